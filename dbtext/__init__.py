@@ -1,10 +1,39 @@
 #!/usr/bin/python
 
-from .wait import PipeReaderThread
-from .mongodb import Mongo_DBText, LocalMongo_DBText
-from .mssql_server import MSSQL_DBText
-from .mysql import MySQL_DBText
-from .postgres import Postgres_DBText
-from .sqlite3db import Sqlite3_DBText
-
-from .base_odbc import DBText
\ No newline at end of file
+import importlib
+
+# Everything is imported on first use, so that "import dbtext" doesn't pay for database drivers that won't be used
+_lazy_names = {
+    "PipeReaderThread": "wait",
+    "Mongo_DBText": "mongodb",
+    "LocalMongo_DBText": "mongodb",
+    "MSSQL_DBText": "mssql_server",
+    "MySQL_DBText": "mysql",
+    "Postgres_DBText": "postgres",
+    "Sqlite3_DBText": "sqlite3db",
+    "DBText": "base_odbc",
+    "DBTextPool": "pool",
+    "SubsetExtractor": "subset",
+    "FixtureRegenerator": "regenerate",
+    "Instrumentation": "instrument",
+    "ConnectionPool": "connections",
+    "TableData": "tabledata"
+}
+
+_submodules = { "aio", "base_odbc", "cleanup", "connections", "db_to_text", "increments", "instrument", "jsonutils", "mongodb",
+                "mssql_server", "mysql", "pool", "postgres", "regenerate", "sqlite3db", "subset", "tabledata", "wait" }
+
+__all__ = list(_lazy_names)
+
+def __getattr__(name):
+    if name in _lazy_names:
+        value = getattr(importlib.import_module("." + _lazy_names[name], __name__), name)
+    elif name in _submodules:
+        value = importlib.import_module("." + name, __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names) | _submodules)
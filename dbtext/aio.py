@@ -0,0 +1,42 @@
+'''
+asyncio support for the blocking database lifecycle calls
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+class AsyncLifecycle:
+    """
+    Mixin that runs the blocking pyodbc/pymongo calls of an instance on a worker thread owned by that instance.
+    Calls on one instance run in the order they were made, while separate instances can be created and dumped
+    concurrently, e.g. with asyncio.gather. The thread is shut down when leaving "async with".
+    """
+    executor = None
+    async def run_blocking(self, method, *args, **kw):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dbtext")
+        # Only imported here, as it is slow to import and anyone awaiting this has already imported it
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(method, *args, **kw))
+    
+    def shutdown_executor(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+            
+    async def adrop(self):
+        return await self.run_blocking(self.drop)
+    
+    async def __aenter__(self):
+        return self
+    
+    def teardown(self):
+        # What leaving "with" or "async with" does, subclasses may put off the drop
+        self.drop()
+
+    async def __aexit__(self, *args):
+        try:
+            await self.run_blocking(self.teardown)
+        finally:
+            self.shutdown_executor()
@@ -5,14 +5,21 @@ Base class for all dbtext instances that use pyodbc
 
 """
 
-import os, sys, filecmp
-import codecs
+import os, sys, filecmp, time
+import codecs, io, hashlib
 import shutil, struct
 from string import Template
 from glob import glob
 from fnmatch import fnmatch
-from . import jsonutils, increments
+from . import jsonutils, increments, cleanup
+from .instrument import null_instrumentation
+from .tabledata import TableData
+from .connections import ConnectionPool
+from .subset import SubsetExtractor
+from .aio import AsyncLifecycle
 from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import json
 import logging
 try:
@@ -21,17 +28,52 @@ except ModuleNotFoundError:
     # gets imported even for MongoDB, which doesn't need it
     pass
 
-class DBText:
+@contextmanager
+def pooled_connection(pool):
+    cxn = pool.acquire()
+    try:
+        with cxn:
+            yield cxn
+    except BaseException:
+        # It may be in a bad state, so don't reuse it
+        pool.close_connection(cxn)
+        raise
+    pool.release(cxn)
+
+class DBText(AsyncLifecycle):
     """
     This is an abstract class - use one of the subclasses specific to your database server.
+    The main lifecycle methods also have async counterparts (acreate, adumptables etc.), see AsyncLifecycle
     """
     connectionStringTemplate = None
     enforceVersion = None
     masterDbName = "master"
-    def __init__(self, database=None, master_connection=None):
+    sqlFileCache = {}
+    # Set parallelExtractWorkers > 1 to fetch tables with a timestamp column and at least parallelExtractMinRows rows
+    # over several connections at once
+    parallelExtractWorkers = 1
+    parallelExtractMinRows = 100000
+    # Up to connectionPoolSize connections to the test database are kept open and reused between calls, set it to 0 to
+    # connect afresh each time. A connection that has been idle for connectionCheckAfter seconds is checked before it is reused.
+    connectionPoolSize = 2
+    connectionCheckAfter = 30.0
+    # Set incrementProcesses > 1 to compare changed table files in that many processes in write_data_increment
+    incrementProcesses = 1
+    def __init__(self, database=None, master_connection=None, deferred_drop=False, fast_load=False, instrumentation=None):
+        """
+        :param deferred_drop: when leaving a "with" statement, queue the database to be dropped by a background thread 
+        (or at the latest when the process exits) instead of waiting for it.
+        :param fast_load: load the tables dir with the server's own bulk loading mechanism, where the subclass has one.
+        :param instrumentation: an instrument.Instrumentation, to collect timings and counts of what dbtext does.
+        """
         self.logger = logging.getLogger("dbtext")
         self.database_name = database
         self.master_connection = master_connection
+        self.deferred_drop = deferred_drop
+        self.fast_load = fast_load
+        self.instrumentation = instrumentation or null_instrumentation
+        self.connection_pool = ConnectionPool(lambda: self.make_connection(self.database_name), self.connectionPoolSize,
+                                              self.connectionCheckAfter, self.check_connection)
         self.maxval = {}
         self.iscreated = master_connection is not None
         self.isconnected = False
@@ -47,8 +89,13 @@ class DBText:
         return ""
         
     def create(self, sqlfile=None, encoding=None, tables_dir=None, **kw):
-        self.create_empty_db(**kw)
-        self.populate_empty_db(sqlfile, tables_dir, encoding)
+        with self.instrumentation.phase("create_empty_db"):
+            self.create_empty_db(**kw)
+        with self.instrumentation.phase("populate_empty_db"):
+            self.populate_empty_db(sqlfile, tables_dir, encoding)
+
+    async def acreate(self, *args, **kw):
+        return await self.run_blocking(self.create, *args, **kw)
 
     def create_empty_db(self, **kw):
         try:
@@ -58,10 +105,17 @@ class DBText:
             self.logger.error(f"Unexpected error for create db {self.database_name}:\n{attachsql}\n%s", e)
             raise
 
+    def copy_database(self, source_name):
+        """
+        Creates this database as a copy of another one on the same server, which is quicker than loading the same data again.
+        Returns False if the server has no quick way to do this, in which case nothing is created.
+        """
+        return False
+
     def populate_empty_db(self, sqlfile, tables_dir=None, encoding=None):
         try:
             self.iscreated = True
-            with self.make_connection(self.database_name) as ttcxn:
+            with self.database_connection() as ttcxn:
                 if sqlfile:
                     if os.path.isfile(sqlfile):
                         self.read_sql_file(ttcxn, sqlfile, encoding)
@@ -80,6 +134,7 @@ class DBText:
             raise
 
     def execute_setup_query(self, ttcxn, currQuery):
+        self.instrumentation.count("round_trips")
         try:
             ttcxn.cursor().execute(currQuery)
         except pyodbc.Error:
@@ -87,30 +142,71 @@ class DBText:
             raise
             
     def read_sql_file(self, ttcxn, sqlfile, encoding=None):
+        with self.instrumentation.phase("parse_sql"):
+            batches = self.parse_sql_file(sqlfile, encoding)
+        self.instrumentation.count("sql_batches", len(batches))
+        with self.instrumentation.phase("run_sql"):
+            self.execute_setup_batches(ttcxn, batches, sqlfile)
+        
+    def execute_setup_batches(self, ttcxn, batches, sqlfile):
+        # Override where the server can safely run several batches in one round trip
+        for lineNumbers, query in batches:
+            self.execute_setup_batch(ttcxn, query, sqlfile, lineNumbers[0])
+            
+    def execute_setup_batch(self, ttcxn, query, sqlfile, lineNumber):
+        try:
+            self.execute_setup_query(ttcxn, query)
+        except Exception:
+            self.logger.error(f"Failed to execute setup query from {sqlfile}, line {lineNumber}")
+            raise
+        
+    @classmethod
+    def parse_sql_file(cls, sqlfile, encoding=None):
+        """
+        Returns the GO-separated batches in the file as a list of (line numbers, query),
+        where the line numbers give the line in the file for each line of the query.
+        Cached by file contents and encoding, so each schema file is only parsed once per process.
+        """
+        with open(sqlfile, "rb") as f:
+            contents = f.read()
+        key = hashlib.sha1(contents).hexdigest(), encoding
+        batches = cls.sqlFileCache.get(key)
+        if batches is None:
+            # TextIOWrapper decodes exactly as open(sqlfile, encoding=encoding) would
+            batches = cls.parse_sql_lines(io.TextIOWrapper(io.BytesIO(contents), encoding=encoding))
+            cls.sqlFileCache[key] = batches
+        return batches
+    
+    @classmethod
+    def parse_sql_lines(cls, lines):
+        batches = []
         currQuery = ''
+        currLines = []
         inComment = False
-        with open(sqlfile, encoding=encoding) as f:
-            for line in f:
-                line = line.strip()
-                if not line or "USE [" in line or line.startswith("--"):
-                    continue
-                if line.startswith("/*"):
-                    inComment = True
-                if inComment:
-                    if line.endswith("*/"):
-                        inComment = False
-                    continue
-               
-                if line in [ "go", "GO" ]:
-                    if currQuery:
-                        self.execute_setup_query(ttcxn, currQuery)
-                        currQuery = ''
-                else:
-                    if currQuery:
-                        currQuery += "\n"
-                    currQuery += line
+        for lineNumber, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line or "USE [" in line or line.startswith("--"):
+                continue
+            if line.startswith("/*"):
+                inComment = True
+            if inComment:
+                if line.endswith("*/"):
+                    inComment = False
+                continue
+           
+            if line in [ "go", "GO" ]:
+                if currQuery:
+                    batches.append((tuple(currLines), currQuery))
+                    currQuery = ''
+                    currLines = []
+            else:
+                if currQuery:
+                    currQuery += "\n"
+                currQuery += line
+                currLines.append(lineNumber)
         if currQuery.strip():
-            self.execute_setup_query(ttcxn, currQuery)
+            batches.append((tuple(currLines), currQuery))
+        return batches
 
     def read_table_files(self, ttcxn, tableFiles, final):
         failedFiles = []
@@ -122,19 +218,42 @@ class DBText:
                 fk_constraint_string = "foreign key constraint"
                 if not final and fk_constraint_string in str(ex).lower():
                     self.logger.debug(f"error when loading data for table {tableFile}: {fk_constraint_string}, will retry this table later")
+                    self.instrumentation.count("fk_retries", table=os.path.basename(tableFile).rsplit(".", 1)[0])
                     failedFiles.append(tableFile)
                 else:
                     raise ex
         return failedFiles
 
+    def get_table_files(self, tables_dir_name):
+        return glob(os.path.join(tables_dir_name, "*.table")) + glob(os.path.join(tables_dir_name, "*.json"))
+
     def read_tables_dir(self, ttcxn, tables_dir_name):
-        tableFiles = glob(os.path.join(tables_dir_name, "*.table")) + glob(os.path.join(tables_dir_name, "*.json"))
+        tableFiles = self.get_table_files(tables_dir_name)
         attempts = 5
         for attempt in range(attempts):
             tableFiles = self.read_table_files(ttcxn, tableFiles, attempt == attempts - 1)
             if len(tableFiles) == 0:
                 return
               
+    def empty_tables(self, ttcxn, table_names):
+        """
+        Deletes all rows of the given tables. Tables whose rows are still referred to from other tables
+        in the list are retried once those have been emptied.
+        """
+        attempts = 5
+        for attempt in range(attempts):
+            failed = []
+            for table_name in table_names:
+                try:
+                    ttcxn.cursor().execute("DELETE FROM " + self.quote(table_name))
+                except Exception:
+                    if attempt == attempts - 1:
+                        raise
+                    failed.append(table_name)
+            table_names = failed
+            if len(table_names) == 0:
+                return
+
     @classmethod
     def expand_value(cls, value, *args):
         if "${" in value:
@@ -146,21 +265,24 @@ class DBText:
 
     @classmethod      
     def parse_table_file(cls, fn):
-        rows = []
+        return list(cls.iterate_table_file(fn))
+
+    @classmethod
+    def iterate_table_file(cls, fn):
+        # Yields each row as a list of (key, value), so large files needn't be held in memory in this form
         currRowData = []
         tablesDir = os.path.dirname(fn) 
         with open(fn) as f:
             for line in f:
                 if line.startswith("ROW"):
                     if currRowData:
-                        rows.append(currRowData)
+                        yield currRowData
                     currRowData = []
                 elif ":" in line:
                     key, value = [ part.strip() for part in line.split(":", 1) ]
                     value = cls.expand_value(value, tablesDir, currRowData)    
                     currRowData.append((key, value))
-        rows.append(currRowData)
-        return rows
+        yield currRowData
     
     @classmethod
     def write_table_file(self, rows, fn, asUpdate=False):
@@ -201,56 +323,90 @@ class DBText:
         else:
             return value
     
+    def parse_json_table_file(self, fn, primaryKeys):
+        with open(fn, "r") as f:
+            json_table_data = json.load(f)
+            ids = [self.evaluate_primary_key(primaryKeys, row_data) for row_data in json_table_data]
+            if len(primaryKeys) == 1 and () in ids:
+                self.logger.info(f"source data file {fn} did not contain primary keys for every record, adding them")
+                for i, row_data in enumerate(json_table_data):
+                    for pk in primaryKeys:
+                        if not pk in row_data:
+                            row_data[pk] = i
+            return json_table_data
+
     def parse_table_file_to_rowdicts(self, fn, primaryKeys):
         if fn.endswith(".json"):
-            with open(fn, "r") as f:
-                json_table_data = json.load(f)
-                ids = [self.evaluate_primary_key(primaryKeys, row_data) for row_data in json_table_data]
-                if len(primaryKeys) == 1 and () in ids:
-                    self.logger.info(f"source data file {fn} did not contain primary keys for every record, adding them")
-                    for i, row_data in enumerate(json_table_data):
-                        for pk in primaryKeys:
-                            if not pk in row_data:
-                                row_data[pk] = i
-                return json_table_data
+            return self.parse_json_table_file(fn, primaryKeys)
         else:
-            tablesDir = os.path.dirname(fn)
-            rows = []
-            for currRowData in self.parse_table_file(fn):
-                currRowDict = {}
-                for key, value in currRowData:
-                    currRowDict[key] = self.parse_row_value(value, currRowDict, tablesDir)
-                rows.append(currRowDict)
-            return rows
+            return self.parse_table_file_to_table_data(fn, primaryKeys).to_dicts()
+
+    def parse_table_file_to_table_data(self, fn, primaryKeys):
+        """
+        As parse_table_file_to_rowdicts, but returns a TableData, which uses much less memory for large tables
+        """
+        if fn.endswith(".json"):
+            return TableData.from_dicts(self.parse_json_table_file(fn, primaryKeys))
+        tablesDir = os.path.dirname(fn)
+        table = TableData()
+        for currRowData in self.iterate_table_file(fn):
+            currRowDict = {}
+            for key, value in currRowData:
+                currRowDict[key] = self.parse_row_value(value, currRowDict, tablesDir)
+            if currRowDict:
+                table.append_dict(currRowDict)
+        return table
         
     def add_table_data_for(self, fn, ttcxn, table_name, pkeys):
-        rowData = self.parse_table_file_to_rowdicts(fn, pkeys)
+        with self.instrumentation.phase("parse_table_file", table_name):
+            rowData = self.parse_table_file_to_table_data(fn, pkeys)
         if len(rowData) > 0:
-            self.insert_rows(ttcxn, table_name, rowData)
+            with self.instrumentation.phase("insert", table_name):
+                self.insert_rows(ttcxn, table_name, rowData)
 
     def add_table_data(self, fn, ttcxn):
         table_name = os.path.basename(fn).rsplit(".", 1)[0]
-        pkeys = self.get_primary_key_columns(ttcxn, table_name)
-        self.add_table_data_for(fn, ttcxn, table_name, pkeys)
+        if self.instrumentation.enabled:
+            self.instrumentation.count("bytes_read", os.path.getsize(fn), table_name)
+        with self.instrumentation.phase("load_table", table_name):
+            pkeys = self.get_primary_key_columns(ttcxn, table_name)
+            self.add_table_data_for(fn, ttcxn, table_name, pkeys)
     
     def insert_rows(self, ttcxn, table_name, rows, identity_insert=False):
         sampleRow = rows[0]
-        valueStr = ("?," * len(sampleRow))[:-1]
-        keys = ", ".join([ self.quote(k) for k in sampleRow ])
-        quoted_table = self.quote(table_name)
+        sql = self.make_insert_sql(self.quote(table_name), [ self.quote(k) for k in sampleRow ], identity_insert)
+        self.insert_row_data(ttcxn, sql, rows, table_name)
+        
+    @classmethod
+    def make_insert_sql(cls, quoted_table, quoted_columns, identity_insert=False):
+        valueStr = ("?," * len(quoted_columns))[:-1]
+        keys = ", ".join(quoted_columns)
         sql = f"INSERT INTO {quoted_table} ({keys}) VALUES ({valueStr})"
         if identity_insert:
-            sql = "SET IDENTITY_INSERT " + quoted_table + " ON; " + sql + "; SET IDENTITY_INSERT " + quoted_table + " OFF"  
-        self.insert_row_data(ttcxn, sql, rows, table_name)
-
-    def insert_row_data(self, ttcxn, sql, rows, table_name):
+            sql = "SET IDENTITY_INSERT " + quoted_table + " ON; " + sql + "; SET IDENTITY_INSERT " + quoted_table + " OFF"
+        return sql
+    
+    def insert_row_data(self, ttcxn, sql, rows, table_name, input_sizes=None, convert_row=None):
+        """
+        :param input_sizes: pyodbc parameter descriptions (sql type, size, decimal digits) for each column.
+        If given, the rows are sent in bulk using pyodbc's fast_executemany.
+        :param convert_row: applied to each row's tuple of values to give the values that are sent
+        """
         try:
-            rowValues = [tuple(row.values()) for row in rows]
-            ttcxn.cursor().executemany(sql, rowValues)
+            cursor = ttcxn.cursor()
+            rowTuples = rows.get_value_tuples() if isinstance(rows, TableData) else [tuple(row.values()) for row in rows]
+            if input_sizes:
+                cursor.fast_executemany = True
+                cursor.setinputsizes(input_sizes)
+            rowValues = [convert_row(row) for row in rowTuples] if convert_row else rowTuples
+            self.instrumentation.count("round_trips")
+            cursor.executemany(sql, rowValues)
+            self.instrumentation.count("rows_inserted", len(rowValues), table_name)
         except pyodbc.DatabaseError as e:
             if "Cannot insert explicit value for identity column" in str(e):
                 self.logger.debug("Error when inserting data: 'Cannot insert explicit value for identity column'. "
                                   "Will retry with IDENTITY_INSERT")
+                self.instrumentation.count("identity_insert_retries", table=table_name)
                 return self.insert_rows(ttcxn, table_name, rows, identity_insert=True)
             elif "foreign key constraint" in str(e).lower():
                 raise
@@ -261,19 +417,22 @@ class DBText:
 
     def update_start_rv(self):
         try:
-            with self.make_connection(self.database_name) as ttcxn:
+            with self.database_connection() as ttcxn:
                 self.readrv(ttcxn)
         except pyodbc.Error as e:
             self.logger.error("Unexpected error for update rv " + self.database_name + ":", e)
             pass
     
+    async def aupdate_start_rv(self):
+        return await self.run_blocking(self.update_start_rv)
+    
     def cursor(self):
         return self.cnxn.cursor()
 
     def query(self, s):
         return self.cursor().execute(s)
 
-    def single(self):
+    def single(self, dbname=None):
         pass # no generic way to do this in sql
 
     def multi(self):
@@ -293,16 +452,78 @@ class DBText:
         return self
     
     def __exit__(self, *args):
-        self.drop()
+        self.teardown()
+
+    def teardown(self):
+        if self.deferred_drop:
+            self.drop_later()
+        else:
+            self.drop()
+            
+    def drop_later(self):
+        cleanup.drop_queue.put(self)
+
+    def database_connection(self):
+        """
+        Returns a context manager giving a connection to the test database, reused from the pool where possible
+        """
+        return pooled_connection(self.connection_pool)
+
+    def check_connection(self, cxn):
+        cxn.cursor().execute("SELECT 1").fetchall()
+
+    def close_connections(self):
+        self.connection_pool.close()
 
     def drop(self):
+        self.close_connections()
         if self.iscreated:
-            self.single()
             try:
-                self.query("DROP DATABASE " + self.database_name + ";")
+                self.drop_database(self.database_name)
                 self.iscreated = False
             except pyodbc.Error as e:
-                self.logger.warning("Unexpected error for drop db " + self.database_name + ":", e)
+                self.logger.warning(f"Unexpected error for drop db {self.database_name}: {e}")
+        self.instrumentation.write_summary()
+                
+    def get_database_names(self):
+        return [] # no generic way to do this in sql
+    
+    def get_database_ages(self):
+        # age in seconds of each database, None if the server can't tell us
+        return { dbname: None for dbname in self.get_database_names() }
+    
+    def drop_stale_databases(self, pattern="db_*", *, max_age, dry_run=False):
+        """
+        Find and drop databases left behind by earlier runs, for example ones that crashed before drop() was called.
+        :param pattern: fnmatch-style pattern for the names of your test databases
+        :param max_age: only drop databases older than this many seconds, so that those of runs still going are left alone.
+        Databases whose age the server can't tell us (only MSSQL and Sqlite3 can) are never dropped.
+        :param dry_run: only log and return the databases that would be dropped
+        :return: a list of (database name, age in seconds) for the databases that were dropped
+        """
+        dropped = []
+        for dbname, age in sorted(self.get_database_ages().items()):
+            if not fnmatch(dbname, pattern) or dbname in [ self.database_name, self.masterDbName ]:
+                continue
+            if age is None or age <= max_age:
+                continue
+            if dry_run:
+                self.logger.info(f"Would drop stale database {dbname} ({age:.0f} seconds old)")
+                dropped.append((dbname, age))
+                continue
+            try:
+                self.drop_database(dbname)
+                self.logger.info(f"Dropped stale database {dbname} ({age:.0f} seconds old)")
+                dropped.append((dbname, age))
+            except Exception as e:
+                self.logger.warning(f"Failed to drop stale database {dbname}: {e}")
+        self.logger.info(f"Found {len(dropped)} stale databases matching {pattern}")
+        return dropped
+    
+    def drop_database(self, dbname):
+        # drop any database by name, using our master connection
+        self.single(dbname)
+        self.query("DROP DATABASE " + dbname + ";")
                
     def get_connection_string(self, driver=True):
         connstr = self.connectionStringTemplate % self.database_name
@@ -320,31 +541,91 @@ class DBText:
     def readrv(self, ttcxn):
         pass # Really an MSSQL concept
         
+    def get_rv_expression(self):
+        return None # Really an MSSQL concept
+
+    def cast_to_text(self, expression):
+        return f"CAST({expression} AS VARCHAR(255))"
+
+    @classmethod
+    def make_text_literal(cls, text):
+        return "'" + text.replace("'", "''") + "'"
+
     def readmax(self):
+        """
+        Reads the watermark for each table in TEXTTEST_DUMPTABLES, given as "table:column:default,...", so that dumptables
+        only dumps rows with a higher value in that column. The default is used if it can't be read.
+        """
         if 'TEXTTEST_DUMPTABLES' not in os.environ:
             return
    
-        dumpnames = os.environ['TEXTTEST_DUMPTABLES'].split(',')
-    
-        ttcnxn = self.make_connection(self.database_name)
-        for descname in dumpnames:
-            descparts = descname.split(':')
-            tabname = descparts[0]
-            maxcolname = descparts[1]
-            notabmax = descparts[2]
+        specs = [ descname.split(':')[:3] for descname in os.environ['TEXTTEST_DUMPTABLES'].split(',') ]
+        with self.database_connection() as ttcnxn:
+            self.read_watermarks(ttcnxn, specs)
+
+    def make_watermark_query(self, tabname, maxcolname):
+        return f"SELECT {self.make_text_literal(tabname)} AS tablename, {self.cast_to_text('MAX(' + maxcolname + ')')} AS maxval FROM {tabname}"
+
+    def read_watermarks(self, ttcnxn, specs):
+        """
+        Reads all the watermarks, and the start rv where there is one, in a single UNION ALL query. If that fails, e.g.
+        because one of the tables doesn't exist, they are read one at a time so each failure can be reported.
+        """
+        queries = [ self.make_watermark_query(tabname, maxcolname) for tabname, maxcolname, _ in specs ]
+        rv_expression = self.get_rv_expression()
+        if rv_expression:
+            queries.append(f"SELECT NULL AS tablename, {rv_expression} AS maxval")
+        try:
+            self.instrumentation.count("round_trips")
+            values = dict(tuple(row) for row in ttcnxn.cursor().execute(" UNION ALL ".join(queries)).fetchall())
+        except Exception as e:
+            self.logger.warning(f"Could not read watermarks in one query, reading them table by table: {e}")
+            values = self.read_watermarks_per_table(ttcnxn, specs)
+            if rv_expression:
+                self.readrv(ttcnxn)
+        else:
+            if rv_expression:
+                self.startrv = values.pop(None)
+        for tabname, maxcolname, notabmax in specs:
+            maxval = values.get(tabname)
+            if maxval is None:
+                self.logger.debug(f"No {maxcolname} watermark for {tabname}, using the default {notabmax!r}")
+                maxval = notabmax
+            self.maxval[tabname] = maxval
+
+    def read_watermarks_per_table(self, ttcnxn, specs):
+        values = {}
+        for tabname, maxcolname, _ in specs:
             try:
-                rows = ttcnxn.cursor().execute('select MAX(' + maxcolname + ') AS maxval FROM ' + tabname).fetchall()
-                self.maxval[tabname] = rows[0].maxval
-            except:
-                self.maxval[tabname] = notabmax
-        ttcnxn.close()
+                self.instrumentation.count("round_trips")
+                rows = ttcnxn.cursor().execute(self.make_watermark_query(tabname, maxcolname)).fetchall()
+                values[tabname] = rows[0][1]
+            except Exception as e:
+                self.logger.warning(f"Could not read watermark {maxcolname} for table {tabname}, using the default: {e}")
+        return values
+
+    def save_watermarks(self, fn):
+        """
+        Writes the start rv and table watermarks to a JSON file, so that a later process can dumptables against them
+        """
+        with open(fn, "w") as f:
+            json.dump({ "startrv": self.startrv, "maxval": self.maxval }, f, indent=2)
+
+    def load_watermarks(self, fn):
+        with open(fn) as f:
+            watermarks = json.load(f)
+        self.startrv = watermarks.get("startrv", self.startrv)
+        self.maxval.update(watermarks.get("maxval", {}))
     
     def convert_from_binary(self, col):
         return col
         
-    def append_to_sql_query(self, column_tuple):
+    def append_to_sql_query(self, column_tuple, qualified=False):
         column_name, column_type = column_tuple
-        quoted_column_name = self.quote(str(column_name))
+        if qualified:
+            quoted_column_name = ".".join(self.quote(part) for part in str(column_name).split(".", 1))
+        else:
+            quoted_column_name = self.quote(str(column_name))
         if column_type in [ "binary", "timestamp" ]:
             return self.convert_from_binary(quoted_column_name)
         else:
@@ -424,21 +705,76 @@ class DBText:
         table_file_pattern = os.path.join(dirName, "${table_name}." + ext)
         return table_file_pattern, blob_patterns
         
-    def write_data_subset(self, writeDir, subset_data):
+    def write_data_subset(self, writeDir, subset_data, keyed_subqueries=False):
+        """
+        Writes the rows selected by subset_data, a list of (tablespec, constraint), as a tables dir.
+        A tablespec can join several tables with commas, e.g. "orders,customers" with a constraint
+        "WHERE orders.customer_id = customers.id AND ...". By default the join is fetched in one query and split up.
+        With keyed_subqueries=True each table in the join is fetched on its own, selecting the rows whose
+        primary key appears in the join via an EXISTS subquery, which avoids repeating the columns of parent tables
+        for every child row.
+        """
         table_file_pattern, blob_patterns = self.make_empty_tables_dir(writeDir)
         table_data = {}
-        with self.make_connection(self.database_name) as ttcxn:
+        seen_rows = {}
+        with self.database_connection() as ttcxn:
             for tablespec, constraint in subset_data:
-                self.logger.info("Getting data for table(s)", repr(tablespec), ",", repr(constraint))
+                self.logger.info(f"Getting data for table(s) {tablespec!r}, {constraint!r}")
+                if keyed_subqueries and "," in tablespec and self.store_keyed_table_data(ttcxn, table_data, tablespec, constraint, seen_rows):
+                    continue
                 rows, colnames = self.extract_data_for_dump(ttcxn, tablespec, constraint)
                 if len(rows) > 0:
-                    self.store_table_data(table_data, tablespec, rows, colnames)
+                    self.store_table_data(table_data, tablespec, rows, colnames, seen_rows)
         for tablename, (rows, colnames) in table_data.items():
             self.write_dump_data(rows, colnames, tablename, table_file_pattern, blob_patterns)
-            
-    def store_table_data(self, table_data, tablespec, rows, colnames):
+
+    def get_subset_key_columns(self, ttcxn, tablename):
+        return self.get_primary_key_columns(ttcxn, tablename)
+
+    def make_keyed_constraint(self, tablename, key_columns, tablespec, constraint):
+        condition = constraint.strip()
+        if condition[:5].upper() == "WHERE":
+            condition = condition[5:].strip()
+        key_match = " AND ".join(f"{self.quote(tablename)}.{self.quote(col)} = dbtext_outer.{self.quote(col)}" for col in key_columns)
+        if condition:
+            key_match = f"({condition}) AND {key_match}"
+        from_clause = ", ".join(self.quote(name) for name in tablespec.split(","))
+        # extract_data_for_dump puts the constraint straight after the table name, so it can alias the table too
+        return f"dbtext_outer WHERE EXISTS (SELECT 1 FROM {from_clause} WHERE {key_match})"
+
+    def store_keyed_table_data(self, ttcxn, table_data, tablespec, constraint, seen_rows):
+        table_names = tablespec.split(",")
+        key_columns = [ self.get_subset_key_columns(ttcxn, tablename) for tablename in table_names ]
+        if not all(key_columns):
+            self.logger.debug(f"Not all tables in {tablespec!r} have primary keys, fetching them with a join")
+            return False
+        for tablename, keys in zip(table_names, key_columns):
+            keyed_constraint = self.make_keyed_constraint(tablename, keys, tablespec, constraint)
+            rows, colnames = self.extract_data_for_dump(ttcxn, tablename, keyed_constraint)
+            if len(rows) > 0:
+                self.add_unique_rows(table_data, tablename, map(tuple, rows), colnames, seen_rows)
+        return True
+
+    def add_unique_rows(self, table_data, tablename, rows, colnames, seen_rows):
+        if tablename in table_data:
+            tablerows, _ = table_data.get(tablename)
+        else:
+            tablerows = []
+            table_data[tablename] = tablerows, colnames
+        seen = seen_rows.get(tablename)
+        if seen is None:
+            seen = seen_rows[tablename] = set(tablerows)
+        for row in rows:
+            if row not in seen:
+                seen.add(row)
+                tablerows.append(row)
+
+    def store_table_data(self, table_data, tablespec, rows, colnames, seen_rows=None):
+        if seen_rows is None:
+            seen_rows = {}
         if "," not in tablespec:
-            table_data[tablespec] = list(map(tuple, rows)), colnames 
+            table_data[tablespec] = list(map(tuple, rows)), colnames
+            seen_rows.pop(tablespec, None)
             return
                 
         for tablename in tablespec.split(","):
@@ -449,17 +785,10 @@ class DBText:
                 if currtable == tablename:
                     tablecolnames.append((colname, coltype))
                     tablecolindices.append(ix)
-            if tablename in table_data:
-                tablerows, _ = table_data.get(tablename)
-            else:
-                tablerows = []
-                table_data[tablename] = tablerows, tablecolnames
             firstcol = min(tablecolindices)
             lastcol = max(tablecolindices)
-            for row in rows:
-                newRow = row[firstcol:lastcol + 1]
-                if newRow not in tablerows:
-                    tablerows.append(newRow)
+            tablerows = (tuple(row[firstcol:lastcol + 1]) for row in rows)
+            self.add_unique_rows(table_data, tablename, tablerows, tablecolnames, seen_rows)
                     
     def write_all_tables(self, table_file_pattern, blob_pattern, ttcxn, exclude=""):
         for tablename in self.expand_table_names(ttcxn, "*", exclude):
@@ -471,12 +800,39 @@ class DBText:
         if use_master_connection:
             self.write_all_tables(table_file_pattern, blob_pattern, self.master_connection, **kw)
         else:
-            with self.make_connection(self.database_name) as ttcxn:
+            with self.database_connection() as ttcxn:
                 self.write_all_tables(table_file_pattern, blob_pattern, ttcxn, **kw)
 
+    async def awrite_data(self, *args, **kw):
+        return await self.run_blocking(self.write_data, *args, **kw)
+
     def get_table_names(self, ttcxn):
         cursor = ttcxn.cursor()
         return [ row.table_name for row in cursor.tables(tableType="TABLE", catalog=self.database_name) ]
+
+    def get_foreign_keys(self, ttcxn):
+        """
+        Returns a list of (child table, child columns, parent table, parent columns) for all foreign keys in the database
+        """
+        fkeys = {}
+        for table_name in self.get_table_names(ttcxn):
+            for info in ttcxn.cursor().foreignKeys(foreignTable=table_name):
+                key = (info.fktable_name, info.fk_name or info.pktable_name)
+                fkeys.setdefault(key, []).append(info)
+        result = []
+        for infos in fkeys.values():
+            infos.sort(key=lambda info: info.key_seq)
+            result.append((infos[0].fktable_name, tuple(info.fkcolumn_name for info in infos),
+                           infos[0].pktable_name, tuple(info.pkcolumn_name for info in infos)))
+        return result
+
+    def extract_subset(self, writeDir, roots, **kw):
+        """
+        Writes a referentially complete subset of the database as a tables dir, starting from the rows selected by roots,
+        a list of (table name, constraint), and following foreign keys. See SubsetExtractor for the keyword arguments.
+        Returns a dictionary of table name to the number of rows written.
+        """
+        return SubsetExtractor(self, **kw).extract(writeDir, roots)
     
     def in_exclude_patterns(self, tn, patterns):
         return any((fnmatch(tn, pattern) for pattern in patterns))
@@ -504,7 +860,7 @@ class DBText:
             self.logger.info(f"unable to dump tables for {self.database_name}, it is not created yet.")
             return
         dumpwholenames = dumpwholenamestr.split(',')
-        with self.make_connection(self.database_name) as ttcxn:
+        with self.database_connection() as ttcxn:
             for descname in self.expand_table_names(ttcxn, table_str, exclude):
                 descparts = descname.split(':')
                 tablename = descparts[0]
@@ -519,7 +875,11 @@ class DBText:
                 self.logger.debug(f"dumping table {tablename}")
                 self.dumptable(ttcxn, tablename, constraint, table_fn_pattern, blob_patterns, dumpableBlobs)
                 
+    async def adumptables(self, *args, **kw):
+        return await self.run_blocking(self.dumptables, *args, **kw)
+                
     def get_primary_key_columns(self, ttcxn, tableName):
+        self.instrumentation.count("catalog_queries")
         # Sqlite3 cursor doesn't have 'primaryKeys' attribute
         if hasattr(ttcxn.cursor(), "primaryKeys"):
             return tuple([ info[3] for info in ttcxn.cursor().primaryKeys(tableName) ])
@@ -528,22 +888,39 @@ class DBText:
     def evaluate_primary_key(self, pkeys, row_data):
         return tuple(row_data[key] for key in pkeys if key in row_data)
 
+    @classmethod
+    def make_row_key(cls, row):
+        try:
+            return frozenset(row.items())
+        except TypeError: # e.g. lists in JSON data
+            return None
+
     def categorise(self, data1, data2, pkeys):
         created, updated, deleted = [], [], []
         
         ids1 = set([ self.evaluate_primary_key(pkeys, row_data) for row_data in data1 ])
         ids2 = set([ self.evaluate_primary_key(pkeys, row_data) for row_data in data2 ])
+        # Rows are compared by hashing their items, rather than searching data1 for each row
+        rowKeys1 = set()
+        unhashableRows1 = []
         for row in data1:
             val = self.evaluate_primary_key(pkeys, row)
             if val not in ids2:
-                deleted.append(row)
+                deleted.append(dict(row))
+            rowKey = self.make_row_key(row)
+            if rowKey is None:
+                unhashableRows1.append(row)
+            else:
+                rowKeys1.add(rowKey)
         for row in data2:
             val = self.evaluate_primary_key(pkeys, row)
             if val in ids1:
-                if row not in data1:
-                    updated.append(row)
+                rowKey = self.make_row_key(row)
+                unchanged = rowKey in rowKeys1 if rowKey is not None else row in unhashableRows1
+                if not unchanged:
+                    updated.append(dict(row))
             else:
-                created.append(row)
+                created.append(dict(row))
         return created, updated, deleted
     
     def dump_change_file(self, fn_template, change_type, new_data):
@@ -563,6 +940,10 @@ class DBText:
         
         return table_data
 
+    def convert_to_table_data(self, rows, colinfo):
+        return TableData([ col[0] for col in colinfo ],
+                         [ tuple(value.isoformat() if isinstance(value, (datetime, date)) else value for value in row) for row in rows ])
+
     def dumpchanges(self, table_fn_pattern, tables_dir=None, exclude=""):
         if not self.iscreated:
             self.logger.info(f"unable to dump tables for {self.database_name}, it is not created yet.")
@@ -570,15 +951,16 @@ class DBText:
         tables_dir = tables_dir or self.get_tables_dir_name()
         self.logger.info(f"will dump changes compared with tables_dir {tables_dir}")
         created, updated, deleted = {}, {}, {}
-        with self.make_connection(self.database_name) as ttcxn:
+        with self.database_connection() as ttcxn:
             for tableName in self.expand_table_names(ttcxn, "*", exclude):
                 self.logger.debug(f"examining changes in table {tableName}")
                 rows, colinfo = self.extract_data_for_dump(ttcxn, tableName, "")
                 tableFile = os.path.join(tables_dir, tableName + ".json") # TODO: make this also work with rowdata in other format
                 pkeys = self.get_primary_key_columns(ttcxn, tableName)
-                initial_table_data = self.parse_table_file_to_rowdicts(tableFile, pkeys) if os.path.isfile(tableFile) else []
-                final_table_data = self.convert_to_row_dicts(rows, colinfo)
-                c, u, d = self.categorise(initial_table_data, final_table_data, pkeys)
+                with self.instrumentation.phase("compare", tableName):
+                    initial_table_data = self.parse_table_file_to_table_data(tableFile, pkeys) if os.path.isfile(tableFile) else []
+                    final_table_data = self.convert_to_table_data(rows, colinfo)
+                    c, u, d = self.categorise(initial_table_data, final_table_data, pkeys)
                 if c:
                     created[tableName] = c
                 if u:
@@ -589,6 +971,9 @@ class DBText:
         self.dump_change_file(table_fn_pattern, "updated", updated)
         self.dump_change_file(table_fn_pattern, "deleted", deleted)        
         
+    async def adumpchanges(self, *args, **kw):
+        return await self.run_blocking(self.dumpchanges, *args, **kw)
+        
     def get_column_names_for_spec(self, ttcxn, tablespec):
         if "," in tablespec:
             colnames = []
@@ -611,6 +996,7 @@ class DBText:
                 return i
     
     def get_column_names(self, ttcxn, tablename):
+        self.instrumentation.count("catalog_queries")
         cols = self.query_for_columns(ttcxn, tablename)
         colnames = []
         timestampcol = None 
@@ -635,16 +1021,35 @@ class DBText:
     def quote(self, tablespec):
         return '"' + tablespec + '"'
      
-    def extract_data_for_dump(self, ttcxn, tablespec, constraint=""):
+    def prepare_extract_connection(self, ttcxn):
+        pass
+
+    def make_dump_query(self, tablespec, colnames, constraint, usemaxcol):
+        joined = "," in tablespec
+        select_values = [ self.append_to_sql_query(col, joined) for col in colnames ]
+        from_clause = ", ".join(self.quote(name) for name in tablespec.split(","))
+        sqltext = 'SELECT '+ ",".join(select_values) + ' from ' + from_clause + ' ' + constraint
+        if usemaxcol:
+            sqltext += ' ORDER BY ' + usemaxcol
+        return sqltext
+
+    def extract_data_for_dump(self, ttcxn, tablespec, constraint="", params=()):
+        self.prepare_extract_connection(ttcxn)
         colnames, usemaxcol = self.get_column_names_for_spec(ttcxn, tablespec)
         if len(colnames) == 0:
             return [], []
-        select_values = [ self.append_to_sql_query(col) for col in colnames ]
-        sqltext = 'SELECT '+ ",".join(select_values) + ' from ' + self.quote(tablespec) + ' ' + constraint
-        if usemaxcol:
-            sqltext += ' ORDER BY ' + usemaxcol
+        if self.parallelExtractWorkers > 1 and "," not in tablespec and not params and ttcxn is not self.master_connection:
+            with self.instrumentation.phase("fetch", tablespec):
+                rows = self.extract_partitioned(ttcxn, tablespec, colnames, constraint, usemaxcol)
+            if rows is not None:
+                self.instrumentation.count("rows_fetched", len(rows), tablespec)
+                return rows, colnames
+        sqltext = self.make_dump_query(tablespec, colnames, constraint, usemaxcol)
         try:
-            rows = ttcxn.cursor().execute(sqltext).fetchall()
+            self.instrumentation.count("round_trips")
+            with self.instrumentation.phase("fetch", tablespec):
+                rows = ttcxn.cursor().execute(sqltext, params).fetchall()
+            self.instrumentation.count("rows_fetched", len(rows), tablespec)
         except pyodbc.DatabaseError as e:
             if "Invalid column name 'rv'" in str(e):
                 # Table has no rv, dump the constraint and assume the whole table is relevant
@@ -655,7 +1060,56 @@ class DBText:
                 return [], colnames
         
         return rows, colnames
-     
+
+    def get_partition_boundaries(self, ttcxn, tablename, constraint, partition_col):
+        from_clause = self.quote(tablename) + ' ' + constraint
+        row_count = ttcxn.cursor().execute('SELECT COUNT(*) from ' + from_clause).fetchone()[0]
+        if row_count < self.parallelExtractMinRows:
+            return []
+        step = -(-row_count // self.parallelExtractWorkers)
+        sqltext = f'SELECT {partition_col} from (SELECT {partition_col}, ROW_NUMBER() OVER (ORDER BY {partition_col}) AS dbtext_rn from ' + \
+            f'{from_clause}) dbtext_sample WHERE dbtext_rn % {step} = 1 AND dbtext_rn > 1 ORDER BY {partition_col}'
+        return [ row[0] for row in ttcxn.cursor().execute(sqltext).fetchall() ]
+
+    def make_partition_constraints(self, constraint, partition_col, boundaries):
+        # The constraint may contain OR, so it has to be kept apart from the range
+        prefix = 'WHERE (' + constraint.strip()[len("WHERE"):].strip() + ') AND ' if constraint else 'WHERE '
+        constraints = [ (prefix + f'{partition_col} < ?', [ boundaries[0] ]) ]
+        for lower, upper in zip(boundaries, boundaries[1:]):
+            constraints.append((prefix + f'{partition_col} >= ? AND {partition_col} < ?', [ lower, upper ]))
+        constraints.append((prefix + f'{partition_col} >= ?', [ boundaries[-1] ]))
+        return constraints
+
+    def fetch_partition(self, sqltext, params):
+        with self.database_connection() as cxn:
+            self.prepare_extract_connection(cxn)
+            return cxn.cursor().execute(sqltext, params).fetchall()
+
+    def extract_partitioned(self, ttcxn, tablename, colnames, constraint, usemaxcol):
+        """
+        Fetches a large table as parallelExtractWorkers key ranges over separate connections, and joins them up in order.
+        Returns None if the table is too small or can't be partitioned, in which case it is fetched with one query as usual.
+        Only tables ordered by a timestamp column are partitioned, on that column, so the rows come out in the same order
+        as from one query.
+        """
+        if not usemaxcol or (constraint and not constraint.strip().upper().startswith("WHERE")):
+            return None
+        try:
+            boundaries = self.get_partition_boundaries(ttcxn, tablename, constraint, usemaxcol)
+            if not boundaries:
+                return None
+            start = time.monotonic()
+            queries = [ (self.make_dump_query(tablename, colnames, partition_constraint, usemaxcol), params)
+                        for partition_constraint, params in self.make_partition_constraints(constraint, usemaxcol, boundaries) ]
+            with ThreadPoolExecutor(max_workers=self.parallelExtractWorkers, thread_name_prefix="dbtext-extract") as executor:
+                parts = list(executor.map(lambda query: self.fetch_partition(*query), queries))
+        except Exception as e:
+            self.logger.warning(f"Could not fetch {tablename} in parallel, fetching it with one query instead: {e}")
+            return None
+        rows = [ row for part in parts for row in part ]
+        self.logger.debug(f"Fetched {len(rows)} rows from {tablename} in {len(parts)} ranges in {time.monotonic() - start:.2f} seconds")
+        return rows
+
     def dumptable(self, ttcxn, tablename, constraint, table_fn_pattern, blob_pattern, dumpableBlobs=True):
         rows, colnames = self.extract_data_for_dump(ttcxn, tablename, constraint) 
         if len(rows) > 0:
@@ -668,10 +1122,15 @@ class DBText:
         
     def write_dump_data(self, rows, colnames, tablename, table_fn_pattern, blob_patterns, dumpableBlobs=True):
         fileName = Template(table_fn_pattern).substitute(table_name=tablename)
-        if fileName.endswith(".json"):
-            self.write_json_dump(rows, colnames, fileName)
-        else:
-            self.write_tableformat_dump(rows, colnames, fileName, blob_patterns, dumpableBlobs)
+        if self.instrumentation.enabled:
+            sizeBefore = os.path.getsize(fileName) if os.path.isfile(fileName) else 0
+        with self.instrumentation.phase("write_file", tablename):
+            if fileName.endswith(".json"):
+                self.write_json_dump(rows, colnames, fileName)
+            else:
+                self.write_tableformat_dump(rows, colnames, fileName, blob_patterns, dumpableBlobs)
+        if self.instrumentation.enabled:
+            self.instrumentation.count("bytes_written", os.path.getsize(fileName) - sizeBefore, tablename)
             
     def write_tableformat_dump(self, rows, colnames, fileName, blob_patterns, dumpableBlobs):
         with codecs.open(fileName, mode='a', encoding='cp1252', errors='replace') as f:
@@ -721,8 +1180,9 @@ class DBText:
             shutil.move(fullDir, origDir)
         self.write_data(writeDir) # should write to "fullDir"
         converter = self.get_increment_converter()
-        converter.convert_to_increment(fullDir, origDir)
+        with self.instrumentation.phase("increment"):
+            converter.convert_to_increment(fullDir, origDir)
         
     def get_increment_converter(self):
-        return increments.IncrementConverter(self.parse_table_file)
+        return increments.IncrementConverter(self.parse_table_file, processes=self.incrementProcesses)
         
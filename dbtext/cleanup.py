@@ -0,0 +1,41 @@
+'''
+Dropping test databases outside the critical path of the test
+'''
+
+import atexit, logging
+from queue import Queue
+from threading import Thread, Lock
+
+class DropQueue:
+    """
+    Drops databases one at a time on a background thread. 
+    Anything still queued when the process exits is dropped before it does so.
+    """
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+        self.lock = Lock()
+        
+    def put(self, db):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+                atexit.register(self.join)
+        self.queue.put(db)
+        
+    def run(self):
+        while True:
+            db = self.queue.get()
+            try:
+                db.drop()
+            except Exception as e:
+                logging.getLogger("dbtext").warning(f"Failed to drop database {db.database_name} in the background: {e}")
+            finally:
+                self.queue.task_done()
+                
+    def join(self):
+        self.queue.join()
+
+
+drop_queue = DropQueue()
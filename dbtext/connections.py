@@ -0,0 +1,62 @@
+'''
+Keeps connections to a test database open between calls, as connecting can be slow on networked servers
+'''
+
+import time
+import logging
+from threading import Lock
+
+class ConnectionPool:
+    """
+    Hands out idle connections when there are any and opens new ones when there aren't. Up to "size" connections
+    are kept open when they're given back. A connection that has been idle for longer than "check_after" seconds is
+    checked with check_connection before it is reused, and replaced if that fails.
+    """
+    def __init__(self, connect, size=2, check_after=30.0, check_connection=None):
+        self.logger = logging.getLogger("dbtext")
+        self.connect = connect
+        self.size = size
+        self.check_after = check_after
+        self.check_connection = check_connection
+        self.idle = [] # (time it was given back, connection)
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                lastUsed, cxn = self.idle.pop()
+            if self.is_usable(cxn, lastUsed):
+                return cxn
+            self.close_connection(cxn)
+        return self.connect()
+
+    def is_usable(self, cxn, lastUsed):
+        if self.check_connection is None or time.monotonic() - lastUsed < self.check_after:
+            return True
+        try:
+            self.check_connection(cxn)
+            return True
+        except Exception as e:
+            self.logger.debug(f"Idle connection failed its health check, opening a new one: {e}")
+            return False
+
+    def release(self, cxn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((time.monotonic(), cxn))
+                return
+        self.close_connection(cxn)
+
+    def close_connection(self, cxn):
+        try:
+            cxn.close()
+        except Exception as e:
+            self.logger.debug(f"Failed to close connection: {e}")
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for _, cxn in idle:
+            self.close_connection(cxn)
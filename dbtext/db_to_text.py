@@ -1,6 +1,16 @@
+'''
+Moving data between pandas DataFrames (or Arrow tables) and the dbtext file formats.
+pandas and pyarrow are only imported when they are used.
+'''
 
-import os
+import os, json, codecs
+import logging
+from datetime import datetime, date
+from glob import glob
+from . import jsonutils
 
+# Rows are written in chunks of this many, so the text of a large DataFrame isn't all held in memory at once
+write_chunk_rows = 10000
 
 def dump_dataframe_as_json(df, tablename, folder="db_tables", prefix=""):
     """Dump a pandas dataframe in json format suitable to use with dbtext"""
@@ -10,8 +20,239 @@ def dump_dataframe_as_json(df, tablename, folder="db_tables", prefix=""):
 
 def dump_dataframe_as_rowdata(df, tablename, ext="table", prefix=""):
     """Dump a pandas dataframe in dbtext format"""
+    prefixes = [ f"    {field}: " for field in df.columns ]
     with open(f"{prefix}{tablename}.{ext}", "w") as f:
-        for i, tup in enumerate(df.itertuples(index=False)):
-            print(f"ROW:{i}", file=f)
-            for field in tup._fields:
-                print(f"    {field}: {getattr(tup, field)}", file=f)
+        for start, columns in iterate_column_chunks(df):
+            column_lines = [ [ fieldPrefix + text + "\n" for text in format_column(col) ] for fieldPrefix, col in zip(prefixes, columns) ]
+            write_rows(f, start, column_lines, "\n")
+
+
+def iterate_column_chunks(df):
+    for start in range(0, len(df), write_chunk_rows):
+        chunk = df.iloc[start:start + write_chunk_rows]
+        yield start, [ chunk.iloc[:, ci] for ci in range(len(df.columns)) ]
+
+
+def write_rows(f, start, column_lines, linesep):
+    f.write("".join(f"ROW:{start + i}{linesep}" + "".join(lines) for i, lines in enumerate(zip(*column_lines))))
+
+
+def format_datetime_column(series, unit, separator):
+    # numpy formats a whole column at once, which is much faster than formatting each Timestamp. Returns None if it
+    # can't give the same text as the Timestamps would, i.e. with time zones or nanoseconds
+    import numpy as np
+    if not isinstance(series.dtype, np.dtype) or series.dtype.kind != "M":
+        return None
+    values = series.to_numpy().astype("datetime64[ns]")
+    nanos = values.view("int64")
+    valid = ~np.isnat(values)
+    if (nanos[valid] % 1000).any():
+        return None
+    text = np.datetime_as_string(values, unit="s").astype(object)
+    if unit == "us":
+        fractional = valid & (nanos % 1000000000 != 0)
+        text[fractional] = np.datetime_as_string(values[fractional], unit="us")
+    if separator != "T":
+        return [ t if t == "NaT" else t[:10] + separator + t[11:] for t in text.tolist() ]
+    return text.tolist()
+
+
+def format_column(series):
+    # str() of each value, as when iterating over the rows
+    return format_datetime_column(series, "us", " ") or [ str(value) for value in series.tolist() ]
+
+
+def format_table_column(series, coltype):
+    # As DBText.get_row_data_based_on_type, with missing values in the DataFrame written as the database's NULL would be
+    nulls = series.isna().tolist()
+    if coltype in [ "image", "varbinary" ]:
+        return [ "None" if isnull else "<blob data>" for isnull in nulls ]
+    elif coltype == "datetime":
+        text = format_datetime_column(series, "s", " ") or [ None if isnull else value.strftime("%Y-%m-%d %H:%M:%S") for value, isnull in zip(series.tolist(), nulls) ]
+    else:
+        text = format_column(series)
+    return [ "None" if isnull else value for value, isnull in zip(text, nulls) ]
+
+
+def write_tableformat_dump(df, fileName, colinfo=None):
+    """
+    Writes a DataFrame exactly as DBText.write_tableformat_dump writes the same rows, i.e. as a .table file in a tables dir.
+    colinfo is a list of (column name, type name) as from DBText.get_column_names, to choose and order the columns
+    and format the values as for that type. Blob files are not written.
+    """
+    colinfo = colinfo or [ (col, "") for col in df.columns ]
+    df = df[[ colname for colname, _ in colinfo ]]
+    prefixes = [ f"   {colname}: " for colname, _ in colinfo ]
+    with codecs.open(fileName, mode='w', encoding='cp1252', errors='replace') as f:
+        for start, columns in iterate_column_chunks(df):
+            column_lines = [ [ fieldPrefix + text + os.linesep for text in format_table_column(col, coltype) ]
+                             for fieldPrefix, (_, coltype), col in zip(prefixes, colinfo, columns) ]
+            write_rows(f, start, column_lines, os.linesep)
+
+
+def get_json_values(series):
+    # As DBText.convert_to_row_dicts
+    nulls = series.isna().tolist()
+    values = format_datetime_column(series, "us", "T") or series.tolist()
+    return [ None if isnull else (value.isoformat() if isinstance(value, (datetime, date)) else value) for value, isnull in zip(values, nulls) ]
+
+
+def encode_json_column(series, encode):
+    import numpy as np
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in "iu":
+        return [ str(value) for value in series.tolist() ]
+    return [ encode(value) for value in get_json_values(series) ]
+
+
+def has_nested_values(df):
+    return any(isinstance(value, (list, tuple, dict)) for col in df.columns if df[col].dtype == object for value in df[col].tolist())
+
+
+def write_json_dump(df, fileName):
+    """
+    Writes a DataFrame exactly as DBText.write_json_dump writes the same rows, i.e. as a .json file in a tables dir
+    """
+    if len(df) == 0 or len(df.columns) == 0 or has_nested_values(df):
+        # Nothing to gain from doing it ourselves, or nested values that json must indent
+        rows = [ dict(zip(df.columns, row)) for _, columns in iterate_column_chunks(df) for row in zip(*map(get_json_values, columns)) ]
+        if len(df.columns) == 0:
+            rows = [ {} for _ in range(len(df)) ]
+        with open(fileName, "w") as f:
+            jsonutils.dump_json_table(f, rows)
+        return
+    # Lay it out as json.dumps(rows, indent=2) would, but encode a column at a time
+    encode = json.JSONEncoder(default=jsonutils.json_serial).encode
+    prefixes = [ "    " + json.dumps(str(col)) + ": " for col in df.columns ]
+    with open(fileName, "w") as f:
+        f.write("[\n")
+        for start, columns in iterate_column_chunks(df):
+            column_items = [ [ keyPrefix + text for text in encode_json_column(col, encode) ] for keyPrefix, col in zip(prefixes, columns) ]
+            if start:
+                f.write(",\n")
+            f.write(",\n".join("  {\n" + ",\n".join(items) + "\n  }" for items in zip(*column_items)))
+        f.write("\n]\n")
+
+
+def read_table_file_columns(fn):
+    """
+    Reads a .table or .json file from a tables dir, returning the column names and a list of values for each.
+    Values from .table files are strings, or None for "None", with the same substitutions as when loading the database.
+    """
+    columns = {}
+    rowCount = 0
+    if fn.endswith(".json"):
+        with open(fn) as f:
+            rows = json.load(f)
+    else:
+        from .base_odbc import DBText
+        rows = ( { colname: None if value == "None" else value for colname, value in row } for row in DBText.iterate_table_file(fn) if row )
+    for row in rows:
+        for colname, value in row.items():
+            if colname not in columns:
+                columns[colname] = [ None ] * rowCount
+            columns[colname].append(value)
+        rowCount += 1
+        for values in columns.values():
+            if len(values) < rowCount:
+                values.append(None)
+    return list(columns), columns
+
+
+def get_type_kind(type_name):
+    type_name = type_name.lower()
+    if type_name in [ "bit", "bool", "boolean" ]:
+        return "bool"
+    elif "int" in type_name:
+        return "int"
+    elif any(part in type_name for part in [ "float", "real", "double", "decimal", "numeric", "money" ]):
+        return "float"
+    elif type_name.startswith("date") or (type_name.startswith("timestamp") and type_name != "timestamp"):
+        # plain "timestamp" is a row version on MSSQL
+        return "datetime"
+
+
+def get_column_kinds(db, table_names):
+    if db is None:
+        return {}
+    kinds = {}
+    with db.database_connection() as ttcxn:
+        for table_name in table_names:
+            colinfo, _ = db.get_column_names(ttcxn, table_name)
+            kinds[table_name] = { colname: get_type_kind(coltype) for colname, coltype in colinfo }
+    return kinds
+
+
+def get_table_files(tables_dir):
+    return sorted(glob(os.path.join(tables_dir, "*.table")) + glob(os.path.join(tables_dir, "*.json")))
+
+
+def get_table_name(fn):
+    return os.path.basename(fn).rsplit(".", 1)[0]
+
+
+def to_pandas_column(values, kind):
+    import pandas as pd
+    if kind is None:
+        return pd.Series(values)
+    series = pd.Series(values, dtype=object)
+    try:
+        if kind == "int":
+            return pd.to_numeric(series).astype("Int64")
+        elif kind == "float":
+            return pd.to_numeric(series).astype("Float64")
+        elif kind == "bool":
+            return series.map(lambda v: v if v is None or isinstance(v, bool) else str(v) in [ "True", "true", "1" ]).astype("boolean")
+        elif kind == "datetime":
+            try:
+                # Fractional seconds may be given for some values and not others
+                return pd.to_datetime(series, format="ISO8601")
+            except ValueError: # pandas before 2.0
+                return pd.to_datetime(series)
+    except (ValueError, TypeError) as e:
+        logging.getLogger("dbtext").debug(f"Could not convert column to {kind}, leaving it as text: {e}")
+    return series
+
+
+def read_tables_dir_as_dataframes(tables_dir, db=None):
+    """
+    Reads every table in a tables dir into a pandas DataFrame, returning a dictionary of table name to DataFrame.
+    With a DBText "db" whose database has the tables, columns get the types the schema gives them, otherwise they are text.
+    """
+    import pandas as pd
+    table_files = get_table_files(tables_dir)
+    kinds = get_column_kinds(db, [ get_table_name(fn) for fn in table_files ])
+    dataframes = {}
+    for fn in table_files:
+        table_name = get_table_name(fn)
+        colnames, columns = read_table_file_columns(fn)
+        table_kinds = kinds.get(table_name, {})
+        dataframes[table_name] = pd.DataFrame({ colname: to_pandas_column(columns[colname], table_kinds.get(colname)) for colname in colnames })
+    return dataframes
+
+
+def to_arrow_column(values, kind):
+    import pyarrow as pa
+    array = pa.array(values)
+    target_types = { "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(), "datetime": pa.timestamp("us") }
+    if kind in target_types and array.type != target_types[kind]:
+        try:
+            return array.cast(target_types[kind])
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            logging.getLogger("dbtext").debug(f"Could not convert column to {kind}, leaving it as text: {e}")
+    return array
+
+
+def read_tables_dir_as_arrow(tables_dir, db=None):
+    """
+    As read_tables_dir_as_dataframes, but returns pyarrow Tables
+    """
+    import pyarrow as pa
+    table_files = get_table_files(tables_dir)
+    kinds = get_column_kinds(db, [ get_table_name(fn) for fn in table_files ])
+    tables = {}
+    for fn in table_files:
+        table_name = get_table_name(fn)
+        colnames, columns = read_table_file_columns(fn)
+        table_kinds = kinds.get(table_name, {})
+        tables[table_name] = pa.table({ colname: to_arrow_column(columns[colname], table_kinds.get(colname)) for colname in colnames })
+    return tables
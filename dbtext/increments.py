@@ -1,10 +1,19 @@
 
 import os, shutil, filecmp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import json
+import logging
+import pickle
 
 class IncrementConverter:
-    def __init__(self, parse_table_file=None):
+    """
+    :param processes: compare the changed table files in this many worker processes. The converter (and parse_table_file)
+    must then be picklable, otherwise it falls back to comparing them in this process.
+    """
+    def __init__(self, parse_table_file=None, processes=1):
         self.parse_table_file = parse_table_file
+        self.processes = processes
     
     def convert_to_increment(self, fullDir, origDir):
         shutil.copytree(fullDir, fullDir + "_prereduce")
@@ -19,6 +28,42 @@ class IncrementConverter:
             if len(unmatched_keys) == 0:
                 return newRow
 
+    @classmethod
+    def make_match_key(cls, row, discard):
+        return frozenset(item for item in row if item[0] not in discard)
+
+    def match_rows(self, origRows, newRows):
+        """
+        Pairs each original row with the first matching new row, as find_matching_row does.
+        Returns the new rows that were not matched and the original rows that were not matched.
+        """
+        discard = self.get_field_names_to_ignore()
+        if type(self).find_matching_row is not IncrementConverter.find_matching_row:
+            # Custom matching, so we have to try every row
+            unmatched = []
+            for row in origRows:
+                newRow = self.find_matching_row(row, newRows, discard)
+                if newRow:
+                    newRows.remove(newRow)
+                else:
+                    unmatched.append(row)
+            return newRows, unmatched
+
+        # Rows match if they have the same items apart from the ignored fields, so we can look them up by those
+        discardKeySet = set(discard)
+        candidates = {}
+        for ix, newRow in enumerate(newRows):
+            candidates.setdefault(self.make_match_key(newRow, discardKeySet), deque()).append(ix)
+        matched = set()
+        unmatched = []
+        for row in origRows:
+            rowCandidates = candidates.get(self.make_match_key(row, discardKeySet))
+            if rowCandidates and newRows[rowCandidates[0]]:
+                matched.add(rowCandidates.popleft())
+            else:
+                unmatched.append(row)
+        return [ newRow for ix, newRow in enumerate(newRows) if ix not in matched ], unmatched
+
     def get_field_names_to_ignore(self):
         return []
     
@@ -41,25 +86,51 @@ class IncrementConverter:
         
         toReduce = []
         renameCheck = []
-        for origFile, newFile in toCompare:
-            origRows = self.parse_table_file(origFile)
-            newRows = self.parse_table_file(newFile)
-            unmatched = []
-            for row in origRows:
-                newRow = self.find_matching_row(row, newRows, self.get_field_names_to_ignore())
-                if newRow:
-                    newRows.remove(newRow)
-                else:
-                    unmatched.append(row)
-            if len(newRows) == 0:
+        # Results come back in the order of toCompare, so the outcome doesn't depend on how the work was shared out
+        for newFile, outcome, data in self.compare_all_table_files(toCompare):
+            if outcome == "remove":
                 toRemove.append(newFile)
-            elif len(unmatched) == 0:
-                toReduce.append((newFile, newRows))
-            elif os.path.basename(newFile).split(".")[0] in self.get_table_names_for_rename_check():
-                renameCheck.append((newFile, unmatched, newRows))
+            elif outcome == "reduce":
+                toReduce.append((newFile, data))
+            elif outcome == "rename":
+                renameCheck.append((newFile, *data))
                         
         toRename = self.check_for_renames(renameCheck, dbdir, toRemove, toReduce)
         return toRemove, toReduce, toRename
+
+    def compare_all_table_files(self, toCompare):
+        if self.processes > 1 and len(toCompare) > 1 and self.is_picklable():
+            workers = min(self.processes, len(toCompare))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                origFiles, newFiles = zip(*toCompare)
+                chunksize = max(1, len(toCompare) // (workers * 4))
+                return list(executor.map(self.compare_table_files, origFiles, newFiles, chunksize=chunksize))
+        return [ self.compare_table_files(origFile, newFile) for origFile, newFile in toCompare ]
+
+    def is_picklable(self):
+        try:
+            pickle.dumps(self)
+            return True
+        except Exception as e:
+            logging.getLogger("dbtext").warning(f"Cannot send {type(self).__name__} to worker processes, comparing table files in this process instead: {e}")
+            return False
+
+    def compare_table_files(self, origFile, newFile):
+        """
+        Returns (newFile, outcome, data): outcome "remove" if the new file adds nothing, "reduce" with the added rows
+        if it only adds rows, "rename" with (unmatched original rows, added rows) if it should be checked for renames,
+        and None otherwise. Runs in a worker process when processes > 1.
+        """
+        origRows = self.parse_table_file(origFile)
+        newRows = self.parse_table_file(newFile)
+        newRows, unmatched = self.match_rows(origRows, newRows)
+        if len(newRows) == 0:
+            return newFile, "remove", None
+        elif len(unmatched) == 0:
+            return newFile, "reduce", newRows
+        elif os.path.basename(newFile).split(".")[0] in self.get_table_names_for_rename_check():
+            return newFile, "rename", (unmatched, newRows)
+        return newFile, None, None
     
     def check_for_renames(self, *args):
         return [] # hook for context-specific logic
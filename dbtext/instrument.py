@@ -0,0 +1,98 @@
+'''
+Timings and counters for the phases of creating, loading and dumping a database, to find out where the time goes
+'''
+
+import time, json, logging
+from contextlib import contextmanager, nullcontext
+
+class Instrumentation:
+    """
+    Pass one of these as "instrumentation" to a DBText or Mongo_DBText to collect:
+    - the time spent in each phase (e.g. "run_sql", "load_table", "fetch", "write_file"), in total and per table
+    - counters (e.g. "rows_inserted", "bytes_written", "round_trips", "fk_retries"), in total and per table
+
+    :param summary_file: if given, a JSON summary is written there when the database is dropped, see write_summary
+    :param hooks: callables hook(event, name, value, table) called as things happen, where event is "phase"
+    (value is the seconds taken) or "count" (value is the amount added). table is None for database-wide events.
+    """
+    enabled = True
+    def __init__(self, summary_file=None, hooks=None):
+        self.logger = logging.getLogger("dbtext")
+        self.summary_file = summary_file
+        self.hooks = list(hooks or [])
+        self.timings = {}
+        self.table_timings = {}
+        self.counters = {}
+        self.table_counters = {}
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def phase(self, name, table=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start, table)
+
+    def add_timing(self, name, elapsed, table=None):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+        if table is not None:
+            tables = self.table_timings.setdefault(name, {})
+            tables[table] = tables.get(table, 0.0) + elapsed
+        for hook in self.hooks:
+            hook("phase", name, elapsed, table)
+
+    def count(self, name, value=1, table=None):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if table is not None:
+            tables = self.table_counters.setdefault(name, {})
+            tables[table] = tables.get(table, 0) + value
+        for hook in self.hooks:
+            hook("count", name, value, table)
+
+    def get_summary(self):
+        return { "timings": self.timings, "table_timings": self.table_timings,
+                 "counters": self.counters, "table_counters": self.table_counters }
+
+    def write_summary(self, fn=None):
+        fn = fn or self.summary_file
+        if fn:
+            with open(fn, "w") as f:
+                json.dump(self.get_summary(), f, indent=2, sort_keys=True)
+            self.logger.debug(f"Wrote instrumentation summary to {fn}")
+
+    def log_summary(self, level=logging.INFO):
+        for name, elapsed in sorted(self.timings.items(), key=lambda item: -item[1]):
+            self.logger.log(level, f"{name}: {elapsed:.3f} seconds")
+        for name, value in sorted(self.counters.items()):
+            self.logger.log(level, f"{name}: {value}")
+
+
+class NullInstrumentation:
+    """
+    Used when no instrumentation is wanted, does nothing as cheaply as possible
+    """
+    enabled = False
+    no_phase = nullcontext()
+    def phase(self, name, table=None):
+        return self.no_phase
+
+    def add_timing(self, *args, **kw):
+        pass
+
+    def count(self, *args, **kw):
+        pass
+
+    def get_summary(self):
+        return {}
+
+    def write_summary(self, fn=None):
+        pass
+
+    def log_summary(self, *args, **kw):
+        pass
+
+
+null_instrumentation = NullInstrumentation()
@@ -6,8 +6,13 @@ Created on Dec 8, 2021
 
 import os, subprocess, json, time
 from . import jsonutils, increments, wait
+from .aio import AsyncLifecycle
+from .instrument import null_instrumentation
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import shutil
 import sys
+import tempfile
 import logging
 try:
     # comes with pymongo
@@ -15,6 +20,61 @@ try:
 except ModuleNotFoundError:
     pass
 
+
+class MongoChangeCapture:
+    """
+    Records which documents change after the initial data has been inserted, using a change stream.
+    Change streams need a replica set, which LocalMongo_DBText starts anyway to allow transactions.
+    """
+    def __init__(self, client, max_await_ms=100):
+        # max_await_ms bounds how long draining waits for events that are still in flight
+        self.stream = client.watch(max_await_time_ms=max_await_ms)
+        self.touched = {} # (db, collection) -> { id key : _id }, or None if the whole collection must be re-read
+        self.dropped_dbs = set()
+        
+    @staticmethod
+    def id_key(docId):
+        # _id can be any BSON type except an array, including (unhashable) embedded documents
+        try:
+            hash(docId)
+            return docId
+        except TypeError:
+            return repr(docId)
+        
+    def drain(self):
+        while self.stream.alive:
+            change = self.stream.try_next()
+            if change is None:
+                return
+            self.record(change)
+            
+    def record(self, change):
+        operation = change["operationType"]
+        ns = change.get("ns", {})
+        key = ns.get("db"), ns.get("coll")
+        if operation == "dropDatabase":
+            self.dropped_dbs.add(key[0])
+        elif operation in [ "drop", "rename" ]:
+            self.touched[key] = None
+            if operation == "rename":
+                to = change["to"]
+                self.touched[(to["db"], to["coll"])] = None
+        elif "documentKey" in change:
+            ids = self.touched.setdefault(key, {})
+            if ids is not None:
+                docId = change["documentKey"]["_id"]
+                ids[self.id_key(docId)] = docId
+                
+    def get_touched_collections(self, cmp_data):
+        touched = dict(self.touched)
+        for dbName in self.dropped_dbs:
+            for collName in cmp_data.get(dbName, {}):
+                touched[(dbName, collName)] = None
+        return touched
+                
+    def close(self):
+        self.stream.close()
+
         
 class MongoTextClient:
     ignore_db_names = [ "admin", "config", "local" ]
@@ -32,19 +92,35 @@ class MongoTextClient:
     def __getattr__(self, name):
         return getattr(self.client, name)
             
-    def dump_data_directory(self, rootDir):
+    def dump_data_directory(self, rootDir, bson_format=False):
         origDir = rootDir + "_orig"
         if os.path.isdir(rootDir):
             os.rename(rootDir, origDir)
         data = self.parse_mongo()
+        self.write_data_directory(rootDir, data, bson_format)
+        increments.IncrementConverter().convert_to_increment(rootDir, origDir)
+        
+    @classmethod
+    def write_data_directory(cls, rootDir, data, bson_format=False):
         for dbName, dbdata in data.items():
             dbdir = os.path.join(rootDir, dbName)
             os.makedirs(dbdir)
             for collName, collection in dbdata.items():
-                fn = os.path.join(dbdir, collName + ".json")
-                with open(fn, "w") as f:
-                    jsonutils.dump_json_table(f, collection)
-        increments.IncrementConverter().convert_to_increment(rootDir, origDir)
+                if bson_format:
+                    with open(os.path.join(dbdir, collName + ".bson"), "wb") as f:
+                        for doc in collection:
+                            f.write(bson.encode(doc))
+                else:
+                    with open(os.path.join(dbdir, collName + ".json"), "w") as f:
+                        jsonutils.dump_json_table(f, collection)
+                        
+    @classmethod
+    def convert_data_directory(cls, rootDir, targetDir, bson_format=True):
+        """
+        Translate a data directory between the .json and .bson collection formats.
+        Note that BSON types without a JSON equivalent (dates, ObjectIds etc.) are written as strings.
+        """
+        cls.write_data_directory(targetDir, cls.parse_data_directory(rootDir, None), bson_format)
     
     @classmethod
     def parse_data_directory(cls, rootDir, dbMapping):
@@ -55,20 +131,49 @@ class MongoTextClient:
                 if os.path.isdir(dbDir):
                     dbdata = {}
                     for collectionFn in os.listdir(dbDir):
-                        if collectionFn.endswith(".json"):
-                            collectionPath = os.path.join(rootDir, dbName, collectionFn)
-                            try:
-                                docs = json.load(open(collectionPath))                                                                
-                                if dbMapping:
-                                    cls.apply_mapping(docs, dbMapping)
-                                dbdata[collectionFn[:-5]] = docs
-                            except json.decoder.JSONDecodeError as e:
-                                print("WARNING: DbText found invalid json in MongoDB data file at", collectionPath.replace(os.getcwd(), "."), 
-                                      "- file will be ignored. Detailed error follows:", file=sys.stderr)
-                                print(str(e), file=sys.stderr)
+                        collectionName, ext = os.path.splitext(collectionFn)
+                        collectionPath = os.path.join(rootDir, dbName, collectionFn)
+                        if ext == ".bson":
+                            docs = cls.parse_bson_collection(collectionPath)
+                        elif ext == ".json" and not os.path.isfile(os.path.join(dbDir, collectionName + ".bson")):
+                            docs = cls.parse_json_collection(collectionPath)
+                        else:
+                            continue
+                        if docs is not None:
+                            if dbMapping:
+                                cls.apply_mapping(docs, dbMapping)
+                            if ext == ".json":
+                                cls.convert_json_ids(docs)
+                            dbdata[collectionName] = docs
                     if len(dbdata) > 0:
                         data[dbName] = dbdata
         return data
+    
+    @classmethod
+    def parse_bson_collection(cls, collectionPath):
+        # Native BSON keeps all the types, so the documents can be inserted as they are
+        with open(collectionPath, "rb") as f:
+            return bson.decode_all(f.read())
+    
+    @classmethod
+    def parse_json_collection(cls, collectionPath):
+        try:
+            with open(collectionPath) as f:
+                return json.load(f)
+        except json.decoder.JSONDecodeError as e:
+            print("WARNING: DbText found invalid json in MongoDB data file at", collectionPath.replace(os.getcwd(), "."), 
+                  "- file will be ignored. Detailed error follows:", file=sys.stderr)
+            print(str(e), file=sys.stderr)
+    
+    @classmethod
+    def convert_json_ids(cls, docs):
+        for doc in docs:
+            if "_id" in doc:
+                try:
+                    doc["_id"] = bson.ObjectId(doc["_id"])
+                except bson.errors.InvalidId:
+                    # IDs are not necessarily object ids, if they aren't just assume they're strings...
+                    pass
 
     @classmethod
     def apply_mapping_to_doc(cls, doc, dbMapping, values_found):
@@ -86,12 +191,15 @@ class MongoTextClient:
         for doc in docs:
             cls.apply_mapping_to_doc(doc, dbMapping, values_found)
     
-    def parse_mongo(self, ignoreDbs=None):
-        data = {}
+    def get_ignore_db_names(self, ignoreDbs):
         if ignoreDbs:
-            ignore = self.ignore_db_names + [ db.lower() for db in ignoreDbs ]
+            return self.ignore_db_names + [ db.lower() for db in ignoreDbs ]
         else:
-            ignore = self.ignore_db_names
+            return self.ignore_db_names
+        
+    def parse_mongo(self, ignoreDbs=None):
+        data = {}
+        ignore = self.get_ignore_db_names(ignoreDbs)
         for databaseName in self.client.list_database_names():
             if databaseName.lower() not in ignore:
                 database = self.client[databaseName]
@@ -105,13 +213,67 @@ class MongoTextClient:
                     data[databaseName] = dbdata
         return data
     
+    def parse_changed_documents(self, cmp_data, change_capture, ignoreDbs=None):
+        """
+        Equivalent to restricting both cmp_data and parse_mongo() to the documents the change capture saw touched.
+        Untouched documents are identical on both sides, so categorise gives the same result on the restricted data
+        """
+        change_capture.drain()
+        ignore = self.get_ignore_db_names(ignoreDbs)
+        touched = change_capture.get_touched_collections(cmp_data)
+        old_data, new_data = {}, {}
+        for dbName, dbdata in cmp_data.items():
+            if dbName.lower() in ignore:
+                # never read back by parse_mongo, so reported as deleted by a full scan
+                old_data[dbName] = dbdata
+                continue
+            for collName, docs in dbdata.items():
+                if len(docs) == 0 or touched.get((dbName, collName), {}) is None:
+                    old_data.setdefault(dbName, {})[collName] = docs
+                else:
+                    ids = touched.get((dbName, collName), {})
+                    old_docs = [ doc for doc in docs if change_capture.id_key(doc.get("_id")) in ids ]
+                    if len(old_docs) > 0:
+                        old_data.setdefault(dbName, {})[collName] = old_docs
+        for (dbName, collName), ids in touched.items():
+            if dbName.lower() in ignore:
+                continue
+            collection = self.client[dbName][collName]
+            if ids is None:
+                new_docs = list(collection.find({}))
+            elif len(ids) > 0:
+                # hint natural order so documents come back in the same order as the full scan in parse_mongo
+                new_docs = list(collection.find({ "_id": { "$in": list(ids.values()) } }).hint([ ("$natural", 1) ]))
+            else:
+                new_docs = []
+            if len(new_docs) > 0:
+                new_data.setdefault(dbName, {})[collName] = new_docs
+        return old_data, new_data
+    
     def has_collection(self, collectionName):
-        for databaseName in self.client.list_database_names():
-            if databaseName.lower() not in self.ignore_db_names:
-                coll = self.client[databaseName].get_collection(collectionName)
-                if coll is not None and coll.count_documents({}) > 0:
-                    return True
-        return False
+        return self.has_documents(self.get_collections_named(collectionName))
+
+    def get_collections_named(self, collectionName):
+        return [ self.client[databaseName].get_collection(collectionName)
+                 for databaseName in self.client.list_database_names() if databaseName.lower() not in self.ignore_db_names ]
+
+    @staticmethod
+    def has_documents(collections):
+        # Finding one document is cheap however big the collection is, unlike counting them
+        return any(coll.find_one({}, projection={ "_id": 1 }) is not None for coll in collections)
+
+    def watch_for_removals(self, collectionName, max_await_ms=100):
+        """
+        Returns a change stream of the events that could leave collections with this name empty, or None if change
+        streams aren't available, e.g. without a replica set
+        """
+        from pymongo.errors import OperationFailure
+        pipeline = [ { "$match": { "$or": [ { "ns.coll": collectionName, "operationType": { "$in": [ "delete", "drop", "rename" ] } },
+                                            { "operationType": "dropDatabase" } ] } } ]
+        try:
+            return self.client.watch(pipeline, max_await_time_ms=max_await_ms)
+        except OperationFailure as e:
+            logging.getLogger("Mongo_DBText").debug("Could not open change stream, will poll instead: %s", e)
                 
     def categorise(self, data1, data2):
         if isinstance(data1, dict):
@@ -191,8 +353,11 @@ class MongoTextClient:
                 change_fn = fn_template.format(db=databaseName)
                 jsonutils.dump_json_tables(database, change_fn, sort_keys=True)
 
-    def dump_changes(self, cmp_data, ext, ignore_dbs=None):
-        new_data = self.parse_mongo(ignore_dbs)
+    def dump_changes(self, cmp_data, ext, ignore_dbs=None, change_capture=None):
+        if change_capture:
+            cmp_data, new_data = self.parse_changed_documents(cmp_data, change_capture, ignore_dbs)
+        else:
+            new_data = self.parse_mongo(ignore_dbs)
         created, updated, deleted = self.categorise(cmp_data, new_data)
         self.swap_out_ids(created)
         self.dump_change_files("db_{db}_created." + ext, created)
@@ -200,43 +365,90 @@ class MongoTextClient:
         self.dump_change_files("db_{db}_deleted." + ext, deleted)
         
     def insert_data(self, data):
+        # ObjectIds in JSON data have already been converted by parse_data_directory
         for databaseName, db_data in data.items():
             db = self.client.get_database(databaseName)
             for collectionName, docs in db_data.items():
-                collection = db.get_collection(collectionName)
-                for doc in docs:
-                    if "_id" in doc:
-                        try:
-                            doc["_id"] = bson.ObjectId(doc["_id"])
-                        except bson.errors.InvalidId:
-                            # IDs are not necessarily object ids, if they aren't just assume they're strings...
-                            pass
-                collection.insert_many(docs)
+                if len(docs) > 0:
+                    db.get_collection(collectionName).insert_many(docs)
+                
+    def start_change_capture(self):
+        from pymongo.errors import OperationFailure
+        try:
+            return MongoChangeCapture(self.client)
+        except OperationFailure as e:
+            logging.getLogger("Mongo_DBText").warning("Could not open change stream, will compare all data instead: %s", e)
 
-class Mongo_DBText:
-    def __init__(self, port=None, data_dirname="mongodata", db_dirname="mongo"):
+class Mongo_DBText(AsyncLifecycle):
+    def __init__(self, port=None, data_dirname="mongodata", db_dirname="mongo", instrumentation=None):
+        """
+        :param instrumentation: an instrument.Instrumentation, to collect timings and counts of what dbtext does.
+        The startup phases are also recorded in startup_timings.
+        """
         self.port = port
         self.dbdir = os.path.abspath(db_dirname)
         self.data_dir = os.path.abspath(data_dirname)
         self.initial_data = {}
         self.text_client = None
+        self.change_capture = None
+        self.startup_timings = {}
+        self.instrumentation = instrumentation or null_instrumentation
             
-    def create(self, dbMapping=None, transactions=True, logfile=None, bindipall=False, **kw):
-        if not os.path.isdir(self.dbdir):
+    def create(self, dbMapping=None, transactions=True, logfile=None, bindipall=False, change_capture=False, ephemeral=False, **kw):
+        """
+        :param change_capture: open a change stream once the data is inserted, so that dump_changes only needs to
+        fetch the documents that were touched rather than re-reading everything. Requires a replica set (transactions=True).
+        :param ephemeral: for LocalMongo_DBText, start mongod with settings for throwaway data: the data files go in a
+        temporary directory on tmpfs where there is one, with a small cache, and are deleted when the database is dropped.
+        """
+        if not ephemeral and not os.path.isdir(self.dbdir):
             os.mkdir(self.dbdir)
         logger = logging.getLogger("Mongo_DBText")
-        self.start_mongo(transactions, logfile, bindipall)
-        logger.debug("Parsing data from " + self.data_dir)
-        self.initial_data = MongoTextClient.parse_data_directory(self.data_dir, dbMapping)
-        logger.debug("Connecting to instance...")
-        self.text_client = self.make_text_client(**kw)
+        self.startup_timings = {}
+        with self.startup_phase("start_mongo"):
+            self.start_mongo(transactions, logfile, bindipall, ephemeral)
+        # Parse the data while the server starts up, it's independent of it until we insert
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            logger.debug("Parsing data from " + self.data_dir)
+            parsing = executor.submit(self.parse_data_directory, dbMapping)
+            logger.debug("Connecting to instance...")
+            with self.startup_phase("connect"):
+                self.text_client = self.make_text_client(**kw)
+            self.initial_data = parsing.result()
         logger.debug("Waiting for database to be primary...")
-        if self.wait_for_all_primary():
+        with self.startup_phase("wait_for_primary"):
+            is_primary = self.wait_for_all_primary()
+        if is_primary:
             logger.debug("Inserting all data")
-            self.text_client.insert_data(self.initial_data)
+            with self.startup_phase("insert_data"):
+                self.text_client.insert_data(self.initial_data)
+            if self.instrumentation.enabled:
+                for dbName, dbdata in self.initial_data.items():
+                    for collName, docs in dbdata.items():
+                        self.instrumentation.count("documents_inserted", len(docs), dbName + "." + collName)
+            if change_capture:
+                logger.debug("Starting change capture")
+                self.change_capture = self.text_client.start_change_capture()
         else:
             print("Database was not primary even after waiting 60 seconds, aborting.", file=sys.stderr)
             
+    async def acreate(self, *args, **kw):
+        return await self.run_blocking(self.create, *args, **kw)
+            
+    @contextmanager
+    def startup_phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[name] = time.perf_counter() - start
+            self.instrumentation.add_timing(name, self.startup_timings[name])
+            logging.getLogger("Mongo_DBText").debug("Startup phase %s took %.3f seconds", name, self.startup_timings[name])
+            
+    def parse_data_directory(self, dbMapping):
+        with self.startup_phase("parse_data"):
+            return MongoTextClient.parse_data_directory(self.data_dir, dbMapping)
+            
     def __enter__(self):
         return self
     
@@ -244,7 +456,13 @@ class Mongo_DBText:
         self.drop()
     
     def drop(self):
-        pass
+        self.close_change_capture()
+        self.instrumentation.write_summary()
+        
+    def close_change_capture(self):
+        if self.change_capture:
+            self.change_capture.close()
+            self.change_capture = None
     
     def setup_succeeded(self):
         return self.text_client is not None
@@ -262,22 +480,63 @@ class Mongo_DBText:
     
     def dump_changes(self, ext, ignore_dbs=None):
         cmp_data = self.filter_initial_data(ignore_dbs) if ignore_dbs else self.initial_data
-        self.text_client.dump_changes(cmp_data, ext, ignore_dbs)
+        with self.instrumentation.phase("dump_changes"):
+            self.text_client.dump_changes(cmp_data, ext, ignore_dbs, self.change_capture)
         
-    def dump_data_directory(self, dump_dir=None):
-        self.text_client.dump_data_directory(dump_dir or self.data_dir)
+    async def adump_changes(self, *args, **kw):
+        return await self.run_blocking(self.dump_changes, *args, **kw)
+        
+    def dump_data_directory(self, dump_dir=None, bson_format=False):
+        with self.instrumentation.phase("dump_data_directory"):
+            self.text_client.dump_data_directory(dump_dir or self.data_dir, bson_format)
+        
+    async def adump_data_directory(self, *args, **kw):
+        return await self.run_blocking(self.dump_data_directory, *args, **kw)
     
     def make_text_client(self, *args, **kw):
         return MongoTextClient(*args, **kw)
     
     def wait_for_collections_empty(self, collectionName, maxTime):
+        """
+        Waits until no database has any documents in a collection with this name, returning False if that takes longer
+        than maxTime seconds. On replica sets it checks again whenever documents are removed. Without change streams,
+        or if the stream fails, it polls as it always has.
+        """
+        from pymongo.errors import PyMongoError
+        deadline = time.monotonic() + float(maxTime)
+        # Opened before the first check, so that nothing removed in between is missed
+        stream = self.text_client.watch_for_removals(collectionName)
+        if stream is None:
+            return self.poll_for_collections_empty(collectionName, deadline)
+        try:
+            collections = self.text_client.get_collections_named(collectionName)
+            while stream.alive:
+                if not self.text_client.has_documents(collections):
+                    return True
+                if time.monotonic() >= deadline:
+                    return False
+                self.wait_for_change(stream, deadline)
+        except PyMongoError as e:
+            logging.getLogger("Mongo_DBText").debug("Change stream failed, will poll instead: %s", e)
+        finally:
+            stream.close()
+        return self.poll_for_collections_empty(collectionName, deadline)
+
+    def poll_for_collections_empty(self, collectionName, deadline):
         attempts = 10
-        sleepLength = float(maxTime) / attempts
+        sleepLength = max(deadline - time.monotonic(), 0) / attempts
         for _ in range(attempts):
             if not self.text_client.has_collection(collectionName):
                 return True
             time.sleep(sleepLength)
         return False
+
+    @staticmethod
+    def wait_for_change(stream, deadline):
+        # try_next waits up to the stream's max_await_time_ms for an event
+        while stream.alive and time.monotonic() < deadline:
+            if stream.try_next() is not None:
+                return
     
     def wait_for_all_primary(self):
         for databaseName in self.initial_data:
@@ -288,34 +547,67 @@ class Mongo_DBText:
                 return False
         return True
             
-    def wait_for_primary(self, db):
-        for _ in range(600):
+    def wait_for_primary(self, db, timeout=60.0):
+        from pymongo.errors import OperationFailure
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while True:
             values = db.command("ismaster")
             if values['ismaster']:
                 return True
-            time.sleep(0.1)
-        return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            topologyVersion = values.get("topologyVersion")
+            if topologyVersion is not None:
+                # MongoDB 4.4 and later: the server holds the reply until its state changes, so we see the election at once
+                try:
+                    db.command("ismaster", topologyVersion=topologyVersion, maxAwaitTimeMS=int(min(remaining, 10.0) * 1000))
+                    continue
+                except OperationFailure:
+                    pass
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 1.0)
 
 
         
 class LocalMongo_DBText(Mongo_DBText):
     mongo_exe = None
-    def start_mongo(self, transactions, logfile, bindipall):
+    # Used by create(ephemeral=True): the first of these directories that exists holds the data files
+    ephemeralDirs = [ "/dev/shm" ]
+    ephemeralCacheSizeGB = 0.25
+    # Nothing is kept, so don't spend time compressing data or collecting diagnostics for it
+    ephemeralArgs = [ "--wiredTigerCollectionBlockCompressor", "none", "--wiredTigerJournalCompressor", "none",
+                      "--setParameter", "diagnosticDataCollectionEnabled=false" ]
+    def start_mongo(self, transactions, logfile, bindipall, ephemeral=False):
         if not self.set_mongo_exe():
             raise RuntimeError("Could not find MongoDB, have you installed it?")
 
         # must use replica set to allow transactions. Use unique one based on process id
         self.rsId = None
-        cmdArgs = [ self.mongo_exe, "--port", "0", "--dbpath", self.dbdir, "--quiet" ]
+        self.ephemeral_dbdir = self.make_ephemeral_dbdir() if ephemeral else None
+        self.cmdArgs = [ self.mongo_exe, "--port", "0", "--dbpath", self.ephemeral_dbdir or self.dbdir, "--quiet" ]
+        if ephemeral:
+            self.cmdArgs += [ "--wiredTigerCacheSizeGB", str(self.ephemeralCacheSizeGB) ]
         if transactions:
             self.rsId = "rs" + str(os.getpid())
-            cmdArgs += [ "--replSet", self.rsId ]
+            self.cmdArgs += [ "--replSet", self.rsId ]
         if bindipall:
-            cmdArgs += [ "--bind_ip_all" ]
-        self.proc = subprocess.Popen(cmdArgs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        self.pipeThread = wait.PipeReaderThread(self.proc, "Waiting for connections", logfile)
+            self.cmdArgs += [ "--bind_ip_all" ]
+        self.logfile = logfile
+        self.launch_mongo(self.ephemeralArgs if ephemeral else [])
+
+    def launch_mongo(self, extraArgs):
+        self.proc = subprocess.Popen(self.cmdArgs + extraArgs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.pipeThread = wait.PipeReaderThread(self.proc, "Waiting for connections", self.logfile)
         self.pipeThread.start()
 
+    def make_ephemeral_dbdir(self):
+        tmpfs = next((d for d in self.ephemeralDirs if os.path.isdir(d) and os.access(d, os.W_OK)), None)
+        if tmpfs is None:
+            logging.getLogger("Mongo_DBText").debug("No tmpfs directory found, using the default temporary directory")
+        return tempfile.mkdtemp(prefix="dbtext_mongo_", dir=tmpfs)
+
     def parse_port(self, line):
         lineDict = json.loads(line.strip())
         attrDict = lineDict.get("attr", {})
@@ -325,6 +617,14 @@ class LocalMongo_DBText(Mongo_DBText):
 
     def make_text_client(self):
         port_line = self.pipeThread.wait_for_text()
+        if port_line is None and self.ephemeral_dbdir:
+            # A mongod version that doesn't accept the tuning options shouldn't stop the tests, they only save time
+            logging.getLogger("Mongo_DBText").warning("MongoDB exited at startup with the ephemeral options, starting it again without them")
+            self.pipeThread.terminate()
+            self.launch_mongo([])
+            port_line = self.pipeThread.wait_for_text()
+        if port_line is None:
+            raise RuntimeError("MongoDB exited before it was ready to accept connections")
         self.port = self.parse_port(port_line)
         if self.rsId:
             self.enable_transactions(self.port, self.rsId)
@@ -337,7 +637,11 @@ class LocalMongo_DBText(Mongo_DBText):
         admin_client.close()
         
     def drop(self):
+        Mongo_DBText.drop(self)
         self.pipeThread.terminate()
+        if self.ephemeral_dbdir:
+            shutil.rmtree(self.ephemeral_dbdir, ignore_errors=True)
+            self.ephemeral_dbdir = None
 
     @classmethod
     def set_mongo_exe(cls):
@@ -5,16 +5,31 @@ Use with MSSQL server
 """
 
 
-import os, subprocess, locale
+import os, subprocess, locale, re
 import struct
+from decimal import Decimal
 from .base_odbc import DBText
 try:
     import pyodbc
 except ModuleNotFoundError:
     # gets imported even for MongoDB, which doesn't need it
     pass                 
+
+# ODBC SQL type codes, as in pyodbc
+SQL_WVARCHAR = -9
+SQL_VARBINARY = -3
+# @@OPTIONS bits
+NOCOUNT_OPTION = 512
+XACT_ABORT_OPTION = 16384
                     
 class MSSQL_DBText(DBText):
+    # Batches that only create or fill tables can be sent together, others (procedures, views, SET options, variables)
+    # depend on being in a batch of their own
+    combinableBatchPattern = re.compile(r"^(CREATE\s+TABLE|CREATE\s+(UNIQUE\s+)?((NON)?CLUSTERED\s+)?INDEX|ALTER\s+TABLE|INSERT)\b", re.IGNORECASE)
+    # Columns that can't convert text in exponent notation, as python writes small and large floats
+    exactNumericTypes = [ "tinyint", "smallint", "int", "bigint", "decimal", "numeric", "money", "smallmoney" ]
+    sessionOptionPattern = re.compile(r"\bSET\s+(NOCOUNT|XACT_ABORT)\b", re.IGNORECASE)
+    maxCombinedBatches = 200
     def handle_datetimeoffset(self, dto_value):
         # ref: https://github.com/mkleehammer/pyodbc/issues/134#issuecomment-281739794
         tup = struct.unpack("<6hI2h", dto_value)  # e.g., (2017, 3, 16, 10, 35, 18, 0, -6, 0)
@@ -33,21 +48,139 @@ class MSSQL_DBText(DBText):
         else:
             return ""
         
-    def extract_data_for_dump(self, ttcxn, *args, **kw):
+    def is_combinable_batch(self, query):
+        return self.combinableBatchPattern.match(query) is not None and "@" not in query and \
+            self.sessionOptionPattern.search(query) is None
+    
+    def execute_setup_batches(self, ttcxn, batches, sqlfile):
+        group = []
+        for lineNumbers, query in batches:
+            combinable = self.is_combinable_batch(query)
+            if not combinable or len(group) == self.maxCombinedBatches:
+                self.execute_batch_group(ttcxn, group, sqlfile)
+                group = []
+            if combinable:
+                group.append((lineNumbers, query))
+            else:
+                self.execute_setup_batch(ttcxn, query, sqlfile, lineNumbers[0])
+        self.execute_batch_group(ttcxn, group, sqlfile)
+        
+    def execute_batch_group(self, ttcxn, group, sqlfile):
+        if len(group) == 0:
+            return
+        elif len(group) == 1:
+            return self.execute_setup_batch(ttcxn, group[0][1], sqlfile, group[0][0][0])
+        # All or nothing, so if anything fails we can roll back and run them one at a time to find out where.
+        # Afterwards the session options are put back as the script left them
+        self.instrumentation.count("round_trips", 2)
+        restore = self.make_restore_options_sql(ttcxn.cursor().execute("SELECT @@OPTIONS").fetchone()[0])
+        query = "SET XACT_ABORT ON; SET NOCOUNT ON;\nBEGIN TRANSACTION;\n" + "\n".join(q for _, q in group) + \
+                "\nCOMMIT TRANSACTION;\n" + restore
+        try:
+            cursor = ttcxn.cursor()
+            cursor.execute(query)
+            while cursor.nextset(): # errors from later statements only appear when we get to their results
+                pass
+        except pyodbc.Error as e:
+            self.logger.debug(f"Combined setup batches failed, running them separately: {e}")
+            ttcxn.cursor().execute("IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION; " + restore)
+            for lineNumbers, query in group:
+                self.execute_setup_batch(ttcxn, query, sqlfile, lineNumbers[0])
+
+    @classmethod
+    def make_restore_options_sql(cls, options):
+        return ("" if options & NOCOUNT_OPTION else "SET NOCOUNT OFF; ") + ("" if options & XACT_ABORT_OPTION else "SET XACT_ABORT OFF;")
+
+    def get_column_metadata(self, ttcxn, table_name):
+        # one catalog query gives both the identity column and the types for the input sizes
+        sql = "SELECT c.name, t.name AS type_name, c.max_length, c.is_identity FROM sys.columns c " + \
+              "JOIN sys.types t ON c.system_type_id = t.user_type_id WHERE c.object_id = OBJECT_ID(?)"
+        rows = ttcxn.cursor().execute(sql, "[" + table_name.replace("]", "]]") + "]").fetchall()
+        return { row.name: (row.type_name, row.max_length, bool(row.is_identity)) for row in rows }
+    
+    @classmethod
+    def has_identity_column(cls, column_metadata, columns):
+        return any(column_metadata.get(col, (None, None, False))[2] for col in columns)
+    
+    @classmethod
+    def get_input_size(cls, type_name, max_length):
+        if type_name in [ "binary", "varbinary", "image" ]:
+            return SQL_VARBINARY, max_length if type_name != "image" and max_length > 0 else 0, 0
+        elif type_name in [ "nchar", "nvarchar" ]:
+            size = max_length // 2 if max_length > 0 else 0
+        elif type_name in [ "char", "varchar" ]:
+            size = max_length if max_length > 0 else 0
+        elif type_name == "datetimeoffset":
+            size = 34 # as written by handle_datetimeoffset, which the server converts back
+        elif type_name is None or type_name in [ "text", "ntext", "xml" ]:
+            size = 0
+        else:
+            size = 64 # numbers, dates etc. arrive as text and are converted by the server
+        return SQL_WVARCHAR, size, 0
+    
+    @classmethod
+    def make_input_sizes(cls, column_metadata, columns):
+        return [ cls.get_input_size(*column_metadata.get(col, (None, 0, False))[:2]) for col in columns ]
+    
+    @classmethod
+    def to_input_value(cls, value, type_name=None):
+        # with declared input sizes, everything except binary data is sent as text for the server to convert, as without them
+        if value is None or isinstance(value, (bytes, bytearray)):
+            return value
+        elif isinstance(value, bool):
+            return "1" if value else "0"
+        elif isinstance(value, (float, Decimal)) and type_name in cls.exactNumericTypes:
+            # e.g. 1e-05 from a json file, so write it without the exponent
+            return format(Decimal(repr(value)) if isinstance(value, float) else value, "f")
+        else:
+            return str(value)
+
+    @classmethod
+    def make_row_converter(cls, column_metadata, columns):
+        type_names = [ column_metadata.get(col, (None, 0, False))[0] for col in columns ]
+        return lambda row: tuple(cls.to_input_value(value, type_name) for value, type_name in zip(row, type_names))
+
+    def insert_rows(self, ttcxn, table_name, rows, identity_insert=False):
+        # Look up identity columns up front rather than failing and retrying with IDENTITY_INSERT
+        column_metadata = self.get_column_metadata(ttcxn, table_name)
+        columns = list(rows[0])
+        identity_insert = identity_insert or self.has_identity_column(column_metadata, columns)
+        sql = self.make_insert_sql(self.quote(table_name), [ self.quote(col) for col in columns ], identity_insert)
+        if column_metadata:
+            input_sizes = self.make_input_sizes(column_metadata, columns)
+            self.insert_row_data(ttcxn, sql, rows, table_name, input_sizes, self.make_row_converter(column_metadata, columns))
+        else:
+            self.insert_row_data(ttcxn, sql, rows, table_name)
+    
+    def prepare_extract_connection(self, ttcxn):
         ttcxn.add_output_converter(-155, self.handle_datetimeoffset)
-        return super().extract_data_for_dump(ttcxn, *args, **kw)
     
-    def single(self):
+    def single(self, dbname=None):
+        dbname = dbname or self.database_name
         try:
-            self.query("ALTER DATABASE " + self.database_name + " SET SINGLE_USER WITH ROLLBACK IMMEDIATE")
+            self.query("ALTER DATABASE " + dbname + " SET SINGLE_USER WITH ROLLBACK IMMEDIATE")
         except pyodbc.Error as e:
-            print("Unexpected error for alter db " + self.database_name + ":", e)
+            print("Unexpected error for alter db " + dbname + ":", e)
         
     def multi(self):
         self.query("ALTER DATABASE " + self.database_name + " SET MULTI_USER")
         
+    def get_database_names(self):
+        return [ row.name for row in self.query("select name from sys.databases").fetchall() ]
+    
+    def get_database_ages(self):
+        rows = self.query("select name, DATEDIFF(second, create_date, GETDATE()) AS age from sys.databases").fetchall()
+        return { row.name: row.age for row in rows }
+        
+    def get_rv_expression(self):
+        return "master.sys.fn_varbintohexstr(@@DBTS)"
+
+    def cast_to_text(self, expression):
+        # Style 126 gives ISO 8601 for dates and times, so they compare properly when used as watermarks
+        return f"CONVERT(VARCHAR(255), {expression}, 126)"
+
     def readrv(self, ttcxn):
-        rows = ttcxn.cursor().execute('select master.sys.fn_varbintohexstr(@@DBTS) AS maxrv').fetchall()
+        rows = ttcxn.cursor().execute(f'select {self.get_rv_expression()} AS maxrv').fetchall()
         self.startrv = rows[0].maxrv
         
     def convert_from_binary(self, col):
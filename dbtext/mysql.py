@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+import os, json, tempfile
 from .base_odbc import DBText
 try:
     import pyodbc
@@ -10,7 +11,7 @@ except ModuleNotFoundError:
     
 class MySQL_DBText(DBText):
 
-    def __init__(self, database=None, master_connection=None, ansi_sql_mode=False):
+    def __init__(self, database=None, master_connection=None, ansi_sql_mode=False, **kw):
         """
         Use this class when the database you want to set up for testing is MySQL
         :param database: the name of the database to create for testing. You should give a name that is unique to your test case run, for example include the current process id in the name
@@ -18,8 +19,10 @@ class MySQL_DBText(DBText):
         By default it will try to connect to a database named 'master'. If one doesn't exist, you could just create an empty one with that name.
         :param ansi_sql_mode: if the MySQL database is configured to have ANSI mode you should set this flag since it affects the syntax of the SQL you use
         (see https://dev.mysql.com/doc/refman/5.7/en/sql-mode.html for more information about modes)
+        Other keyword arguments are as for DBText. With fast_load=True, tables are loaded with LOAD DATA LOCAL INFILE,
+        with foreign key and unique checks switched off for the load. The server must allow local_infile.
         """
-        super().__init__(database, master_connection)
+        super().__init__(database, master_connection, **kw)
         self.ansi_sql_mode=ansi_sql_mode
 
     def quote(self, tablespec):
@@ -29,6 +32,82 @@ class MySQL_DBText(DBText):
             # A default installation of MySQL does not use ANSI mode and uses backticks to escape reserved words in column names etc
             return '`' + tablespec + '`'
 
+    def cast_to_text(self, expression):
+        return f"CAST({expression} AS CHAR)"
+
+    def read_tables_dir(self, ttcxn, tables_dir_name):
+        if not self.fast_load:
+            return DBText.read_tables_dir(self, ttcxn, tables_dir_name)
+        
+        loadcxn = self.make_local_infile_connection()
+        cursor = loadcxn.cursor()
+        fk_checks, unique_checks = cursor.execute("SELECT @@SESSION.foreign_key_checks, @@SESSION.unique_checks").fetchone()
+        # With the checks off the tables can be loaded in any order, so no need to retry on foreign key errors
+        cursor.execute("SET SESSION foreign_key_checks = 0, SESSION unique_checks = 0")
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for tableFile in self.get_table_files(tables_dir_name):
+                    self.logger.debug(f"Loading data from {tableFile}")
+                    with self.instrumentation.phase("load_table", os.path.basename(tableFile).rsplit(".", 1)[0]):
+                        self.load_table_file(loadcxn, tableFile, tmpdir)
+        finally:
+            cursor.execute(f"SET SESSION foreign_key_checks = {int(fk_checks)}, SESSION unique_checks = {int(unique_checks)}")
+            loadcxn.close()
+            
+    def make_local_infile_connection(self):
+        return pyodbc.connect(self.get_connection_string() + "ENABLE_LOCAL_INFILE=1;", autocommit=True)
+    
+    @classmethod
+    def to_infile_field(cls, value):
+        if value is None:
+            return b"\\N"
+        elif isinstance(value, bool):
+            return b"1" if value else b"0"
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        data = value if isinstance(value, (bytes, bytearray)) else str(value).encode("utf-8")
+        # the default escaping for LOAD DATA: FIELDS TERMINATED BY '\t' ESCAPED BY '\\' LINES TERMINATED BY '\n'
+        for char, escaped in [ (b"\\", b"\\\\"), (b"\t", b"\\t"), (b"\n", b"\\n"), (b"\r", b"\\r"), (b"\0", b"\\0") ]:
+            data = data.replace(char, escaped)
+        return bytes(data)
+
+    @classmethod
+    def to_infile_hex_field(cls, value):
+        # for binary columns, which are decoded again with UNHEX as they would otherwise be read as utf8mb4 text
+        if value is None:
+            return b"\\N"
+        data = value if isinstance(value, (bytes, bytearray)) else str(value).encode("utf-8")
+        return data.hex().encode("ascii")
+            
+    def load_table_file(self, loadcxn, fn, tmpdir):
+        table_name = os.path.basename(fn).rsplit(".", 1)[0]
+        rows = self.parse_table_file_to_table_data(fn, self.get_primary_key_columns(loadcxn, table_name))
+        if len(rows) == 0:
+            return
+        columns = list(rows[0])
+        binary_columns = [ col for col in columns if any(isinstance(row.get(col), (bytes, bytearray)) for row in rows) ]
+        datafile = os.path.join(tmpdir, table_name + ".txt")
+        with open(datafile, "wb") as f:
+            for row in rows:
+                fields = [ self.to_infile_hex_field(row.get(col)) if col in binary_columns else self.to_infile_field(row.get(col)) for col in columns ]
+                f.write(b"\t".join(fields) + b"\n")
+        path = datafile.replace("\\", "/").replace("'", "''")
+        variables = { col: f"@dbtext_{ix}" for ix, col in enumerate(columns) if col in binary_columns }
+        targets = ", ".join([ variables.get(col, self.quote(col)) for col in columns ])
+        sql = f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {self.quote(table_name)} CHARACTER SET utf8mb4 ({targets})"
+        if variables:
+            sql += " SET " + ", ".join([ f"{self.quote(col)} = UNHEX({variable})" for col, variable in variables.items() ])
+        try:
+            loadcxn.cursor().execute(sql)
+            self.instrumentation.count("round_trips")
+            self.instrumentation.count("rows_inserted", len(rows), table_name)
+        except pyodbc.Error:
+            self.logger.error(f"Failed to load data into {table_name} from {fn}")
+            raise
+
+    def get_database_names(self):
+        return [ row[0] for row in self.query("SHOW DATABASES").fetchall() ]
+
     @classmethod
     def get_driver(cls):
         drivers = []
@@ -0,0 +1,169 @@
+'''
+A pool of test databases that are created and populated in the background,
+so that a test can have one straight away instead of waiting for DBText.create
+'''
+
+import os, re, time
+import logging
+from threading import Thread, Condition, Lock
+
+class DBTextPool:
+    """
+    Keeps "size" databases ready, all created from the same sqlfile and tables_dir.
+    acquire() hands one out and a replacement is created in the background straight away.
+
+    Pool databases are named <name_prefix>db_pool<pid>_<creation time>_<number>, so they can't clash with each other
+    or with other pools, and get_tables_dir_name() finds the tables dir as usual.
+
+    :param dbtext_class: the DBText subclass for your database server, e.g. MSSQL_DBText or Sqlite3_DBText
+    :param dbtext_args: keyword arguments for dbtext_class, e.g. ansi_sql_mode for MySQL
+    :param create_args: extra keyword arguments for create(), e.g. mdffile for MSSQL
+    :param idle_timeout: seconds a database may wait in the pool before it is replaced by a fresh one, None means forever
+    :param stale_after: seconds after which pool databases left behind by other processes, e.g. crashed runs,
+    are dropped when the pool starts. None means never.
+    :param template: name of a database already holding the data, to copy with DBText.copy_database instead of loading
+    the sqlfile and tables_dir each time, where the server can do that. Nothing may be connected to it while the pool runs.
+    """
+    def __init__(self, dbtext_class, sqlfile=None, tables_dir=None, encoding=None, size=2, name_prefix="",
+                 idle_timeout=None, stale_after=3600, dbtext_args=None, create_args=None, template=None):
+        self.logger = logging.getLogger("dbtext")
+        self.dbtext_class = dbtext_class
+        self.sqlfile = sqlfile and os.path.abspath(sqlfile)
+        self.tables_dir = tables_dir and os.path.abspath(tables_dir)
+        self.encoding = encoding
+        self.size = size
+        self.name_prefix = name_prefix
+        self.idle_timeout = idle_timeout
+        self.stale_after = stale_after
+        self.dbtext_args = dbtext_args or {}
+        self.create_args = create_args or {}
+        self.template = template
+        self.name_pattern = re.compile("^" + re.escape(name_prefix) + r"db_pool(\d+)_(\d+)_\d+$")
+        self.ready = [] # (time it became ready, db)
+        self.counter = 0
+        self.closing = False
+        self.error = None
+        self.condition = Condition()
+        self.master = dbtext_class(**self.dbtext_args)
+        # The master connection is used by the background thread and by whoever discards databases,
+        # and connections can't be shared between threads
+        self.master_lock = Lock()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        self.drop_stale_databases()
+        self.thread.start()
+
+    def make_database_name(self):
+        self.counter += 1
+        return f"{self.name_prefix}db_pool{os.getpid()}_{int(time.time())}_{self.counter}"
+
+    def drop_stale_databases(self):
+        if self.stale_after is None:
+            return
+        now = time.time()
+        with self.master_lock:
+            for dbname in self.master.get_database_names():
+                match = self.name_pattern.match(dbname)
+                if match and int(match.group(1)) != os.getpid() and now - int(match.group(2)) > self.stale_after:
+                    self.logger.info(f"Dropping stale pool database {dbname}")
+                    try:
+                        self.master.drop_database(dbname)
+                    except Exception as e:
+                        self.logger.warning(f"Failed to drop stale pool database {dbname}: {e}")
+
+    def acquire(self, timeout=None):
+        """
+        Returns a created and populated DBText instance, waiting for one to be ready if necessary.
+        The caller owns it from now on, and should drop it as usual, e.g. by using it in a "with" statement
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.ready or self.error or self.closing, timeout):
+                raise RuntimeError(f"No pool database became ready within {timeout} seconds")
+            if not self.ready:
+                raise RuntimeError("Database pool could not create a database") from self.error
+            _, db = self.ready.pop(0)
+            self.condition.notify_all()
+        self.logger.debug(f"Handing out pool database {db.database_name}")
+        return db
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+        for _, db in self.ready:
+            self.discard(db)
+        self.ready = []
+
+    def create_database(self):
+        db = self.dbtext_class(self.make_database_name(), **self.dbtext_args)
+        self.logger.debug(f"Creating pool database {db.database_name}")
+        try:
+            if self.template and db.copy_database(self.template):
+                with db.database_connection() as ttcxn:
+                    db.readrv(ttcxn)
+            else:
+                db.create(self.sqlfile, self.encoding, self.tables_dir, **self.create_args)
+        except Exception:
+            self.discard(db)
+            raise
+        return db
+
+    def discard(self, db):
+        self.logger.debug(f"Dropping pool database {db.database_name}")
+        db.close_connections()
+        try:
+            with self.master_lock:
+                self.master.drop_database(db.database_name)
+        except Exception as e:
+            self.logger.warning(f"Failed to drop pool database {db.database_name}: {e}")
+
+    def get_expired(self):
+        if self.idle_timeout is None:
+            return []
+        now = time.monotonic()
+        expired = [ (t, db) for t, db in self.ready if now - t > self.idle_timeout ]
+        for item in expired:
+            self.ready.remove(item)
+        return [ db for _, db in expired ]
+
+    def get_wait_time(self):
+        if self.idle_timeout is None or not self.ready:
+            return None
+        oldest = min(t for t, _ in self.ready)
+        return max(oldest + self.idle_timeout - time.monotonic(), 0)
+
+    def run(self):
+        while True:
+            with self.condition:
+                expired = self.get_expired()
+                while not self.closing and not expired and len(self.ready) >= self.size:
+                    self.condition.wait(self.get_wait_time())
+                    expired = self.get_expired()
+                if self.closing:
+                    return
+            for db in expired:
+                self.discard(db)
+            with self.condition:
+                needed = len(self.ready) < self.size
+            if needed:
+                try:
+                    db = self.create_database()
+                except Exception as e:
+                    self.logger.error(f"Database pool failed to create a database, will not create any more: {e}")
+                    with self.condition:
+                        self.error = e
+                        self.condition.notify_all()
+                    return
+                with self.condition:
+                    self.ready.append((time.monotonic(), db))
+                    self.condition.notify_all()
@@ -2,14 +2,37 @@
 
 from .base_odbc import DBText
 from datetime import datetime
+import json
 try:
     import pyodbc
 except ModuleNotFoundError:
     # gets imported even for MongoDB, which doesn't need it
     pass
+
+
+class CopyStream:
+    # file-like object for psycopg2's copy_expert, so that rows are sent as they are formatted
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ""
+        
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
    
     
 class Postgres_DBText(DBText):
+    """
+    With fast_load=True, the tables dir is loaded with COPY ... FROM STDIN, which needs the "psycopg" or "psycopg2"
+    module as the ODBC driver can't do it. Falls back to normal inserts if neither is installed.
+    """
     masterDbName = "postgres"        
     @classmethod
     def get_driver(cls):
@@ -30,14 +53,107 @@ class Postgres_DBText(DBText):
         cls.connectionStringTemplate = 'DRIVER={' + driver + '};Server=' + host + ';Port=' + port + ';Database=%s;Uid=' + user + ';Pwd=' + password + ';BoolsAsChar=0;'
         return cls.connectionStringTemplate
 
+    def get_database_names(self):
+        return [ row[0] for row in self.query("SELECT datname FROM pg_database WHERE NOT datistemplate").fetchall() ]
+
+    def copy_database(self, source_name):
+        # Nothing may be connected to the source database while it is copied
+        self.query("CREATE DATABASE " + self.quote(self.database_name) + " TEMPLATE " + self.quote(source_name) + ";")
+        self.iscreated = True
+        return True
+
+    def read_tables_dir(self, ttcxn, tables_dir_name):
+        self.loaded_pkeys = {}
+        self.copycxn = self.make_copy_connection() if self.fast_load else None
+        try:
+            DBText.read_tables_dir(self, ttcxn, tables_dir_name)
+        finally:
+            if self.copycxn:
+                self.copycxn.close()
+                self.copycxn = None
+        self.reset_sequences(ttcxn, self.loaded_pkeys)
+
     def add_table_data_for(self, fn, ttcxn, table_name, pkeys):
+        if self.copycxn:
+            rowData = self.parse_table_file_to_table_data(fn, pkeys)
+            if len(rowData) > 0:
+                self.copy_rows(table_name, rowData)
+        else:
+            DBText.add_table_data_for(self, fn, ttcxn, table_name, pkeys)
+        self.loaded_pkeys[table_name] = pkeys
+
+    def reset_sequences(self, ttcxn, table_pkeys):
         # Need to reset sequence counters explicitly in Postgres (MS SQL does this automatically behind the scenes)
-        DBText.add_table_data_for(self, fn, ttcxn, table_name, pkeys)
-        for pkey in pkeys:
-            quoted_table = self.quote(table_name)
-            sql = f"select pg_get_serial_sequence('{quoted_table}', '{pkey}');"
-            seq = ttcxn.cursor().execute(sql).fetchall()[0][0]
+        # Find all the sequences in one query, and reset them all in another
+        pairs = [ (self.quote(table_name), pkey) for table_name, pkeys in table_pkeys.items() for pkey in pkeys ]
+        if len(pairs) == 0:
+            return
+        values = ", ".join([ "(?, ?)" ] * len(pairs))
+        sql = f"SELECT t.tbl, t.col, pg_get_serial_sequence(t.tbl, t.col) FROM (VALUES {values}) AS t(tbl, col);"
+        rows = ttcxn.cursor().execute(sql, [ item for pair in pairs for item in pair ]).fetchall()
+        setvals, params = [], []
+        for quoted_table, pkey, seq in rows:
             if seq:
-                quoted_pkey = self.quote(pkey)
-                ttcxn.cursor().execute(f"select setval('{seq}', (select MAX({quoted_pkey}) FROM {quoted_table}));")
-                self.logger.debug(f"Primary key has sequence {seq} - resetting its value")
+                self.logger.debug(f"Primary key {quoted_table}.{pkey} has sequence {seq} - resetting its value")
+                setvals.append(f"setval(CAST(? AS regclass), (SELECT MAX({self.quote(pkey)}) FROM {quoted_table}))")
+                params.append(seq)
+        if setvals:
+            ttcxn.cursor().execute("SELECT " + ", ".join(setvals) + ";", params)
+
+    def get_native_connection_args(self):
+        odbc_args = {}
+        for part in self.get_connection_string().split(";"):
+            if "=" in part:
+                key, value = part.split("=", 1)
+                odbc_args[key.strip().lower()] = value.strip()
+        args = dict(host=odbc_args.get("server"), port=odbc_args.get("port"), dbname=odbc_args.get("database"),
+                    user=odbc_args.get("uid"), password=odbc_args.get("pwd"))
+        return { key: value for key, value in args.items() if value }
+
+    def make_copy_connection(self):
+        try:
+            import psycopg as native
+        except ModuleNotFoundError:
+            try:
+                import psycopg2 as native
+            except ModuleNotFoundError:
+                self.logger.warning("fast_load for Postgres needs psycopg or psycopg2 installed, loading data with normal inserts")
+                return
+        self.native_module = native
+        cxn = native.connect(**self.get_native_connection_args())
+        cxn.autocommit = True
+        return cxn
+
+    @classmethod
+    def to_copy_text(cls, value):
+        if value is None:
+            return "\\N"
+        elif isinstance(value, (bytes, bytearray)):
+            return "\\\\x" + value.hex()
+        elif isinstance(value, bool):
+            return "t" if value else "f"
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def copy_rows(self, table_name, rows):
+        columns = list(rows[0])
+        quoted_columns = ", ".join([ self.quote(col) for col in columns ])
+        sql = f"COPY {self.quote(table_name)} ({quoted_columns}) FROM STDIN"
+        lines = ( "\t".join([ self.to_copy_text(row.get(col)) for col in columns ]) + "\n" for row in rows )
+        try:
+            with self.copycxn.cursor() as cursor:
+                if hasattr(cursor, "copy"): # psycopg 3
+                    with cursor.copy(sql) as copy:
+                        for line in lines:
+                            copy.write(line)
+                else:
+                    cursor.copy_expert(sql, CopyStream(lines))
+            self.instrumentation.count("round_trips")
+            self.instrumentation.count("rows_inserted", len(rows), table_name)
+        except self.native_module.IntegrityError as e:
+            # so that read_table_files can retry tables that fail on foreign keys, as it does for inserts
+            raise pyodbc.IntegrityError(str(e)) from e
+        except self.native_module.Error:
+            self.logger.error("Failed to copy data into " + table_name)
+            raise
@@ -0,0 +1,158 @@
+'''
+Regenerates the tables dirs of many test directories in one process, e.g. after a schema change, instead of running
+each test to get write_data_increment called
+
+e.g. python -m dbtext.regenerate --dbtext-class Sqlite3_DBText --sqlfile empty_db.sql --workers 4 tests/*
+'''
+
+import os, sys, shutil, filecmp, tempfile, time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .pool import DBTextPool
+
+class FixtureRegenerator:
+    """
+    Each test directory's tables dir is loaded on top of the base data (the sqlfile and base_tables_dir) in a database
+    from a DBTextPool, and written back with only the rows that differ from the base data, as write_data_increment does.
+    The base data is loaded and dumped once, and up to "workers" test directories are regenerated at a time.
+    Where the server can copy a database (Sqlite3 and Postgres), each test directory gets a copy of the base database,
+    otherwise the pool loads the base data into each one in the background.
+
+    :param dbtext_class: the DBText subclass for your database server, e.g. MSSQL_DBText or Sqlite3_DBText
+    :param name_prefix: as for DBTextPool, it decides the name of the tables dir, e.g. "birds" for birdsdb_tables
+    """
+    def __init__(self, dbtext_class, sqlfile=None, base_tables_dir=None, encoding=None, workers=1, name_prefix="",
+                 dbtext_args=None, create_args=None):
+        self.logger = logging.getLogger("dbtext")
+        self.pool = DBTextPool(dbtext_class, sqlfile, base_tables_dir, encoding, size=workers, name_prefix=name_prefix,
+                               dbtext_args=dbtext_args, create_args=create_args)
+        self.workers = workers
+        self.base_db = None
+        self.base_dump_dir = None
+
+    def regenerate(self, test_dirs):
+        """
+        Returns a list of (test dir, added, removed, changed) for the files of each test directory's tables dir,
+        or (test dir, exception) for any that failed, in the order given
+        """
+        start = time.monotonic()
+        self.base_db = self.pool.create_database()
+        try:
+            self.base_dump_dir = self.dump_base_data()
+            self.pool.template = self.base_db.database_name
+            with self.pool:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dbtext-regenerate") as executor:
+                    results = list(executor.map(self.regenerate_safely, test_dirs))
+        finally:
+            if self.base_dump_dir:
+                shutil.rmtree(self.base_dump_dir, ignore_errors=True)
+            self.pool.discard(self.base_db)
+        self.logger.info(f"Regenerated {len(test_dirs)} test directories in {time.monotonic() - start:.2f} seconds")
+        return results
+
+    def dump_base_data(self):
+        base_dump_dir = tempfile.mkdtemp(prefix="dbtext_base_")
+        self.base_db.write_data(base_dump_dir)
+        # so that it can be copied
+        self.base_db.close_connections()
+        return base_dump_dir
+
+    def regenerate_safely(self, test_dir):
+        try:
+            return self.regenerate_test_dir(test_dir)
+        except Exception as e:
+            self.logger.error(f"Failed to regenerate tables in {test_dir}: {e}")
+            return test_dir, e
+
+    def regenerate_test_dir(self, test_dir):
+        db = self.pool.acquire()
+        try:
+            tables_dir = os.path.join(test_dir, db.get_tables_dir_name())
+            backup_dir = tables_dir + "_old"
+            if os.path.isdir(tables_dir):
+                self.load_test_tables_dir(db, tables_dir)
+                os.rename(tables_dir, backup_dir)
+            try:
+                # Increments are relative to the base data, so that's what the test's tables dir is compared with
+                shutil.copytree(os.path.join(self.base_dump_dir, db.get_tables_dir_name()), tables_dir)
+                db.write_data_increment(test_dir)
+            except Exception:
+                shutil.rmtree(tables_dir, ignore_errors=True)
+                if os.path.isdir(backup_dir):
+                    os.rename(backup_dir, tables_dir)
+                raise
+            finally:
+                for suffix in [ "_orig", "_prereduce" ]:
+                    shutil.rmtree(tables_dir + suffix, ignore_errors=True)
+            changes = self.compare_dirs(backup_dir, tables_dir)
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            return (test_dir, *changes)
+        finally:
+            self.pool.discard(db)
+
+    @classmethod
+    def is_increment_file(cls, fn):
+        # Tables that only gained rows are written by write_data_increment with just the new rows, as "ROW:+"
+        if not fn.endswith(".table"):
+            return False
+        with open(fn) as f:
+            return f.readline().startswith("ROW:+")
+
+    def load_test_tables_dir(self, db, tables_dir):
+        # Any other table file holds all of the table's rows, so the base data for that table must go first
+        replaced = [ os.path.basename(fn).rsplit(".", 1)[0] for fn in db.get_table_files(tables_dir) if not self.is_increment_file(fn) ]
+        with db.database_connection() as ttcxn:
+            db.empty_tables(ttcxn, replaced)
+            db.read_tables_dir(ttcxn, tables_dir)
+
+    @classmethod
+    def get_relative_files(cls, dirname):
+        files = set()
+        for root, _, fileNames in os.walk(dirname):
+            files.update(os.path.relpath(os.path.join(root, fn), dirname) for fn in fileNames)
+        return files
+
+    @classmethod
+    def compare_dirs(cls, old_dir, new_dir):
+        oldFiles = cls.get_relative_files(old_dir)
+        newFiles = cls.get_relative_files(new_dir)
+        changed = [ fn for fn in sorted(oldFiles & newFiles)
+                    if not filecmp.cmp(os.path.join(old_dir, fn), os.path.join(new_dir, fn), shallow=False) ]
+        return sorted(newFiles - oldFiles), sorted(oldFiles - newFiles), changed
+
+
+def write_summary(results, stream=sys.stdout):
+    failed = 0
+    for test_dir, *changes in results:
+        if len(changes) == 1:
+            failed += 1
+            stream.write(f"{test_dir}: FAILED: {changes[0]}\n")
+            continue
+        lines = [ f"   {kind} {fn}" for kind, files in zip("+-~", changes) for fn in files ]
+        stream.write(f"{test_dir}: " + (f"{len(lines)} files changed\n" if lines else "unchanged\n"))
+        for line in lines:
+            stream.write(line + "\n")
+    if failed:
+        stream.write(f"{failed} of {len(results)} test directories could not be regenerated\n")
+
+def main():
+    import dbtext
+    parser = argparse.ArgumentParser(description="Regenerate the tables dirs of many test directories against the current schema")
+    parser.add_argument("test_dirs", nargs="+", help="test directories, each containing a tables dir")
+    parser.add_argument("--dbtext-class", default="Sqlite3_DBText", help="e.g. MSSQL_DBText, MySQL_DBText, Postgres_DBText")
+    parser.add_argument("--sqlfile", help="the schema script")
+    parser.add_argument("--base-tables", help="tables dir with data shared by all the tests, which they are increments of")
+    parser.add_argument("--encoding", help="encoding of the schema script")
+    parser.add_argument("--name-prefix", default="", help="decides the name of the tables dir, e.g. 'birds' for birdsdb_tables")
+    parser.add_argument("--workers", type=int, default=1, help="test directories to regenerate at once")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    regenerator = FixtureRegenerator(getattr(dbtext, args.dbtext_class), args.sqlfile, args.base_tables, args.encoding,
+                                     args.workers, args.name_prefix)
+    results = regenerator.regenerate(args.test_dirs)
+    write_summary(results)
+    return 1 if any(len(result) == 2 for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,143 @@
 #!/usr/bin/python
 
-import sqlite3
+import sqlite3, os, time
+from glob import glob
 from .base_odbc import DBText
 
 class Sqlite3_DBText(DBText):
 
     @classmethod
     def make_connection(cls, dbname):
-        return sqlite3.connect(f"{dbname}.db")
+        # Pooled connections may be used by other threads, e.g. for the async methods, though never by two at once
+        return sqlite3.connect(f"{dbname}.db", check_same_thread=False)
 
     def create_empty_db(self):
         pass
 
+    def copy_database(self, source_name):
+        source = sqlite3.connect(f"{source_name}.db")
+        target = sqlite3.connect(f"{self.database_name}.db")
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.iscreated = True
+        return True
+
     def drop(self):
-        pass
+        # Leaves the file for inspection
+        self.close_connections()
+        self.instrumentation.write_summary()
+
+    def cast_to_text(self, expression):
+        return f"CAST({expression} AS TEXT)"
+
+    @classmethod
+    def make_blob(cls, blobFiles, blobType):
+        # sqlite3 takes bytes as they are, no need for pyodbc
+        blobs = [ open(fn, "rb").read() for fn in blobFiles ]
+        return cls.package_blobs(blobs, blobType)
+
+    def get_database_names(self):
+        return [ os.path.basename(fn)[:-3] for fn in glob("*.db") ]
+
+    def get_database_ages(self):
+        now = time.time()
+        return { os.path.basename(fn)[:-3]: now - os.path.getmtime(fn) for fn in glob("*.db") }
+
+    def drop_database(self, dbname):
+        # drop() leaves the file for inspection, but other databases are only dropped when we want rid of them
+        fn = f"{dbname}.db"
+        if os.path.isfile(fn):
+            os.remove(fn)
+
+    def read_tables_dir(self, ttcxn, tables_dir_name):
+        if not self.fast_load:
+            return DBText.read_tables_dir(self, ttcxn, tables_dir_name)
+        # One transaction with the journal in memory and no syncs, foreign keys checked only at commit.
+        # Normal durability is restored before the file is handed to the system under test.
+        start = time.perf_counter()
+        journal_mode = ttcxn.execute("PRAGMA journal_mode").fetchone()[0]
+        synchronous = ttcxn.execute("PRAGMA synchronous").fetchone()[0]
+        ttcxn.execute("PRAGMA journal_mode = MEMORY")
+        ttcxn.execute("PRAGMA synchronous = OFF")
+        try:
+            ttcxn.execute("BEGIN")
+            ttcxn.execute("PRAGMA defer_foreign_keys = ON")
+            DBText.read_tables_dir(self, ttcxn, tables_dir_name)
+            ttcxn.commit()
+        except BaseException:
+            ttcxn.rollback()
+            raise
+        finally:
+            ttcxn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            ttcxn.execute(f"PRAGMA synchronous = {synchronous}")
+        self.logger.debug(f"Loaded {tables_dir_name} in {time.perf_counter() - start:.3f} seconds")
 
     def execute_setup_query(self, ttcxn, currQuery):
         ttcxn.executescript(currQuery)
 
+    def execute_setup_batches(self, ttcxn, batches, sqlfile):
+        # executescript can run the whole file in one call, whatever the batches were.
+        # The terminators go on lines of their own, as a batch may end with a -- comment
+        script = "\n;\n".join(query for _, query in batches)
+        self.instrumentation.count("round_trips")
+        try:
+            ttcxn.executescript(script)
+        except sqlite3.Error:
+            self.report_setup_failure(batches, sqlfile)
+            raise
+
+    def report_setup_failure(self, batches, sqlfile):
+        # executescript doesn't say which statement failed, and has already run the ones before it.
+        # So replay the statements one by one in a scratch in-memory database to find it.
+        scratch = sqlite3.connect(":memory:")
+        try:
+            for lineNumbers, query in batches:
+                statement, startLine = "", None
+                for lineNumber, line in zip(lineNumbers, query.split("\n")):
+                    statement += line + "\n"
+                    startLine = startLine or lineNumber
+                    if sqlite3.complete_statement(statement) or lineNumber == lineNumbers[-1]:
+                        try:
+                            scratch.executescript(statement)
+                        except sqlite3.Error:
+                            self.logger.error(f"Failed to execute setup query from {sqlfile}, line {startLine}:\n{statement}")
+                            return
+                        statement, startLine = "", None
+        finally:
+            scratch.close()
+        self.logger.error(f"Failed to execute setup script {sqlfile}")
+
     def get_table_names(self, ttcxn):
         cursor = ttcxn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = [name[0] for name in cursor.fetchall()]
         return tables
 
+    def get_subset_key_columns(self, ttcxn, tablename):
+        # Sqlite3 has no primaryKeys(), but table_info gives each column's position in the primary key
+        cursor = ttcxn.cursor()
+        cursor.execute(f"PRAGMA TABLE_INFO({tablename})")
+        return tuple(info[1] for info in sorted(cursor.fetchall(), key=lambda info: info[5]) if info[5])
+
+    def get_foreign_keys(self, ttcxn):
+        result = []
+        for table_name in self.get_table_names(ttcxn):
+            fkeys = {}
+            for info in ttcxn.cursor().execute(f"PRAGMA foreign_key_list({table_name})"):
+                fkeys.setdefault(info[0], []).append(info)
+            for infos in fkeys.values():
+                infos.sort(key=lambda info: info[1])
+                parent_table = infos[0][2]
+                # The parent columns are left out when the key refers to the parent's primary key
+                parent_cols = tuple(info[4] for info in infos)
+                if None in parent_cols:
+                    parent_cols = self.get_subset_key_columns(ttcxn, parent_table)
+                result.append((table_name, tuple(info[3] for info in infos), parent_table, parent_cols))
+        return result
+
     def query_for_columns(self, ttcxn, tablename):
         cursor = ttcxn.cursor()
         cursor.execute(f"PRAGMA TABLE_INFO({tablename})")
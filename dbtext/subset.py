@@ -0,0 +1,138 @@
+'''
+Extracts a small but referentially complete subset of a database as a tables dir, starting from some chosen rows
+and following foreign keys from there
+'''
+
+import time
+import logging
+
+class SubsetExtractor:
+    """
+    Starts from root rows, given as (table name, constraint) e.g. ("orders", "WHERE id = 1234"), and follows foreign keys:
+    - to parent tables always, so every row written has the rows it refers to
+    - to child tables up to max_child_depth steps away from a root row, taking at most max_child_rows rows per child table.
+    Rows that are only there as parents don't bring in their own children, unless a root or child key reaches them too.
+    Rows are fetched in batches of batch_size query parameters, i.e. fewer keys per batch for composite keys.
+
+    :param db: the DBText instance to extract from
+    """
+    def __init__(self, db, max_child_depth=1, max_child_rows=1000, batch_size=500):
+        self.logger = logging.getLogger("dbtext")
+        self.db = db
+        self.max_child_depth = max_child_depth
+        self.max_child_rows = max_child_rows
+        self.batch_size = batch_size
+        self.table_rows = {} # table name -> { row tuple: None }, i.e. an ordered set
+        self.table_colnames = {}
+        self.fetched_keys = {} # (table name, columns) -> set of key values already queried
+        self.children_followed = {} # table name -> set of row tuples whose children have been followed
+        self.child_row_counts = {}
+        self.elapsed = None
+
+    def extract(self, writeDir, roots):
+        """
+        Writes the subset to a tables dir under writeDir, which create() can load as usual.
+        Returns a dictionary of table name to the number of rows written.
+        """
+        start = time.monotonic()
+        with self.db.database_connection() as ttcxn:
+            self.foreign_keys = self.db.get_foreign_keys(ttcxn)
+            pending = []
+            for tablename, constraint in roots:
+                rows, colnames = self.db.extract_data_for_dump(ttcxn, tablename, constraint)
+                self.add_rows(tablename, rows, colnames)
+                pending.append((tablename, list(map(tuple, rows)) if colnames else [], 0, True))
+            while pending:
+                tablename, rows, depth, follow_children = pending.pop(0)
+                if rows:
+                    pending += self.follow_foreign_keys(ttcxn, tablename, rows, depth, follow_children)
+        self.write_tables(writeDir)
+        self.elapsed = time.monotonic() - start
+        row_counts = { tablename: len(rows) for tablename, rows in self.table_rows.items() }
+        for tablename, count in sorted(row_counts.items()):
+            self.logger.info(f"Subset of {tablename}: {count} rows")
+        self.logger.info(f"Extracted {sum(row_counts.values())} rows from {len(row_counts)} tables in {self.elapsed:.2f} seconds")
+        return row_counts
+
+    def add_rows(self, tablename, rows, colnames):
+        if not colnames:
+            return []
+        self.table_colnames.setdefault(tablename, colnames)
+        known_rows = self.table_rows.setdefault(tablename, {})
+        new_rows = []
+        for row in map(tuple, rows):
+            if row not in known_rows:
+                known_rows[row] = None
+                new_rows.append(row)
+        return new_rows
+
+    def follow_foreign_keys(self, ttcxn, tablename, rows, depth, follow_children):
+        # Parents only need their own parents, following their children as well would pull in most of the database.
+        # A row already fetched as a parent still has its children followed when a root or child edge reaches it.
+        # Those come off the queue in order of depth, so the first time is always the closest to a root
+        pending = []
+        if follow_children and depth < self.max_child_depth:
+            followed = self.children_followed.setdefault(tablename, set())
+            child_rows = [ row for row in rows if row not in followed ]
+            followed.update(child_rows)
+        else:
+            child_rows = []
+        for child_table, child_cols, parent_table, parent_cols in self.foreign_keys:
+            if child_table == tablename:
+                new_rows = self.fetch_related(ttcxn, rows, tablename, child_cols, parent_table, parent_cols)
+                pending.append((parent_table, new_rows, depth, False))
+            if parent_table == tablename and child_rows:
+                found_rows = self.fetch_related(ttcxn, child_rows, tablename, parent_cols, child_table, child_cols, child=True)
+                pending.append((child_table, found_rows, depth + 1, True))
+        return pending
+
+    def get_key_values(self, rows, tablename, columns):
+        colnames = [ colname for colname, _ in self.table_colnames[tablename] ]
+        indices = [ colnames.index(col) for col in columns ]
+        values = {}
+        for row in rows:
+            value = tuple(row[ix] for ix in indices)
+            if None not in value:
+                values[value] = None
+        return list(values)
+
+    def fetch_related(self, ttcxn, rows, tablename, columns, other_table, other_columns, child=False):
+        """
+        Returns the rows that are new to the subset, or for children all rows found, as they may have been fetched as parents
+        """
+        fetched = self.fetched_keys.setdefault((other_table, other_columns), set())
+        values = [ value for value in self.get_key_values(rows, tablename, columns) if value not in fetched ]
+        fetched.update(values)
+        new_rows = []
+        # MSSQL allows at most 2100 parameters per query
+        batch_size = max(1, self.batch_size // len(other_columns))
+        for ix in range(0, len(values), batch_size):
+            if child and self.child_row_counts.get(other_table, 0) >= self.max_child_rows:
+                self.logger.warning(f"Reached the limit of {self.max_child_rows} rows for {other_table}, subset will not contain all of its rows")
+                break
+            batch = values[ix:ix + batch_size]
+            constraint, params = self.make_key_constraint(other_columns, batch)
+            batch_rows, colnames = self.db.extract_data_for_dump(ttcxn, other_table, constraint, params)
+            if child:
+                batch_rows = batch_rows[:self.max_child_rows - self.child_row_counts.get(other_table, 0)]
+            added = self.add_rows(other_table, batch_rows, colnames)
+            if child:
+                self.child_row_counts[other_table] = self.child_row_counts.get(other_table, 0) + len(added)
+                new_rows += map(tuple, batch_rows)
+            else:
+                new_rows += added
+        return new_rows
+
+    def make_key_constraint(self, columns, values):
+        params = [ item for value in values for item in value ]
+        if len(columns) == 1:
+            placeholders = ",".join("?" * len(values))
+            return f"WHERE {self.db.quote(columns[0])} IN ({placeholders})", params
+        match = "(" + " AND ".join(f"{self.db.quote(col)} = ?" for col in columns) + ")"
+        return "WHERE " + " OR ".join([ match ] * len(values)), params
+
+    def write_tables(self, writeDir):
+        table_file_pattern, blob_patterns = self.db.make_empty_tables_dir(writeDir)
+        for tablename, rows in self.table_rows.items():
+            if rows:
+                self.db.write_dump_data(list(rows), self.table_colnames[tablename], tablename, table_file_pattern, blob_patterns)
@@ -0,0 +1,162 @@
+'''
+A compact representation of a table's rows, with the column names stored once and each row as a tuple
+'''
+
+from collections.abc import Mapping, Sequence
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+# Stands in for columns a row doesn't have, so rows behave exactly like the dicts they were made from
+MISSING = _Missing()
+
+class Row(Mapping):
+    """
+    A read-only dict-like view of one row of a TableData. Compares equal to a dict with the same items.
+    """
+    __slots__ = ("_indices", "_values")
+    def __init__(self, indices, values):
+        self._indices = indices
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._indices[key]]
+
+    def __iter__(self):
+        return iter(self._indices)
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __contains__(self, key):
+        return key in self._indices
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._indices, self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Row) and other._indices is self._indices:
+            return self._values == other._values
+        return Mapping.__eq__(self, other)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class SparseRow(Row):
+    """
+    A row from a table where some rows don't have all the columns
+    """
+    __slots__ = ()
+    def __getitem__(self, key):
+        value = self._values[self._indices[key]]
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (col for col, value in zip(self._indices, self._values) if value is not MISSING)
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not MISSING)
+
+    def __contains__(self, key):
+        return key in self._indices and self._values[self._indices[key]] is not MISSING
+
+    def values(self):
+        return tuple(value for value in self._values if value is not MISSING)
+
+    def items(self):
+        return ((col, value) for col, value in zip(self._indices, self._values) if value is not MISSING)
+
+
+class TableData(Sequence):
+    """
+    Column names are stored once and rows as tuples of values in column order, which takes a fraction of the memory
+    of a list of dicts for large tables. It can be used as a list of (read-only) row dicts, e.g. for row in table: row["id"]
+    """
+    __slots__ = ("columns", "rows", "sparse", "_indices")
+    def __init__(self, columns=(), rows=None):
+        self.columns = tuple(columns)
+        self.rows = rows if rows is not None else []
+        self.sparse = False
+        self._indices = { col: ix for ix, col in enumerate(self.columns) }
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        table = cls()
+        for row_dict in dicts:
+            table.append_dict(row_dict)
+        return table
+
+    def append(self, values):
+        self.rows.append(tuple(values))
+
+    def append_dict(self, row_dict):
+        if len(row_dict) == len(self.columns):
+            if tuple(row_dict) == self.columns:
+                self.rows.append(tuple(row_dict.values()))
+                return
+            if all(map(self._indices.__contains__, row_dict)):
+                self.rows.append(tuple(row_dict[col] for col in self.columns))
+                return
+        new_columns = [ col for col in row_dict if col not in self._indices ]
+        if new_columns:
+            self.add_columns(new_columns)
+        if len(row_dict) < len(self.columns):
+            self.sparse = True
+        self.rows.append(tuple(row_dict.get(col, MISSING) for col in self.columns))
+
+    def add_columns(self, new_columns):
+        if self.rows:
+            padding = (MISSING,) * len(new_columns)
+            self.rows = [ row + padding for row in self.rows ]
+            self.sparse = True
+        self.columns += tuple(new_columns)
+        self._indices = { col: ix for ix, col in enumerate(self.columns) }
+
+    def get_row_class(self):
+        return SparseRow if self.sparse else Row
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            table = TableData(self.columns, self.rows[ix])
+            table.sparse = self.sparse
+            return table
+        return self.get_row_class()(self._indices, self.rows[ix])
+
+    def __iter__(self):
+        row_class = self.get_row_class()
+        indices = self._indices
+        for values in self.rows:
+            yield row_class(indices, values)
+
+    def __repr__(self):
+        return f"TableData({self.columns!r}, {len(self.rows)} rows)"
+
+    def get_value_tuples(self, missing=None):
+        """
+        The rows as tuples in column order, with "missing" for any columns a row doesn't have
+        """
+        if not self.sparse:
+            return self.rows
+        return [ tuple(missing if value is MISSING else value for value in row) for row in self.rows ]
+
+    def column(self, name):
+        """
+        All the values in one column, as a list, with None where a row doesn't have the column
+        """
+        ix = self._indices[name]
+        return [ None if row[ix] is MISSING else row[ix] for row in self.rows ]
+
+    def to_dicts(self):
+        if self.sparse:
+            return [ dict(row.items()) for row in self ]
+        return [ dict(zip(self.columns, row)) for row in self.rows ]
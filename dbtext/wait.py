@@ -1,6 +1,5 @@
 
-from threading import Thread
-import time
+from threading import Thread, Event
 
 class PipeReaderThread(Thread):
     def __init__(self, proc, ready_text, filename=None):
@@ -8,20 +7,29 @@ class PipeReaderThread(Thread):
         self.proc = proc
         self.ready_bytes = ready_text.encode()
         self.ready_line = None
+        self.ready_event = Event()
         self.logfile = open(filename, "wb") if filename else None
         
     def run(self):
-        while self.proc.poll() is None:
-            line = self.proc.stdout.readline()
-            if self.ready_line is None and self.ready_bytes in line:
-                self.ready_line = line.decode().strip()
-            if self.logfile and not self.logfile.closed:
-                self.logfile.write(line)
-                self.logfile.flush()
+        try:
+            while self.proc.poll() is None:
+                line = self.proc.stdout.readline()
+                if self.ready_line is None and self.ready_bytes in line:
+                    self.ready_line = line.decode().strip()
+                    self.ready_event.set()
+                if self.logfile and not self.logfile.closed:
+                    self.logfile.write(line)
+                    self.logfile.flush()
+        finally:
+            # process has exited, don't leave anyone waiting for text that will never come
+            self.ready_event.set()
                 
-    def wait_for_text(self):
-        while self.ready_line is None:
-            time.sleep(0.1)
+    def wait_for_text(self, timeout=None):
+        """
+        Returns the line containing the ready text as soon as it is read, 
+        or None if the process exits (or the timeout expires) without writing it.
+        """
+        self.ready_event.wait(timeout)
         return self.ready_line
     
     def terminate(self):
@@ -29,4 +37,3 @@ class PipeReaderThread(Thread):
             self.logfile.close()
         self.proc.terminate()
         self.join()
-
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+'''
+Measures what "import dbtext" costs, and what using each backend adds, in fresh processes.
+Drivers can be hidden to see the cost without them, as if they weren't installed.
+
+e.g. python import_time.py --repeat 20 --output import_times.json
+'''
+
+import os, sys, json, subprocess, statistics, argparse
+
+package_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+backends = [ "Sqlite3_DBText", "MSSQL_DBText", "MySQL_DBText", "Postgres_DBText", "Mongo_DBText" ]
+
+# Driver modules to hide for each scenario. A None entry in sys.modules makes importing it fail as if it wasn't installed
+scenarios = {
+    "installed drivers": [],
+    "without pyodbc": [ "pyodbc" ],
+    "without pymongo": [ "bson", "pymongo" ],
+    "without any drivers": [ "pyodbc", "bson", "pymongo" ]
+}
+
+measure_script = '''
+import sys, time, json
+for name in {hidden!r}:
+    sys.modules[name] = None
+start = time.perf_counter()
+import dbtext
+times = {{ "import dbtext": time.perf_counter() - start }}
+for backend in {backends!r}:
+    start = time.perf_counter()
+    getattr(dbtext, backend)
+    times[backend] = time.perf_counter() - start
+print(json.dumps(times))
+'''
+
+def measure_once(hidden):
+    script = measure_script.format(hidden=hidden, backends=backends)
+    env = dict(os.environ, PYTHONPATH=package_root + os.pathsep + os.getenv("PYTHONPATH", ""))
+    output = subprocess.run([ sys.executable, "-c", script ], env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+def measure(repeat):
+    results = []
+    for scenario, hidden in scenarios.items():
+        runs = [ measure_once(hidden) for _ in range(repeat) ]
+        for operation in runs[0]:
+            times = [ run[operation] for run in runs ]
+            results.append({ "backend": "import", "scenario": scenario, "operation": operation, "times": times,
+                             "min": min(times), "median": statistics.median(times) })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Time 'import dbtext' and first use of each backend in fresh processes")
+    parser.add_argument("--repeat", type=int, default=10, help="processes to start for each scenario")
+    parser.add_argument("--output", help="file to write the results to, default is standard output")
+    args = parser.parse_args()
+    text = json.dumps({ "python": sys.version.split()[0], "repeat": args.repeat, "results": measure(args.repeat) }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+'''
+Times the main dbtext operations on synthetic fixtures (see synthetic.py) and writes the results as JSON,
+so that runs with different dbtext versions or settings can be compared.
+Runs offline against Sqlite3, and against a local MongoDB as well if mongod and pymongo are installed.
+
+e.g. python run_benchmarks.py --rows 10000 --repeat 5 --output before.json
+'''
+
+import os, sys, json, time, shutil, tempfile, platform, statistics, argparse
+import importlib.util
+from contextlib import contextmanager
+
+from synthetic import SyntheticFixture, add_fixture_arguments, make_fixture
+import import_time
+import dbtext
+
+class Benchmark_DBText(dbtext.Sqlite3_DBText):
+    def get_blob_patterns(self):
+        return SyntheticFixture.get_blob_patterns()
+
+    def get_blob_patterns_for_dump(self, sut_ext):
+        return [ "blob_${blob_key}." + sut_ext ]
+
+class Timer:
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def time(self, operation):
+        start = time.perf_counter()
+        yield
+        self.times.setdefault(operation, []).append(time.perf_counter() - start)
+
+    def get_results(self, backend):
+        return [ { "backend": backend, "operation": operation, "times": times,
+                   "min": min(times), "median": statistics.median(times) } for operation, times in self.times.items() ]
+
+@contextmanager
+def run_directory(workdir):
+    run_dir = tempfile.mkdtemp(dir=workdir)
+    cwd = os.getcwd()
+    os.chdir(run_dir)
+    try:
+        yield run_dir
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+def benchmark_sqlite3(fixture, workdir, repeat):
+    schema = os.path.join(workdir, "schema.sql")
+    tables_dir = os.path.join(workdir, "benchdb_tables")
+    fixture.write_schema(schema)
+    fixture.write_tables_dir(tables_dir)
+    timer = Timer()
+    for _ in range(repeat):
+        with run_directory(workdir) as run_dir:
+            db = Benchmark_DBText("benchdb_" + str(os.getpid()))
+            with timer.time("create"):
+                db.create(sqlfile=schema, tables_dir=tables_dir)
+            with timer.time("dumptables"):
+                db.dumptables("bench", "*", usemaxcol="")
+            db.write_data(run_dir, json_format=True)
+            with db.make_connection(db.database_name) as cxn:
+                for statement in fixture.make_change_statements():
+                    cxn.execute(statement)
+            with timer.time("dumpchanges"):
+                db.dumpchanges("{type}.bench", tables_dir=os.path.join(run_dir, db.get_tables_dir_name(json_format=True)))
+            shutil.copytree(tables_dir, os.path.join(run_dir, db.get_tables_dir_name()))
+            with timer.time("write_data_increment"):
+                db.write_data_increment(run_dir)
+            db.drop()
+    return timer.get_results("sqlite3")
+
+def mongo_available():
+    if importlib.util.find_spec("pymongo") is None:
+        return False
+    return dbtext.LocalMongo_DBText.set_mongo_exe()
+
+def benchmark_mongo(fixture, workdir, repeat, ephemeral=False):
+    data_dir = os.path.join(workdir, "mongodata")
+    fixture.write_mongo_data_dir(data_dir)
+    timer = Timer()
+    for _ in range(repeat):
+        with run_directory(workdir) as run_dir:
+            with dbtext.LocalMongo_DBText(data_dirname=data_dir, db_dirname=os.path.join(run_dir, "mongo")) as db:
+                with timer.time("create"):
+                    db.create(ephemeral=ephemeral)
+                for name, startup_time in db.startup_timings.items():
+                    timer.times.setdefault("create:" + name, []).append(startup_time)
+                collections = db.text_client.client["synthetic"]
+                for collection_name, updated, deleted, new_docs in fixture.make_mongo_changes():
+                    collection = collections[collection_name]
+                    collection.update_many({ "_id": { "$in": updated } }, { "$set": { "c0": "changed" } })
+                    collection.delete_many({ "_id": { "$in": deleted } })
+                    collection.insert_many(new_docs)
+                with timer.time("dump_changes"):
+                    db.dump_changes("bench")
+                with timer.time("dump_data_directory"):
+                    db.dump_data_directory(os.path.join(run_dir, "dumped"))
+    return timer.get_results("mongo-ephemeral" if ephemeral else "mongo")
+
+def benchmark_mongo_ephemeral(fixture, workdir, repeat):
+    return benchmark_mongo(fixture, workdir, repeat, ephemeral=True)
+
+def benchmark_import(fixture, workdir, repeat):
+    return import_time.measure(repeat)
+
+def get_dbtext_version():
+    try:
+        from importlib.metadata import version
+        return version("dbtext")
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Time dbtext operations on synthetic fixtures and write the results as JSON")
+    add_fixture_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3, help="times to run each benchmark")
+    parser.add_argument("--backends", default="sqlite3,mongo,import", help="comma-separated, from sqlite3, mongo, mongo-ephemeral and import")
+    parser.add_argument("--output", help="file to write the results to, default is standard output")
+    args = parser.parse_args()
+    fixture = make_fixture(args)
+    backends = { "sqlite3": (benchmark_sqlite3, lambda: True), "mongo": (benchmark_mongo, mongo_available),
+                 "mongo-ephemeral": (benchmark_mongo_ephemeral, mongo_available),
+                 "import": (benchmark_import, lambda: True) }
+    results = []
+    skipped = []
+    workdir = tempfile.mkdtemp(prefix="dbtext_bench")
+    try:
+        for backend in args.backends.split(","):
+            run_benchmark, is_available = backends[backend]
+            if is_available():
+                print(f"Running {backend} benchmarks...", file=sys.stderr)
+                results += run_benchmark(fixture, workdir, args.repeat)
+            else:
+                print(f"Skipping {backend} benchmarks, it isn't installed", file=sys.stderr)
+                skipped.append(backend)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "dbtext_version": get_dbtext_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "fixture": fixture.get_parameters(),
+        "repeat": args.repeat,
+        "skipped": skipped,
+        "results": results
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+'''
+Generates synthetic schemas and fixtures of a given size for benchmarking dbtext.
+The same parameters and seed always give the same files.
+'''
+
+import os, sys, json, random, argparse
+from string import Template
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from dbtext import DBText
+
+class SyntheticFixture:
+    """
+    Tables t0, t1 ... each have an integer id, "columns" text columns of "width" characters and,
+    if blob_bytes is set, a binary payload column of that many bytes. As DBText writes them, the payloads go in blob files
+    named after a blob_key column, see get_blob_patterns. The MongoDB data has them as hex, as JSON has no binary format.
+    Tables form foreign key chains fk_depth long, e.g. with fk_depth=2 t1 refers to t0, t2 to t1, t3 starts a new chain.
+    """
+    def __init__(self, tables=5, rows=1000, columns=5, width=20, blob_bytes=0, fk_depth=2, seed=1):
+        self.tables = tables
+        self.rows = rows
+        self.columns = columns
+        self.width = width
+        self.blob_bytes = blob_bytes
+        self.fk_depth = fk_depth
+        self.seed = seed
+
+    def get_parameters(self):
+        return dict(vars(self))
+
+    def get_table_names(self):
+        return [ f"t{ix}" for ix in range(self.tables) ]
+
+    def get_parent(self, ix):
+        if self.fk_depth and ix % (self.fk_depth + 1):
+            return f"t{ix - 1}"
+
+    def get_column_names(self, ix):
+        colnames = [ "id" ]
+        if self.get_parent(ix):
+            colnames.append("parent_id")
+        colnames += [ f"c{col}" for col in range(self.columns) ]
+        if self.blob_bytes:
+            colnames += [ "blob_key", "payload" ]
+        return colnames
+
+    @classmethod
+    def get_blob_patterns(cls):
+        # relative to the tables dir
+        return [ "payloads/${blob_key}.bin" ]
+
+    def write_schema(self, fn):
+        with open(fn, "w") as f:
+            for ix, tablename in enumerate(self.get_table_names()):
+                coldefs = [ "id INTEGER PRIMARY KEY" ]
+                parent = self.get_parent(ix)
+                if parent:
+                    coldefs.append(f"parent_id INTEGER REFERENCES {parent}(id)")
+                coldefs += [ f"c{col} VARCHAR({self.width})" for col in range(self.columns) ]
+                if self.blob_bytes:
+                    coldefs += [ "blob_key VARCHAR(20)", "payload VARBINARY" ]
+                f.write(f"CREATE TABLE {tablename} (\n    " + ",\n    ".join(coldefs) + "\n);\n\n")
+
+    def make_text(self, rand, length):
+        return "".join(rand.choices("abcdefghijklmnopqrstuvwxyz ", k=length)).strip() or "x"
+
+    def make_row(self, rand, ix, rowid):
+        row = { "id": rowid }
+        if self.get_parent(ix):
+            row["parent_id"] = rand.randrange(self.rows)
+        for col in range(self.columns):
+            row[f"c{col}"] = self.make_text(rand, self.width)
+        if self.blob_bytes:
+            row["blob_key"] = f"t{ix}_{rowid}"
+            row["payload"] = rand.getrandbits(8 * self.blob_bytes).to_bytes(self.blob_bytes, "little")
+        return row
+
+    def make_rows(self, ix):
+        rand = random.Random(self.seed * 1000 + ix)
+        return [ self.make_row(rand, ix, rowid) for rowid in range(self.rows) ]
+
+    def write_tables_dir(self, dirname):
+        os.makedirs(dirname, exist_ok=True)
+        for ix, tablename in enumerate(self.get_table_names()):
+            rows = self.make_rows(ix)
+            for row in rows:
+                if "payload" in row:
+                    self.write_blob_file(dirname, row)
+            rows = [ [ (key, str(value)) for key, value in row.items() ] for row in rows ]
+            DBText.write_table_file(rows, os.path.join(dirname, tablename + ".table"))
+
+    def write_blob_file(self, dirname, row):
+        blob_file = os.path.join(dirname, Template(self.get_blob_patterns()[0]).substitute(row))
+        os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+        with open(blob_file, "wb") as f:
+            f.write(row["payload"])
+        row["payload"] = "<blob data>"
+
+    def write_mongo_data_dir(self, dirname, dbname="synthetic"):
+        dbdir = os.path.join(dirname, dbname)
+        os.makedirs(dbdir, exist_ok=True)
+        for ix, tablename in enumerate(self.get_table_names()):
+            docs = [ { "_id": row.pop("id"), **row } for row in self.make_rows(ix) ]
+            for doc in docs:
+                if "payload" in doc:
+                    doc["payload"] = doc["payload"].hex()
+            with open(os.path.join(dbdir, tablename + ".json"), "w") as f:
+                json.dump(docs, f, indent=2)
+
+    def make_change_statements(self, fraction=0.1):
+        """
+        SQL that updates, deletes and inserts about "fraction" of each table's rows,
+        so that there are some changes to dump
+        """
+        step = max(int(1 / fraction), 2)
+        statements = []
+        for ix, tablename in enumerate(self.get_table_names()):
+            # Leaf tables only for deletes, so that foreign keys stay valid
+            is_parent = ix + 1 < self.tables and self.get_parent(ix + 1) == tablename
+            statements.append(f"UPDATE {tablename} SET c0 = 'changed' WHERE id % {step} = 1")
+            if not is_parent:
+                statements.append(f"DELETE FROM {tablename} WHERE id % {step} = 2")
+            new_ids = range(self.rows, self.rows + max(self.rows // step, 1))
+            colnames = self.get_column_names(ix)
+            for rowid in new_ids:
+                values = [ str(rowid) ] + [ { "parent_id": "0", "payload": "NULL" }.get(col, "'new'") for col in colnames[1:] ]
+                statements.append(f"INSERT INTO {tablename} ({', '.join(colnames)}) VALUES ({', '.join(values)})")
+        return statements
+
+    def make_mongo_changes(self, fraction=0.1):
+        """
+        Returns (collection name, updated ids, deleted ids, new documents) for each collection
+        """
+        step = max(int(1 / fraction), 2)
+        changes = []
+        for ix, tablename in enumerate(self.get_table_names()):
+            ids = range(self.rows)
+            new_docs = [ { "_id": rowid, "c0": "new" } for rowid in range(self.rows, self.rows + max(self.rows // step, 1)) ]
+            changes.append((tablename, [ i for i in ids if i % step == 1 ], [ i for i in ids if i % step == 2 ], new_docs))
+        return changes
+
+
+def add_fixture_arguments(parser):
+    parser.add_argument("--tables", type=int, default=5, help="number of tables (collections for MongoDB)")
+    parser.add_argument("--rows", type=int, default=1000, help="rows per table")
+    parser.add_argument("--columns", type=int, default=5, help="text columns per table")
+    parser.add_argument("--width", type=int, default=20, help="characters per text column")
+    parser.add_argument("--blob-bytes", type=int, default=0, help="size of a binary payload column, 0 for none")
+    parser.add_argument("--fk-depth", type=int, default=2, help="length of the foreign key chains between tables, 0 for none")
+    parser.add_argument("--seed", type=int, default=1)
+
+def make_fixture(args):
+    return SyntheticFixture(args.tables, args.rows, args.columns, args.width, args.blob_bytes, args.fk_depth, args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic schema, tables dir and MongoDB data dir")
+    parser.add_argument("target_dir")
+    add_fixture_arguments(parser)
+    args = parser.parse_args()
+    fixture = make_fixture(args)
+    os.makedirs(args.target_dir, exist_ok=True)
+    fixture.write_schema(os.path.join(args.target_dir, "schema.sql"))
+    fixture.write_tables_dir(os.path.join(args.target_dir, "benchdb_tables"))
+    fixture.write_mongo_data_dir(os.path.join(args.target_dir, "mongodata"))
+
+if __name__ == "__main__":
+    main()
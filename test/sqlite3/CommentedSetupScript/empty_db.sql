@@ -0,0 +1,17 @@
+-- The same schema as empty_db.sql, in batches that end with comments
+CREATE TABLE wildlife
+(
+    internalId INTEGER PRIMARY KEY AUTOINCREMENT,
+    name       VARCHAR(100),
+    type       VARCHAR(16)
+) -- what can be observed
+GO
+
+CREATE TABLE observations
+(
+    internalId INTEGER PRIMARY KEY AUTOINCREMENT,
+    date       DATE,
+    wildlifeId INT,
+    FOREIGN KEY (wildlifeId) REFERENCES wildlife (internalId)
+); -- one row per sighting
+GO
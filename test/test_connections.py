@@ -0,0 +1,102 @@
+'''
+Reusing connections to the test database with ConnectionPool, with stand-in connections and against Sqlite3
+'''
+
+import os, tempfile, unittest
+from dbtext import Sqlite3_DBText
+from dbtext.connections import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def check(self):
+        if not self.healthy:
+            raise ConnectionError("server has gone away")
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        cxn = FakeConnection()
+        self.opened.append(cxn)
+        return cxn
+
+    def test_reuses_idle_connections(self):
+        pool = ConnectionPool(self.connect)
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_keeps_at_most_size(self):
+        pool = ConnectionPool(self.connect, size=2)
+        cxns = [ pool.acquire() for _ in range(3) ]
+        for cxn in cxns:
+            pool.release(cxn)
+        self.assertEqual([ cxn.closed for cxn in cxns ], [ False, False, True ])
+        pool.close()
+        self.assertTrue(all(cxn.closed for cxn in cxns))
+        self.assertNotIn(pool.acquire(), cxns)
+
+    def test_checks_connections_idle_for_long(self):
+        pool = ConnectionPool(self.connect, check_after=0.0, check_connection=FakeConnection.check)
+        cxn = pool.acquire()
+        pool.release(cxn)
+        self.assertIs(pool.acquire(), cxn)
+        cxn.healthy = False
+        pool.release(cxn)
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, cxn)
+        self.assertTrue(cxn.closed)
+
+    def test_no_check_when_recently_used(self):
+        pool = ConnectionPool(self.connect, check_after=30.0, check_connection=FakeConnection.check)
+        cxn = pool.acquire()
+        cxn.healthy = False
+        pool.release(cxn)
+        self.assertIs(pool.acquire(), cxn)
+
+
+class DatabaseConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+        self.db = Sqlite3_DBText("pooled")
+        self.db.create()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_reused_between_calls(self):
+        with self.db.database_connection() as first:
+            first.execute("CREATE TABLE birds (id INTEGER)")
+        with self.db.database_connection() as second:
+            self.assertIs(second, first)
+            self.assertEqual(second.execute("SELECT COUNT(*) FROM birds").fetchone()[0], 0)
+        self.db.drop()
+        self.assertEqual(self.db.connection_pool.idle, [])
+
+    def test_not_reused_after_an_error(self):
+        with self.assertRaises(ValueError):
+            with self.db.database_connection() as first:
+                first.execute("CREATE TABLE birds (id INTEGER)")
+                first.execute("INSERT INTO birds VALUES (1)")
+                raise ValueError("failed half way")
+        with self.db.database_connection() as second:
+            self.assertIsNot(second, first)
+            self.assertEqual(second.execute("SELECT COUNT(*) FROM birds").fetchone()[0], 0) # rolled back
+        self.db.drop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+'''
+Writing subsets of the data with write_data_subset, with and without keyed subqueries, against Sqlite3
+'''
+
+import os, tempfile, unittest
+from dbtext import Sqlite3_DBText
+
+schema = """
+CREATE TABLE customer (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customer, note TEXT);
+CREATE TABLE log (customer_id INTEGER, msg TEXT);
+INSERT INTO customer VALUES (1, 'ann'), (2, 'bob');
+INSERT INTO orders VALUES (1, 1, 'first'), (2, 1, 'second'), (3, 2, 'third');
+INSERT INTO log VALUES (1, 'joined'), (1, 'ordered'), (2, 'joined');
+"""
+
+
+class QueryRecordingSqlite3_DBText(Sqlite3_DBText):
+    def extract_data_for_dump(self, ttcxn, tablespec, constraint="", params=()):
+        self.queried.append(tablespec)
+        return Sqlite3_DBText.extract_data_for_dump(self, ttcxn, tablespec, constraint, params)
+
+
+class DataSubsetTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+        with open("schema.sql", "w") as f:
+            f.write(schema)
+        self.db = QueryRecordingSqlite3_DBText("subset")
+        self.db.create(sqlfile="schema.sql")
+
+    def tearDown(self):
+        self.db.drop()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def write_subset(self, writeDir, subset_data, **kw):
+        self.db.queried = []
+        self.db.write_data_subset(writeDir, subset_data, **kw)
+        tables_dir = os.path.join(writeDir, "subsetdb_tables")
+        contents = {}
+        for fn in sorted(os.listdir(tables_dir)):
+            with open(os.path.join(tables_dir, fn)) as f:
+                contents[fn] = f.read()
+        return contents
+
+    def test_join(self):
+        subset_data = [ ("orders,customer", "WHERE orders.customer_id = customer.id AND customer.id = 1") ]
+        contents = self.write_subset("joined", subset_data)
+        self.assertEqual(self.db.queried, [ "orders,customer" ])
+        # ann appears once, although both of her orders are in the join
+        self.assertEqual(contents, { "customer.table": "ROW:0\n   id: 1\n   name: ann\n",
+                                     "orders.table": "ROW:0\n   customer_id: 1\n   id: 1\n   note: first\n" +
+                                                     "ROW:1\n   customer_id: 1\n   id: 2\n   note: second\n" })
+        keyed_contents = self.write_subset("keyed", subset_data, keyed_subqueries=True)
+        self.assertEqual(self.db.queried, [ "orders", "customer" ])
+        self.assertEqual(keyed_contents, contents)
+
+    def test_rows_from_several_tablespecs(self):
+        subset_data = [ ("customer", "WHERE id = 1"), ("orders,customer", "WHERE orders.customer_id = customer.id") ]
+        for keyed_subqueries in [ False, True ]:
+            contents = self.write_subset(f"out{keyed_subqueries}", subset_data, keyed_subqueries=keyed_subqueries)
+            self.assertEqual(contents["customer.table"], "ROW:0\n   id: 1\n   name: ann\nROW:1\n   id: 2\n   name: bob\n")
+            self.assertEqual(contents["orders.table"].count("ROW:"), 3)
+
+    def test_table_without_primary_key(self):
+        subset_data = [ ("log,customer", "WHERE log.customer_id = customer.id AND customer.id = 1") ]
+        contents = self.write_subset("joined", subset_data)
+        keyed_contents = self.write_subset("keyed", subset_data, keyed_subqueries=True)
+        self.assertEqual(self.db.queried, [ "log,customer" ]) # fetched with the join instead
+        self.assertEqual(keyed_contents, contents)
+        self.assertEqual(contents["log.table"], "ROW:0\n   customer_id: 1\n   msg: joined\nROW:1\n   customer_id: 1\n   msg: ordered\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
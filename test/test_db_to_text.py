@@ -0,0 +1,120 @@
+'''
+The pandas and Arrow bridge in db_to_text: its writers must give the same files as DBText's own, and its readers
+must give the rows back with the types of the schema
+'''
+
+import os, tempfile, unittest
+from datetime import datetime
+from dbtext import Sqlite3_DBText, db_to_text
+try:
+    import pandas as pd
+    import pyarrow as pa
+except ModuleNotFoundError:
+    pd = None
+
+schema = """
+CREATE TABLE birds (id INTEGER PRIMARY KEY, name TEXT, weight REAL, seen DATETIME, ringed BOOLEAN);
+"""
+
+rows = [ (1, "robin", 0.5, datetime(2024, 5, 1, 10, 0, 0, 250000), True),
+         (2, None, None, None, None),
+         (3, "rouge-gorge é", 2.25, datetime(2024, 5, 2), False) ]
+
+# .table files are written as cp1252 but read with the default encoding, so these only use ASCII
+ascii_rows = [ row[:1] + ("robin redbreast",) + row[2:] if ix == 2 else row for ix, row in enumerate(rows) ]
+
+colinfo = [ ("id", "int"), ("name", "varchar"), ("weight", "float"), ("seen", "datetime"), ("ringed", "bit") ]
+
+
+def read_bytes(fn):
+    with open(fn, "rb") as f:
+        return f.read()
+
+
+@unittest.skipIf(pd is None, "pandas and pyarrow are not installed")
+class DBToTextTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+        self.db = Sqlite3_DBText("bridge")
+
+    def tearDown(self):
+        self.db.drop()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def make_dataframe(self):
+        return pd.DataFrame({ "id": pd.Series([ 1, 2, 3 ]),
+                              "name": pd.Series([ "robin", None, "rouge-gorge é" ]),
+                              "weight": pd.Series([ 0.5, None, 2.25 ]),
+                              "seen": pd.to_datetime([ row[3] for row in rows ]),
+                              "ringed": pd.Series([ True, None, False ], dtype="boolean") })
+
+    def test_table_format_as_dbtext(self):
+        self.db.write_tableformat_dump(rows, colinfo, "dbtext.table", [], False)
+        db_to_text.write_tableformat_dump(self.make_dataframe(), "bridge.table", colinfo)
+        self.assertEqual(read_bytes("bridge.table"), read_bytes("dbtext.table"))
+
+    def test_table_format_in_chunks(self):
+        # the row numbers carry on from one chunk to the next
+        self.db.write_tableformat_dump(rows, colinfo, "dbtext.table", [], False)
+        chunk_rows = db_to_text.write_chunk_rows
+        db_to_text.write_chunk_rows = 2
+        try:
+            db_to_text.write_tableformat_dump(self.make_dataframe(), "bridge.table", colinfo)
+        finally:
+            db_to_text.write_chunk_rows = chunk_rows
+        self.assertEqual(read_bytes("bridge.table"), read_bytes("dbtext.table"))
+
+    def test_json_as_dbtext(self):
+        self.db.write_json_dump(rows, colinfo, "dbtext.json")
+        db_to_text.write_json_dump(self.make_dataframe(), "bridge.json")
+        self.assertEqual(read_bytes("bridge.json"), read_bytes("dbtext.json"))
+
+    def test_json_nested_values(self):
+        nested = [ (1, [ 1, 2 ]), (2, { "a": None }) ]
+        self.db.write_json_dump(nested, [ ("id", "int"), ("data", "json") ], "dbtext.json")
+        db_to_text.write_json_dump(pd.DataFrame({ "id": [ 1, 2 ], "data": [ [ 1, 2 ], { "a": None } ] }), "bridge.json")
+        self.assertEqual(read_bytes("bridge.json"), read_bytes("dbtext.json"))
+
+    def write_tables_dir(self):
+        os.makedirs("tables")
+        self.db.write_tableformat_dump(ascii_rows, colinfo, os.path.join("tables", "birds.table"), [], False)
+        self.db.write_json_dump(ascii_rows, colinfo, os.path.join("tables", "sightings.json"))
+
+    def test_read_as_text(self):
+        self.write_tables_dir()
+        dataframes = db_to_text.read_tables_dir_as_dataframes("tables")
+        self.assertEqual(sorted(dataframes), [ "birds", "sightings" ])
+        birds = dataframes["birds"]
+        self.assertEqual(list(birds.columns), [ "id", "name", "weight", "seen", "ringed" ])
+        self.assertEqual(birds["id"].tolist(), [ "1", "2", "3" ])
+        self.assertEqual(birds["name"].isna().tolist(), [ False, True, False ])
+        self.assertEqual(birds["name"][2], "robin redbreast")
+        self.assertEqual(dataframes["sightings"]["id"].tolist(), [ 1, 2, 3 ])
+
+    def test_read_with_schema_types(self):
+        self.write_tables_dir()
+        with open("schema.sql", "w") as f:
+            f.write(schema.replace("birds", "sightings") + schema)
+        self.db.create(sqlfile="schema.sql", tables_dir="empty")
+        for dataframes in [ db_to_text.read_tables_dir_as_dataframes("tables", self.db),
+                            { name: table.to_pandas() for name, table in db_to_text.read_tables_dir_as_arrow("tables", self.db).items() } ]:
+            for birds in dataframes.values():
+                self.assertEqual(birds["id"].tolist(), [ 1, 2, 3 ])
+                self.assertEqual(birds["weight"].isna().tolist(), [ False, True, False ])
+                self.assertEqual(birds["weight"][2], 2.25)
+                self.assertEqual(birds["ringed"].isna().tolist(), [ False, True, False ])
+                self.assertEqual([ bool(birds["ringed"][0]), bool(birds["ringed"][2]) ], [ True, False ])
+                self.assertEqual(birds["seen"][2], pd.Timestamp("2024-05-02"))
+
+    def test_arrow_as_text(self):
+        self.write_tables_dir()
+        tables = db_to_text.read_tables_dir_as_arrow("tables")
+        self.assertEqual(tables["birds"].column("id").type, pa.string())
+        self.assertEqual(tables["birds"].column("name").to_pylist(), [ "robin", None, "robin redbreast" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
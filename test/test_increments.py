@@ -0,0 +1,91 @@
+'''
+Reducing table files to increments with IncrementConverter, in this process and in worker processes
+'''
+
+import os, tempfile, unittest
+from dbtext import DBText
+from dbtext.increments import IncrementConverter
+
+orig_files = {
+    "birds.table": "ROW:0\n   id: 1\n   name: robin\n",
+    "same.table": "ROW:0\n   id: 1\n",
+    "reordered.table": "ROW:0\n   id: 1\nROW:1\n   id: 2\n",
+    "changed.table": "ROW:0\n   id: 1\n   name: robin\n"
+}
+
+new_files = {
+    "birds.table": "ROW:0\n   id: 1\n   name: robin\nROW:1\n   id: 2\n   name: wren\n",
+    "same.table": "ROW:0\n   id: 1\n",
+    "reordered.table": "ROW:0\n   id: 2\nROW:1\n   id: 1\n",
+    "changed.table": "ROW:0\n   id: 1\n   name: wren\n",
+    "new.table": "ROW:0\n   id: 1\n"
+}
+
+
+def write_files(dirName, files):
+    os.makedirs(dirName)
+    for fn, text in files.items():
+        with open(os.path.join(dirName, fn), "w") as f:
+            f.write(text)
+
+def read_files(dirName):
+    files = {}
+    for fn in sorted(os.listdir(dirName)):
+        with open(os.path.join(dirName, fn)) as f:
+            files[fn] = f.read()
+    return files
+
+def parse_table_file(fn):
+    return DBText.parse_table_file(fn)
+
+
+class WorkerPidConverter(IncrementConverter):
+    # Says which process compared each file
+    def compare_table_files(self, origFile, newFile):
+        return IncrementConverter.compare_table_files(self, origFile, newFile) + (os.getpid(),)
+
+
+class IncrementConverterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.origDir = os.path.join(self.tmpdir.name, "orig")
+        write_files(self.origDir, orig_files)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def convert(self, name, converter):
+        fullDir = os.path.join(self.tmpdir.name, name)
+        write_files(fullDir, new_files)
+        converter.convert_to_increment(fullDir, self.origDir)
+        self.assertEqual(read_files(fullDir + "_prereduce"), dict(sorted(new_files.items())))
+        return read_files(fullDir)
+
+    def test_in_this_process(self):
+        files = self.convert("serial", IncrementConverter(parse_table_file))
+        self.assertEqual(files, { "birds.table": "ROW:+\n   id: 2\n   name: wren\n",
+                                  "changed.table": new_files["changed.table"],
+                                  "new.table": new_files["new.table"] })
+
+    def test_in_worker_processes(self):
+        serial = self.convert("serial", IncrementConverter(parse_table_file))
+        self.assertEqual(self.convert("parallel", IncrementConverter(parse_table_file, processes=3)), serial)
+        self.assertEqual(self.convert("classmethod", IncrementConverter(DBText.parse_table_file, processes=3)), serial)
+
+    def test_compared_outside_this_process(self):
+        newDir = os.path.join(self.tmpdir.name, "new")
+        write_files(newDir, new_files)
+        toCompare = [ (os.path.join(self.origDir, fn), os.path.join(newDir, fn)) for fn in orig_files ]
+        results = WorkerPidConverter(parse_table_file, processes=2).compare_all_table_files(toCompare)
+        self.assertEqual([ result[0] for result in results ], [ newFile for _, newFile in toCompare ])
+        self.assertNotIn(os.getpid(), [ result[-1] for result in results ])
+
+    def test_not_picklable(self):
+        serial = self.convert("serial", IncrementConverter(parse_table_file))
+        converter = IncrementConverter(lambda fn: DBText.parse_table_file(fn), processes=3)
+        with self.assertLogs("dbtext", "WARNING"):
+            self.assertEqual(self.convert("fallback", converter), serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+'''
+LocalMongo_DBText's ephemeral profile, with a stand-in for mongod that doesn't accept the ephemeral tuning options
+'''
+
+import os, sys, tempfile, unittest
+from dbtext.mongodb import LocalMongo_DBText
+try:
+    import pymongo
+except ModuleNotFoundError:
+    pymongo = None
+
+fake_mongod = """
+import json, sys, time
+with open(sys.argv[0] + ".calls", "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+if "--wiredTigerCollectionBlockCompressor" in sys.argv:
+    print("Error parsing command line: unrecognised option '--wiredTigerCollectionBlockCompressor'", flush=True)
+    sys.exit(2)
+print(json.dumps({ "msg": "Waiting for connections", "attr": { "port": 27999 } }), flush=True)
+time.sleep(60)
+"""
+
+
+@unittest.skipIf(pymongo is None, "pymongo is not installed")
+class EphemeralProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mongod = os.path.join(self.tmpdir.name, "mongod")
+        with open(self.mongod, "w") as f:
+            f.write("#!" + sys.executable + "\n" + fake_mongod)
+        os.chmod(self.mongod, 0o755)
+
+        class FakeLocalMongo_DBText(LocalMongo_DBText):
+            mongo_exe = self.mongod
+            ephemeralDirs = [ self.tmpdir.name ]
+        self.db = FakeLocalMongo_DBText(db_dirname=os.path.join(self.tmpdir.name, "mongo"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def get_calls(self):
+        with open(self.mongod + ".calls") as f:
+            return f.read().splitlines()
+
+    def test_restarts_without_tuning_options(self):
+        self.db.start_mongo(False, None, False, ephemeral=True)
+        dbdir = self.db.ephemeral_dbdir
+        self.assertEqual(os.path.dirname(dbdir), self.tmpdir.name)
+        self.db.text_client = self.db.make_text_client()
+        self.assertEqual(self.db.port, 27999)
+        first, second = self.get_calls()
+        self.assertIn("--wiredTigerCollectionBlockCompressor none", first)
+        self.assertEqual(second, f"--port 0 --dbpath {dbdir} --quiet --wiredTigerCacheSizeGB 0.25")
+        self.db.drop()
+        self.assertFalse(os.path.exists(dbdir))
+
+    def test_without_ephemeral(self):
+        self.db.start_mongo(False, None, False)
+        self.db.text_client = self.db.make_text_client()
+        self.assertEqual(self.get_calls(), [ f"--port 0 --dbpath {self.db.dbdir} --quiet" ])
+        self.db.drop()
+
+
+if __name__ == "__main__":
+    unittest.main()
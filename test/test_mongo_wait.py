@@ -0,0 +1,92 @@
+'''
+Mongo_DBText.wait_for_collections_empty, with stand-ins for the text client and change stream so that no mongod is needed
+'''
+
+import time, unittest
+from dbtext.mongodb import Mongo_DBText
+try:
+    from pymongo.errors import OperationFailure
+except ModuleNotFoundError:
+    OperationFailure = None
+
+
+class FakeChangeStream:
+    # Each call to try_next removes a document, as if another process had deleted it
+    def __init__(self, client, events=True, error_after=None):
+        self.client = client
+        self.events = events
+        self.error_after = error_after
+        self.alive = True
+        self.closed = False
+        self.calls = 0
+
+    def try_next(self):
+        self.calls += 1
+        if self.error_after is not None and self.calls > self.error_after:
+            raise OperationFailure("change stream lost its resume point")
+        time.sleep(0.001)
+        if self.events:
+            self.client.documents = max(self.client.documents - 1, 0)
+            return { "operationType": "delete" }
+
+    def close(self):
+        self.alive = False
+        self.closed = True
+
+
+class FakeTextClient:
+    def __init__(self, documents, stream_args=None):
+        self.documents = documents
+        self.stream = FakeChangeStream(self, **stream_args) if stream_args is not None else None
+        self.polls = 0
+
+    def watch_for_removals(self, collectionName):
+        return self.stream
+
+    def get_collections_named(self, collectionName):
+        return [ collectionName ]
+
+    def has_documents(self, collections):
+        return self.documents > 0
+
+    def has_collection(self, collectionName):
+        # the polling fallback: each poll also sees a document go
+        self.polls += 1
+        self.documents = max(self.documents - 1, 0)
+        return self.documents > 0
+
+
+@unittest.skipIf(OperationFailure is None, "pymongo is not installed")
+class WaitForCollectionsEmptyTest(unittest.TestCase):
+    def wait(self, text_client, maxTime=5):
+        db = Mongo_DBText()
+        db.text_client = text_client
+        return db.wait_for_collections_empty("queue", maxTime)
+
+    def test_change_stream(self):
+        text_client = FakeTextClient(3, {})
+        self.assertTrue(self.wait(text_client))
+        self.assertEqual((text_client.stream.calls, text_client.polls), (3, 0))
+        self.assertTrue(text_client.stream.closed)
+
+    def test_polls_without_change_streams(self):
+        text_client = FakeTextClient(3)
+        self.assertTrue(self.wait(text_client, maxTime=0.1))
+        self.assertEqual(text_client.polls, 3)
+
+    def test_polls_when_the_stream_fails(self):
+        text_client = FakeTextClient(5, { "error_after": 2 })
+        self.assertTrue(self.wait(text_client, maxTime=0.1))
+        self.assertEqual((text_client.stream.calls, text_client.polls), (3, 3))
+        self.assertTrue(text_client.stream.closed)
+
+    def test_timeout(self):
+        text_client = FakeTextClient(1, { "events": False })
+        start = time.monotonic()
+        self.assertFalse(self.wait(text_client, maxTime=0.2))
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(text_client.polls, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Checks of the SQL and parameters dbtext sends when setting up and inserting into MSSQL, which need neither pyodbc nor a server
+'''
+
+import unittest
+from decimal import Decimal
+from dbtext.mssql_server import MSSQL_DBText, SQL_WVARCHAR, SQL_VARBINARY
+
+
+class MakeInsertSqlTest(unittest.TestCase):
+    def test_insert(self):
+        sql = MSSQL_DBText.make_insert_sql("[birds]", [ "[id]", "[name]" ])
+        self.assertEqual(sql, "INSERT INTO [birds] ([id], [name]) VALUES (?,?)")
+
+    def test_identity_insert(self):
+        sql = MSSQL_DBText.make_insert_sql("[birds]", [ "[id]" ], identity_insert=True)
+        self.assertEqual(sql, "SET IDENTITY_INSERT [birds] ON; INSERT INTO [birds] ([id]) VALUES (?); SET IDENTITY_INSERT [birds] OFF")
+
+
+class InputSizeTest(unittest.TestCase):
+    def test_text(self):
+        self.assertEqual(MSSQL_DBText.get_input_size("nvarchar", 100), (SQL_WVARCHAR, 50, 0))
+        self.assertEqual(MSSQL_DBText.get_input_size("nchar", 20), (SQL_WVARCHAR, 10, 0))
+        self.assertEqual(MSSQL_DBText.get_input_size("varchar", 30), (SQL_WVARCHAR, 30, 0))
+        self.assertEqual(MSSQL_DBText.get_input_size("nvarchar", -1), (SQL_WVARCHAR, 0, 0))
+        self.assertEqual(MSSQL_DBText.get_input_size("ntext", 16), (SQL_WVARCHAR, 0, 0))
+
+    def test_binary(self):
+        self.assertEqual(MSSQL_DBText.get_input_size("varbinary", 16), (SQL_VARBINARY, 16, 0))
+        self.assertEqual(MSSQL_DBText.get_input_size("varbinary", -1), (SQL_VARBINARY, 0, 0))
+        self.assertEqual(MSSQL_DBText.get_input_size("image", 16), (SQL_VARBINARY, 0, 0))
+
+    def test_converted_by_server(self):
+        self.assertEqual(MSSQL_DBText.get_input_size("datetimeoffset", 10), (SQL_WVARCHAR, 34, 0))
+        for type_name in [ "int", "decimal", "float", "datetime2", "bit" ]:
+            self.assertEqual(MSSQL_DBText.get_input_size(type_name, 8), (SQL_WVARCHAR, 64, 0))
+
+    def test_unknown_column(self):
+        column_metadata = { "id": ("int", 4, True) }
+        sizes = MSSQL_DBText.make_input_sizes(column_metadata, [ "id", "extra" ])
+        self.assertEqual(sizes, [ (SQL_WVARCHAR, 64, 0), (SQL_WVARCHAR, 0, 0) ])
+        self.assertTrue(MSSQL_DBText.has_identity_column(column_metadata, [ "extra", "id" ]))
+        self.assertFalse(MSSQL_DBText.has_identity_column(column_metadata, [ "extra" ]))
+
+
+class InputValueTest(unittest.TestCase):
+    def test_unchanged(self):
+        for value in [ None, b"\x00\x01", bytearray(b"\x02") ]:
+            self.assertIs(MSSQL_DBText.to_input_value(value, "varbinary"), value)
+
+    def test_text(self):
+        self.assertEqual(MSSQL_DBText.to_input_value("abc", "nvarchar"), "abc")
+        self.assertEqual(MSSQL_DBText.to_input_value(42, "int"), "42")
+        self.assertEqual(MSSQL_DBText.to_input_value(True, "bit"), "1")
+        self.assertEqual(MSSQL_DBText.to_input_value(False, "bit"), "0")
+
+    def test_numbers_for_exact_columns(self):
+        # nvarchar can't be converted to decimal from exponent notation
+        self.assertEqual(MSSQL_DBText.to_input_value(1e-05, "decimal"), "0.00001")
+        self.assertEqual(MSSQL_DBText.to_input_value(1e+16, "bigint"), "10000000000000000")
+        self.assertEqual(MSSQL_DBText.to_input_value(-2.5e-07, "numeric"), "-0.00000025")
+        self.assertEqual(MSSQL_DBText.to_input_value(0.1, "money"), "0.1")
+        self.assertEqual(MSSQL_DBText.to_input_value(Decimal("1E+2"), "decimal"), "100")
+
+    def test_numbers_for_float_columns(self):
+        self.assertEqual(MSSQL_DBText.to_input_value(1e-05, "float"), "1e-05")
+        self.assertEqual(MSSQL_DBText.to_input_value(1e+300, "float"), "1e+300")
+        self.assertEqual(MSSQL_DBText.to_input_value(5e-324, "real"), "5e-324")
+        self.assertEqual(MSSQL_DBText.to_input_value(1e-05, None), "1e-05")
+
+    def test_row_converter(self):
+        column_metadata = { "id": ("int", 4, True), "weight": ("decimal", 9, False), "wingspan": ("float", 8, False) }
+        convert = MSSQL_DBText.make_row_converter(column_metadata, [ "id", "weight", "wingspan", "extra" ])
+        self.assertEqual(convert((1, 1e-05, 1e-05, 1e-05)), ("1", "0.00001", "1e-05", "1e-05"))
+
+
+class SetupBatchTest(unittest.TestCase):
+    def test_combinable(self):
+        db = MSSQL_DBText.__new__(MSSQL_DBText)
+        self.assertTrue(db.is_combinable_batch("CREATE TABLE birds (id INT)"))
+        self.assertTrue(db.is_combinable_batch("insert into birds VALUES (1)"))
+        self.assertFalse(db.is_combinable_batch("CREATE PROCEDURE count_birds AS SELECT COUNT(*) FROM birds"))
+        self.assertFalse(db.is_combinable_batch("INSERT INTO birds VALUES (@id)"))
+        # the script's own session options must not be overridden by those around a combined group
+        self.assertFalse(db.is_combinable_batch("INSERT INTO birds VALUES (1);\nSET NOCOUNT ON"))
+        self.assertFalse(db.is_combinable_batch("CREATE TABLE birds (id INT); set xact_abort off"))
+
+    def test_restore_options(self):
+        self.assertEqual(MSSQL_DBText.make_restore_options_sql(0), "SET NOCOUNT OFF; SET XACT_ABORT OFF;")
+        self.assertEqual(MSSQL_DBText.make_restore_options_sql(512 | 5496), "SET XACT_ABORT OFF;")
+        self.assertEqual(MSSQL_DBText.make_restore_options_sql(16384), "SET NOCOUNT OFF; ")
+        self.assertEqual(MSSQL_DBText.make_restore_options_sql(16384 | 512), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+DBTextPool, with a stand-in for a DBText class so that no database server is needed
+'''
+
+import os, time, unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from dbtext import DBTextPool
+
+
+class FakeDBText:
+    # Records what the pool does. Fails if two threads use the master's connection at once, as pyodbc would not allow it
+    existing = []
+    dropped = []
+    lock = Lock()
+    in_use = False
+    def __init__(self, database=None, **kw):
+        self.database_name = database
+
+    def use_connection(self):
+        with self.lock:
+            if FakeDBText.in_use:
+                raise AssertionError("master connection used by two threads at once")
+            FakeDBText.in_use = True
+        time.sleep(0.005)
+        FakeDBText.in_use = False
+
+    def create(self, *args, **kw):
+        pass
+
+    def close_connections(self):
+        pass
+
+    def get_database_names(self):
+        self.use_connection()
+        return list(self.existing)
+
+    def drop_database(self, dbname):
+        self.use_connection()
+        self.dropped.append(dbname)
+
+
+class DBTextPoolTest(unittest.TestCase):
+    def setUp(self):
+        FakeDBText.existing = []
+        FakeDBText.dropped = []
+
+    def test_discard_from_several_threads(self):
+        with DBTextPool(FakeDBText, size=2, stale_after=None) as pool:
+            dbs = [ pool.acquire(timeout=5) for _ in range(8) ]
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(pool.discard, dbs))
+        self.assertEqual(sorted(FakeDBText.dropped[:8]), sorted(db.database_name for db in dbs))
+        self.assertEqual(len(FakeDBText.dropped), 10) # the ones still waiting in the pool too
+
+    def test_drop_stale_databases(self):
+        now = int(time.time())
+        FakeDBText.existing = [ f"db_pool1_{now - 7200}_1", # left by another process two hours ago
+                                f"db_pool1_{now - 60}_2", # another process that may still be running
+                                f"db_pool{os.getpid()}_{now - 7200}_3", # our own
+                                f"other_db_pool1_{now - 7200}_4", f"db_pool1_{now - 7200}_5_copy", "master" ]
+        pool = DBTextPool(FakeDBText, stale_after=3600)
+        pool.drop_stale_databases()
+        self.assertEqual(FakeDBText.dropped, [ f"db_pool1_{now - 7200}_1" ])
+
+    def test_drop_stale_databases_with_prefix(self):
+        now = int(time.time())
+        FakeDBText.existing = [ f"birdsdb_pool1_{now - 7200}_1", f"db_pool1_{now - 7200}_2" ]
+        DBTextPool(FakeDBText, name_prefix="birds", stale_after=3600).drop_stale_databases()
+        DBTextPool(FakeDBText, name_prefix="birds", stale_after=None).drop_stale_databases()
+        self.assertEqual(FakeDBText.dropped, [ f"birdsdb_pool1_{now - 7200}_1" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
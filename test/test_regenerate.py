@@ -0,0 +1,61 @@
+'''
+Regenerating test directories' tables dirs with FixtureRegenerator, against Sqlite3
+'''
+
+import os, tempfile, unittest
+from dbtext import Sqlite3_DBText
+from dbtext.regenerate import FixtureRegenerator
+
+
+def write_file(fn, text):
+    os.makedirs(os.path.dirname(fn) or ".", exist_ok=True)
+    with open(fn, "w") as f:
+        f.write(text)
+
+def read_file(fn):
+    with open(fn) as f:
+        return f.read()
+
+
+class RegenerateTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+        write_file("schema.sql", "CREATE TABLE birds (id INTEGER PRIMARY KEY, name TEXT);\nCREATE TABLE log (msg TEXT);\n")
+        write_file("base/db_tables/birds.table", "ROW:0\n   id: 1\n   name: robin\nROW:1\n   id: 2\n   name: wren\n")
+        write_file("base/db_tables/log.table", "ROW:0\n   msg: started\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def regenerate(self, *test_dirs):
+        regenerator = FixtureRegenerator(Sqlite3_DBText, "schema.sql", "base/db_tables", workers=2)
+        return regenerator.regenerate(list(test_dirs))
+
+    def test_full_table_files_replace_base_data(self):
+        # wren removed and a new bird with a key the base data already has, which must not clash
+        write_file("test/db_tables/birds.table", "ROW:0\n   id: 1\n   name: robin\nROW:1\n   id: 3\n   name: owl\n")
+        # no primary key, so the base row must not be loaded twice
+        write_file("test/db_tables/log.table", "ROW:0\n   msg: started\nROW:1\n   msg: stopped\n")
+        [ result ] = self.regenerate("test")
+        self.assertEqual(result, ("test", [], [], [ "log.table" ]))
+        self.assertEqual(read_file("test/db_tables/birds.table"), "ROW:0\n   id: 1\n   name: robin\nROW:1\n   id: 3\n   name: owl\n")
+        self.assertEqual(read_file("test/db_tables/log.table"), "ROW:+\n   msg: stopped\n")
+
+    def test_increment_files_add_to_base_data(self):
+        write_file("test/db_tables/birds.table", "ROW:+\n   id: 3\n   name: owl\n")
+        write_file("test/db_tables/log.table", "ROW:+\n   msg: stopped\n")
+        [ result ] = self.regenerate("test")
+        self.assertEqual(result, ("test", [], [], []))
+
+    def test_unchanged_test_dirs(self):
+        write_file("same/db_tables/log.table", "ROW:0\n   msg: started\n")
+        write_file("empty/readme.txt", "no tables dir")
+        results = self.regenerate("same", "empty")
+        self.assertEqual(results, [ ("same", [], [ "log.table" ], []), ("empty", [], [], []) ])
+
+
+if __name__ == "__main__":
+    unittest.main()
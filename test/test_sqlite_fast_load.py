@@ -0,0 +1,78 @@
+'''
+Loading a tables dir into Sqlite3 with fast_load, compared with a normal load
+'''
+
+import os, sqlite3, tempfile, unittest
+from dbtext import Sqlite3_DBText
+
+
+def write_file(fn, text):
+    os.makedirs(os.path.dirname(fn) or ".", exist_ok=True)
+    with open(fn, "w") as f:
+        f.write(text)
+
+
+class RecordingSqlite3_DBText(Sqlite3_DBText):
+    # Records the connection's settings while the table files are loaded
+    def read_table_files(self, ttcxn, *args):
+        self.load_settings = tuple(ttcxn.execute(f"PRAGMA {name}").fetchone()[0] for name in [ "journal_mode", "synchronous", "defer_foreign_keys" ])
+        self.load_in_transaction = ttcxn.in_transaction
+        return Sqlite3_DBText.read_table_files(self, ttcxn, *args)
+
+
+class FastLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+        write_file("schema.sql", "CREATE TABLE birds (id INTEGER PRIMARY KEY, name TEXT);\n" +
+                   "CREATE TABLE sightings (bird_id INTEGER REFERENCES birds(id), place TEXT);\n")
+        write_file("tables/birds.table", "ROW:0\n   id: 1\n   name: robin\nROW:1\n   id: 2\n   name: wren\n")
+        write_file("tables/sightings.table", "ROW:0\n   bird_id: 2\n   place: garden\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def read_rows(self, dbname):
+        cnxn = sqlite3.connect(dbname + ".db")
+        try:
+            return { table: cnxn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall() for table in [ "birds", "sightings" ] }
+        finally:
+            cnxn.close()
+
+    def create(self, dbname, **kw):
+        db = RecordingSqlite3_DBText(dbname, **kw)
+        db.create(sqlfile="schema.sql", tables_dir="tables")
+        return db
+
+    def test_same_data_as_normal_load(self):
+        self.create("normal").drop()
+        self.create("fast", fast_load=True).drop()
+        self.assertEqual(self.read_rows("fast"), self.read_rows("normal"))
+        self.assertEqual(self.read_rows("fast")["birds"], [ (1, "robin"), (2, "wren") ])
+
+    def test_settings(self):
+        db = self.create("normal")
+        self.assertEqual(db.load_settings, ("delete", 2, 0))
+        db.drop()
+        db = self.create("fast", fast_load=True)
+        self.assertEqual(db.load_settings, ("memory", 0, 1))
+        self.assertTrue(db.load_in_transaction)
+        with db.database_connection() as ttcxn:
+            self.assertEqual(ttcxn.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+            self.assertEqual(ttcxn.execute("PRAGMA synchronous").fetchone()[0], 2) # FULL, the default
+            self.assertFalse(ttcxn.in_transaction)
+        db.drop()
+
+    def test_failed_load_rolled_back(self):
+        write_file("tables/sightings.table", "ROW:0\n   bird_id: 2\n   colour: brown\n")
+        db = Sqlite3_DBText("fast", fast_load=True)
+        with self.assertRaises(Exception):
+            db.create(sqlfile="schema.sql", tables_dir="tables")
+        db.drop()
+        self.assertEqual(self.read_rows("fast"), { "birds": [], "sightings": [] })
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+'''
+DBText.drop_stale_databases, with the server's list of databases stubbed out
+'''
+
+import unittest
+from dbtext import DBText
+
+
+class StubDBText(DBText):
+    # Only the database listing and dropping are stubbed, the filtering is DBText's own
+    def __init__(self, database_ages, database=None):
+        super().__init__(database, master_connection=object())
+        self.database_ages = database_ages
+        self.dropped = []
+
+    def get_database_ages(self):
+        return dict(self.database_ages)
+
+    def drop_database(self, dbname):
+        if dbname == "db_broken":
+            raise RuntimeError("in use")
+        self.dropped.append(dbname)
+
+
+class DropStaleDatabasesTest(unittest.TestCase):
+    def setUp(self):
+        self.ages = { "db_old": 7200, "db_new": 60, "db_unknown": None, "other_old": 7200, "master": 7200, "db_broken": 7200 }
+
+    def test_max_age_required(self):
+        with self.assertRaises(TypeError):
+            StubDBText(self.ages).drop_stale_databases("db_*")
+
+    def test_drops_old_matching_databases(self):
+        db = StubDBText(self.ages)
+        dropped = db.drop_stale_databases("db_*", max_age=3600)
+        self.assertEqual(dropped, [ ("db_old", 7200) ])
+        self.assertEqual(db.dropped, [ "db_old" ])
+
+    def test_pattern(self):
+        db = StubDBText(self.ages)
+        self.assertEqual(db.drop_stale_databases("*_old", max_age=3600), [ ("db_old", 7200), ("other_old", 7200) ])
+
+    def test_never_drops_own_or_master_database(self):
+        db = StubDBText(self.ages, database="db_old")
+        # nor those of unknown age, and those that fail to drop aren't reported as dropped
+        self.assertEqual(db.drop_stale_databases("*", max_age=0), [ ("db_new", 60), ("other_old", 7200) ])
+
+    def test_dry_run(self):
+        db = StubDBText(self.ages)
+        self.assertEqual(db.drop_stale_databases("db_*", max_age=30, dry_run=True), [ ("db_broken", 7200), ("db_new", 60), ("db_old", 7200) ])
+        self.assertEqual(db.dropped, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
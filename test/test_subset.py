@@ -0,0 +1,81 @@
+'''
+Extracting referentially complete subsets with SubsetExtractor, against Sqlite3
+'''
+
+import os, tempfile, unittest
+from dbtext import Sqlite3_DBText
+
+schema = """
+CREATE TABLE customer (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE product (a INTEGER, b INTEGER, title TEXT, PRIMARY KEY (a, b));
+CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customer, note TEXT);
+CREATE TABLE line (id INTEGER PRIMARY KEY, order_id INTEGER REFERENCES orders(id), pa INTEGER, pb INTEGER,
+                   FOREIGN KEY (pa, pb) REFERENCES product (a, b));
+INSERT INTO customer VALUES (1, 'ann'), (2, 'bob');
+INSERT INTO product VALUES (1, 1, 'seed'), (1, 2, 'nut'), (2, 1, 'suet');
+INSERT INTO orders VALUES (1, 1, 'first'), (2, 1, 'second'), (3, 2, 'third'), (4, 2, 'fourth');
+INSERT INTO line VALUES (1, 1, 1, 1), (2, 1, 1, 2), (3, 2, 2, 1), (4, 3, 1, 1), (5, 4, 1, 2);
+"""
+
+
+class SubsetTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+        with open("schema.sql", "w") as f:
+            f.write(schema)
+        self.db = Sqlite3_DBText("subset")
+        self.db.create(sqlfile="schema.sql")
+
+    def tearDown(self):
+        self.db.drop()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def extract(self, writeDir, roots, **kw):
+        row_counts = self.db.extract_subset(writeDir, roots, **kw)
+        tables_dir = os.path.join(writeDir, "subsetdb_tables")
+        contents = {}
+        for fn in sorted(os.listdir(tables_dir)):
+            with open(os.path.join(tables_dir, fn)) as f:
+                contents[fn] = f.read()
+        return row_counts, contents
+
+    def get_ids(self, text):
+        return [ int(line.split(":")[1]) for line in text.splitlines() if line.startswith("   id:") ]
+
+    def test_parents_without_their_children(self):
+        row_counts, contents = self.extract("out", [ ("line", "WHERE id = 4") ])
+        self.assertEqual(row_counts, { "line": 1, "orders": 1, "customer": 1, "product": 1 })
+        self.assertEqual(self.get_ids(contents["orders.table"]), [ 3 ]) # not order 4 of the same customer
+        self.assertEqual(self.get_ids(contents["customer.table"]), [ 2 ])
+        self.assertIn("   a: 1\n   b: 1\n", contents["product.table"])
+
+    def test_children_up_to_depth(self):
+        # one key per query, so composite keys are batched too
+        row_counts, contents = self.extract("out", [ ("customer", "WHERE id = 1") ], max_child_depth=2, batch_size=1)
+        self.assertEqual(row_counts, { "customer": 1, "orders": 2, "line": 3, "product": 3 })
+        self.assertEqual(self.get_ids(contents["line.table"]), [ 1, 2, 3 ])
+        row_counts, _ = self.extract("out1", [ ("customer", "WHERE id = 1") ])
+        self.assertEqual(row_counts, { "customer": 1, "orders": 2 })
+
+    def test_max_child_rows(self):
+        row_counts, _ = self.extract("out", [ ("customer", "WHERE id = 1") ], max_child_rows=1)
+        self.assertEqual(row_counts, { "customer": 1, "orders": 1 })
+
+    def test_rows_fetched_as_parents_still_bring_children(self):
+        # customer 1 and order 1 are first fetched as parents of line 1, the customer root must still bring in their children
+        roots = [ ("line", "WHERE id = 1"), ("customer", "WHERE id = 1") ]
+        row_counts, contents = self.extract("out1", roots, max_child_depth=2)
+        self.assertEqual(self.get_ids(contents["line.table"]), [ 1, 2, 3 ])
+        self.assertEqual(self.get_ids(contents["orders.table"]), [ 1, 2 ])
+        reversed_counts, reversed_contents = self.extract("out2", list(reversed(roots)), max_child_depth=2)
+        self.assertEqual(reversed_counts, row_counts)
+        self.assertEqual(set(reversed_contents), set(contents))
+        for fn, text in contents.items():
+            self.assertEqual(sorted(self.get_ids(reversed_contents[fn])), sorted(self.get_ids(text)), fn)
+
+
+if __name__ == "__main__":
+    unittest.main()
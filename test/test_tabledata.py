@@ -0,0 +1,97 @@
+'''
+TableData, the compact representation of parsed and extracted table rows, which must behave like the list of dicts it replaced
+'''
+
+import os, tempfile, unittest
+from dbtext import Sqlite3_DBText
+from dbtext.tabledata import TableData, Row, SparseRow, MISSING
+
+
+class TableDataTest(unittest.TestCase):
+    def test_rows_like_dicts(self):
+        dicts = [ { "id": 1, "name": "robin" }, { "name": "wren", "id": 2 } ]
+        table = TableData.from_dicts(dicts)
+        self.assertEqual(table.columns, ("id", "name"))
+        self.assertEqual(table.rows, [ (1, "robin"), (2, "wren") ])
+        self.assertFalse(table.sparse)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(list(table), dicts)
+        self.assertEqual(table[1]["name"], "wren")
+        self.assertIsInstance(table[0], Row)
+        self.assertEqual(table.to_dicts(), [ { "id": 1, "name": "robin" }, { "id": 2, "name": "wren" } ])
+        self.assertEqual(repr(table[0]), "{'id': 1, 'name': 'robin'}")
+        self.assertEqual(repr(table), "TableData(('id', 'name'), 2 rows)")
+
+    def test_rows_compare_with_each_other(self):
+        table = TableData([ "id" ], [ (1,), (1,), (2,) ])
+        self.assertEqual(table[0], table[1])
+        self.assertNotEqual(table[0], table[2])
+        self.assertEqual(table[0], TableData([ "id" ], [ (1,) ])[0])
+        self.assertNotEqual(table[0], { "id": 1, "name": None })
+
+    def test_sparse_rows(self):
+        dicts = [ { "id": 1 }, { "id": 2, "name": "wren" }, { "size": 3, "id": 3 } ]
+        table = TableData.from_dicts(dicts)
+        self.assertTrue(table.sparse)
+        self.assertEqual(table.columns, ("id", "name", "size"))
+        self.assertEqual(table.rows[0], (1, MISSING, MISSING))
+        self.assertIsInstance(table[0], SparseRow)
+        # rows have only the columns they were made from
+        self.assertEqual(list(table), dicts)
+        self.assertEqual(table.to_dicts(), dicts)
+        self.assertNotIn("name", table[0])
+        self.assertEqual(len(table[0]), 1)
+        with self.assertRaises(KeyError):
+            table[0]["name"]
+        self.assertEqual(table[0].get("name", "none"), "none")
+        self.assertEqual(table[2].values(), (3, 3))
+        self.assertEqual(table.get_value_tuples(), [ (1, None, None), (2, "wren", None), (3, None, 3) ])
+        self.assertEqual(table.column("name"), [ None, "wren", None ])
+
+    def test_slices(self):
+        table = TableData.from_dicts([ { "id": 1 }, { "id": 2, "name": "wren" } ])
+        part = table[1:]
+        self.assertIsInstance(part, TableData)
+        self.assertTrue(part.sparse)
+        self.assertEqual(list(part), [ { "id": 2, "name": "wren" } ])
+
+    def test_dense_value_tuples_not_copied(self):
+        table = TableData([ "id", "name" ])
+        table.append([ 1, "robin" ])
+        self.assertIs(table.get_value_tuples(), table.rows)
+
+
+class ParseTableFileTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def write_table_file(self, text):
+        fn = os.path.join("tables", "birds.table")
+        os.makedirs("tables", exist_ok=True)
+        with open(fn, "w") as f:
+            f.write(text)
+        return fn
+
+    def test_same_rows_as_dicts(self):
+        db = Sqlite3_DBText("parse")
+        fn = self.write_table_file("ROW:0\n   id: 1\n   name: robin\nROW:1\n   id: 2\n   name: wren\n   size: 3\n")
+        table = db.parse_table_file_to_table_data(fn, ("id",))
+        self.assertIsInstance(table, TableData)
+        self.assertEqual(table.columns, ("id", "name", "size"))
+        self.assertEqual(list(table), db.parse_table_file_to_rowdicts(fn, ("id",)))
+        self.assertEqual(table.to_dicts(), [ { "id": "1", "name": "robin" }, { "id": "2", "name": "wren", "size": "3" } ])
+
+    def test_empty_file(self):
+        db = Sqlite3_DBText("parse")
+        table = db.parse_table_file_to_table_data(self.write_table_file(""), ("id",))
+        self.assertEqual(len(table), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+'''
+Reading, saving and loading the table watermarks that dumptables compares against, against Sqlite3
+'''
+
+import os, tempfile, unittest
+from unittest.mock import patch
+from dbtext import Sqlite3_DBText
+from dbtext.instrument import Instrumentation
+
+schema = """
+CREATE TABLE birds (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE sightings (id INTEGER PRIMARY KEY, seen TEXT);
+CREATE TABLE empty (id INTEGER PRIMARY KEY);
+INSERT INTO birds VALUES (1, 'robin'), (12, 'wren');
+INSERT INTO sightings VALUES (1, '2024-05-01 10:00:00'), (2, '2024-05-03 08:30:00');
+"""
+
+
+class WatermarkTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name) # Sqlite3 databases are created in the working directory
+        with open("schema.sql", "w") as f:
+            f.write(schema)
+        self.instrumentation = Instrumentation()
+        self.db = Sqlite3_DBText("watermarks", instrumentation=self.instrumentation)
+        self.db.create(sqlfile="schema.sql")
+        self.instrumentation.counters.clear()
+
+    def tearDown(self):
+        self.db.drop()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def readmax(self, dumptables):
+        with patch.dict(os.environ, { "TEXTTEST_DUMPTABLES": dumptables }):
+            self.db.readmax()
+        return self.db.maxval
+
+    def test_one_query(self):
+        maxval = self.readmax("birds:id:0,sightings:seen:2000-01-01,empty:id:-1")
+        self.assertEqual(maxval, { "birds": "12", "sightings": "2024-05-03 08:30:00", "empty": "-1" })
+        self.assertEqual(self.instrumentation.counters["round_trips"], 1)
+
+    def test_table_by_table_when_one_fails(self):
+        with self.assertLogs("dbtext", "WARNING") as logs:
+            maxval = self.readmax("birds:id:0,missing:id:5,empty:id:-1")
+        self.assertEqual(maxval, { "birds": "12", "missing": "5", "empty": "-1" })
+        self.assertEqual(self.instrumentation.counters["round_trips"], 4)
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("Could not read watermark id for table missing", logs.output[1])
+
+    def test_no_dumptables(self):
+        with patch.dict(os.environ):
+            os.environ.pop("TEXTTEST_DUMPTABLES", None)
+            self.db.readmax()
+        self.assertEqual(self.db.maxval, {})
+        self.assertNotIn("round_trips", self.instrumentation.counters)
+
+    def test_save_and_load(self):
+        self.readmax("birds:id:0,empty:id:-1")
+        self.db.save_watermarks("watermarks.json")
+        other = Sqlite3_DBText("watermarks")
+        other.maxval["sightings"] = "3"
+        other.load_watermarks("watermarks.json")
+        self.assertEqual(other.maxval, { "birds": "12", "empty": "-1", "sightings": "3" })
+        self.assertEqual(other.startrv, self.db.startrv)
+
+
+if __name__ == "__main__":
+    unittest.main()